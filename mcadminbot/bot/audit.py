@@ -0,0 +1,216 @@
+"""
+bot/audit.py - An append-only record of the admin actions taken through the bot.
+
+Entries are kept in a SQLite database in WAL mode, indexed by actor, target player,
+command and time. record only appends to an in-memory batch; batches are written
+by a single worker thread that owns the database connection, so the event loop
+never waits on disk I/O.
+"""
+
+import asyncio
+import concurrent.futures
+import sqlite3
+import time
+from typing import List, NamedTuple, Optional
+
+from loguru import logger
+
+from . import servers
+from . import statefiles
+
+# Qualified names of the commands that change a server and are recorded
+AUDITED_COMMANDS = frozenset([
+    'whitelist add', 'whitelist remove', 'whitelist on', 'whitelist off', 'whitelist reload',
+    'whitelist import', 'ban', 'ban import', 'ban-ip', 'kick', 'pardon', 'pardon-ip',
+    'op', 'deop',
+])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS audit (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    actor_id INTEGER NOT NULL,
+    actor TEXT NOT NULL,
+    server TEXT NOT NULL,
+    command TEXT NOT NULL,
+    target TEXT,
+    detail TEXT,
+    outcome TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS audit_actor ON audit (actor_id, time);
+CREATE INDEX IF NOT EXISTS audit_target ON audit (target COLLATE NOCASE, time);
+CREATE INDEX IF NOT EXISTS audit_command ON audit (command, time);
+CREATE INDEX IF NOT EXISTS audit_time ON audit (time);
+"""
+
+_COLUMNS = 'time, actor_id, actor, server, command, target, detail, outcome'
+
+
+class AuditEntry(NamedTuple):
+    """One admin action."""
+
+    time: float
+    actor_id: int
+    actor: str
+    server: str
+    command: str
+    target: Optional[str]
+    detail: Optional[str]
+    outcome: str
+
+    def format(self) -> str:
+        """
+        Returns:
+            The entry as one line of a Discord message.
+        """
+        when = time.strftime('%Y-%m-%d %H:%M', time.gmtime(self.time))
+        detail = f" ({self.detail})" if self.detail else ''
+        return (f"{when} UTC [{self.server}] {self.actor}: {self.command} "
+                f"{self.target or ''}{detail} - {self.outcome}")
+
+
+def entry_from_context(ctx) -> AuditEntry:
+    """
+    Builds an audit entry from the parsed arguments of a finished command.
+
+    Args:
+        ctx: The context of a command in AUDITED_COMMANDS, after it was invoked.
+
+    Returns:
+        The entry describing who did what to whom, and whether the command raised an
+        error ('error'), did not reach a server ('failed'), was rejected by the server
+        ('rejected') or ran ('sent').
+    """
+    # ctx.args holds the cog and context, then each parameter in order
+    arguments = dict(zip(ctx.command.clean_params, ctx.args[2:]))
+    target = arguments.get('username') or arguments.get('ip_address') or arguments.get('path')
+    if target is None and ctx.message.attachments:
+        target = ctx.message.attachments[0].filename
+    return AuditEntry(
+        time=time.time(),
+        actor_id=ctx.author.id,
+        actor=str(ctx.author),
+        server=arguments.get('target') or servers.get_server().name,
+        command=ctx.command.qualified_name,
+        target=target,
+        detail=arguments.get('reason'),
+        outcome='error' if ctx.command_failed else getattr(ctx, 'rcon_outcome', None) or 'sent')
+
+
+def entry_from_command(actor, server: str, command: str, detail: str,
+                       outcome: str) -> Optional[AuditEntry]:
+    """
+    Builds an audit entry for an RCON command run on a user's behalf, such as a
+    step of a macro.
+
+    Args:
+        actor: The Discord user or member that ran it.
+        server: The name of the server it ran on.
+        command: The RCON command, such as 'ban Griefer Griefing'.
+        detail: What ran the command.
+        outcome: 'sent', 'rejected' or 'failed'.
+
+    Returns:
+        The entry, or None if the command is not in AUDITED_COMMANDS.
+    """
+    words = command.split()
+    for length in (2, 1):
+        name = ' '.join(words[:length])
+        if len(words) >= length and name in AUDITED_COMMANDS:
+            return AuditEntry(
+                time=time.time(),
+                actor_id=actor.id,
+                actor=str(actor),
+                server=server,
+                command=name,
+                target=words[length] if len(words) > length else None,
+                detail=detail,
+                outcome=outcome)
+    return None
+
+
+class AuditLog:
+    """Batches audit entries into a SQLite database from a dedicated worker thread."""
+
+    def __init__(self, path: str, batch_interval: float = 1.0):
+        """
+        Instantiates an audit log. The database is opened by the worker thread on first use.
+
+        Args:
+            path: The path of the SQLite database file, which is created readable only
+                by this user.
+            batch_interval: Seconds between writes of the pending entries.
+        """
+        self.path = path
+        self.batch_interval = batch_interval
+        self.pending = []
+        self._connection = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def record(self, entry: AuditEntry) -> None:
+        """Queues an entry to be written with the next batch."""
+        self.pending.append(entry)
+
+    async def run(self) -> None:
+        """Writes the pending entries every batch_interval seconds until cancelled."""
+        while True:
+            await asyncio.sleep(self.batch_interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Writes the pending entries now."""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        try:
+            await self._in_worker(self._write, batch)
+        except (sqlite3.Error, OSError) as error:
+            logger.error(f"Could not write {len(batch)} audit entries to [{self.path}]: {error}")
+
+    async def query(self, player: str, limit: int = 20) -> List[AuditEntry]:
+        """
+        Finds the latest actions taken on a player, including any not yet written.
+
+        Args:
+            player: The player name or IP address, matched case-insensitively.
+            limit: The most entries to return.
+
+        Returns:
+            The matching entries, newest first.
+        """
+        await self.flush()
+        return await self._in_worker(self._select, player, limit)
+
+    async def close(self) -> None:
+        """Writes the pending entries and closes the database."""
+        await self.flush()
+        await self._in_worker(self._close)
+        self._executor.shutdown(wait=True)
+
+    def _in_worker(self, function, *args):
+        return asyncio.get_event_loop().run_in_executor(self._executor, function, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(str(statefiles.secure(self.path)))
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def _write(self, batch: List[AuditEntry]) -> None:
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                f"INSERT INTO audit ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+
+    def _select(self, player: str, limit: int) -> List[AuditEntry]:
+        rows = self._connect().execute(
+            f"SELECT {_COLUMNS} FROM audit WHERE target = ? COLLATE NOCASE "
+            'ORDER BY time DESC LIMIT ?', (player, limit))
+        return [AuditEntry(*row) for row in rows]
+
+    def _close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -2,16 +2,85 @@
 bot/bot.py - The core module of Mcadminbot.
 
 run_bot instantiates an instance of Mcadminbot and runs the bot.
+
+The config is reloaded in place, without reconnecting to Discord, when the process
+receives SIGHUP or when a watched config file changes on disk.
 """
 
+import asyncio
+import collections
+import os
+import signal
+import time
+from typing import Callable, List
+
 import discord
 from discord.ext import commands
 from loguru import logger
 
 import mcadminbot.config as config
+from . import audit
+from . import breaker
 from . import exceptions
+from . import handoff
+from . import jobs
+from . import logstream
+from . import logtail
+from . import macros
+from . import metrics
 from . import minecraftcommands
+from . import players
+from . import servers
+from . import slash
 from . import systemcommands
+from . import utils
+
+# The least number of seconds between two changes of the bot's activity
+PRESENCE_UPDATE_INTERVAL = 15
+
+def gateway_options() -> dict:
+    """
+    Builds the options that limit what the bot receives from and caches about Discord.
+
+    Commands only need message events, and the roles that permission_check reads
+    arrive with each message's author, so members and presences are neither
+    requested nor cached by default and guilds are not chunked at startup.
+
+    Returns:
+        Keyword arguments for discord.Client.
+
+    Raises:
+        McadminbotConfigError: 'discord_intents' or 'member_cache' names an
+            unknown flag, or they do not fit together.
+    """
+    intents = _flags(discord.Intents, 'discord_intents')
+    member_cache = _flags(discord.MemberCacheFlags, 'member_cache')
+    if member_cache.online and not intents.presences:
+        raise exceptions.McadminbotConfigError(
+            "'member_cache' can only include 'online' when 'discord_intents' includes 'presences'.")
+    if member_cache.joined and not intents.members:
+        raise exceptions.McadminbotConfigError(
+            "'member_cache' can only include 'joined' when 'discord_intents' includes 'members'.")
+    if member_cache.voice and not intents.voice_states:
+        raise exceptions.McadminbotConfigError(
+            "'member_cache' can only include 'voice' when 'discord_intents' includes "
+            "'voice_states'.")
+    return {
+        'intents': intents,
+        'member_cache_flags': member_cache,
+        'max_messages': config.CONFIG['message_cache_size'] or None,
+        'chunk_guilds_at_startup': False,
+    }
+
+def _flags(flag_class, key: str):
+    flags = flag_class.none()
+    for name in config.CONFIG[key]:
+        if name not in flag_class.VALID_FLAGS:
+            raise exceptions.McadminbotConfigError(
+                f"Unknown flag [{name}] in '{key}', expected one of "
+                f"{', '.join(sorted(flag_class.VALID_FLAGS))}.")
+        setattr(flags, name, True)
+    return flags
 
 class McadminbotHelp(commands.help.DefaultHelpCommand):
     """
@@ -26,53 +95,457 @@ class McadminbotHelp(commands.help.DefaultHelpCommand):
         """
         super().__init__(verify_checks=False)
 
+class McadminbotContext(commands.Context):
+    """A subclass of discord.ext.commands.Context that times replies sent to Discord."""
+
+    async def send(self, *args, **kwargs):
+        """
+        Overrides discord.ext.commands.Context.send.
+
+        Records the time spent sending under the 'discord_send' stage.
+        """
+        with metrics.STAGE_SECONDS.time(stage='discord_send'):
+            return await super().send(*args, **kwargs)
+
 class Mcadminbot(commands.Bot):
     """A subclass of discord.ext.commands.Bot that is the core bot."""
 
-    def __init__(self):
+    def __init__(self, predecessor: int = None, on_takeover: Callable[[], None] = None,
+                 **options):
         """
         Instantiates an instance of Mcadminbot.
 
-        Loads any accompanying cogs.
+        Loads the configured Minecraft servers and any accompanying cogs.
+
+        Args:
+            predecessor: The PID of a running bot to take over from once this one
+                is connected and ready. Message commands received until then are
+                buffered.
+            on_takeover: Called once the predecessor has exited.
+            options: Passed on to discord.ext.commands.Bot.
 
         Raises:
-            McadminbotConfigError: A command prefix was not specified.
+            McadminbotConfigError: A command prefix was not specified
+                or the configured servers are invalid.
         """
         try:
             super().__init__(
                 command_prefix=config.CONFIG['command_prefix'],
-                help_command=McadminbotHelp()
+                help_command=McadminbotHelp(),
+                **dict(gateway_options(), **options)
                 )
         except KeyError as error:
             raise exceptions.McadminbotConfigError(
                 "'command_prefix' not specified in the config.") from error
 
-        self.add_cog(minecraftcommands.MinecraftCommands(self))
-        self.add_cog(systemcommands.SystemCommands(self))
+        servers.load_servers()
+
+        # With shards split across processes, only the process running shard 0
+        # streams the server logs and announces outages, so each happens once
+        self.primary = 0 in (options.get('shard_ids') or [0])
+
+        # The audit database is opened once; changing its path needs a restart
+        self.audit = None
+        self._audit_task = None
+        if config.CONFIG['audit_database']:
+            self.audit = audit.AuditLog(
+                config.CONFIG['audit_database'], config.CONFIG['audit_batch_interval'])
+            self._audit_task = self.loop.create_task(self.audit.run())
+
+        if self.primary:
+            breaker.add_listener(self._announce_server_state)
+        logtail.add_listener(self._track_log_event)
+        players.add_listener(self._player_changed)
+
+        self.jobs = jobs.Jobs(self)
+        command_cogs = [minecraftcommands.MinecraftCommands(self),
+                        systemcommands.SystemCommands(self),
+                        self.jobs,
+                        macros.Macros(self)]
+        for cog in command_cogs:
+            self.add_cog(cog)
+        # Interactions arrive on the shard of their guild, so every process handles them
+        if config.CONFIG['slash_commands']:
+            self.add_cog(slash.SlashCommands(self, command_cogs))
+        if self.primary:
+            self.add_cog(logstream.LogStream(self))
+
+        try:
+            self.loop.add_signal_handler(
+                signal.SIGHUP, lambda: self.loop.create_task(self.reload_config()))
+        except (AttributeError, NotImplementedError):
+            logger.warning('SIGHUP is not supported here; config reload by signal is disabled')
+        self.loop.create_task(self._watch_config())
+
+        self.loop.create_task(self._poll_players())
+        self._presence_pending = False
+        self._activity_name = None
+
+        # Commands being run, which a graceful shutdown waits for
+        self.stopping = False
+        self._in_flight = 0
+        self._drained = None
+
+        # The IDs of accepted commands, which a successor must not run again
+        self.handing_off = False
+        self._handled = collections.deque(maxlen=handoff.HANDLED_HISTORY)
+        self.standby = handoff.Standby(predecessor) if predecessor else None
+        self._on_takeover = on_takeover
+        self._taking_over = False
+
+        # A successor binds the metrics port once its predecessor has released it
+        self._metrics_server = None
+        if config.CONFIG['metrics_port'] and self.standby is None:
+            self.loop.create_task(self._start_metrics_server())
+
+    async def get_context(self, message, *, cls=None):
+        """
+        Overrides the discord.ext.commands.Bot get_context method.
+
+        Builds a McadminbotContext and records the time spent matching the
+        prefix and command under the 'parse' stage.
+        """
+        with metrics.STAGE_SECONDS.time(stage='parse'):
+            return await super().get_context(message, cls=cls or McadminbotContext)
+
+    async def invoke(self, ctx) -> None:
+        """
+        Overrides the discord.ext.commands.Bot invoke method.
+
+        Records the duration and outcome of every command that was found.
+        """
+        if ctx.command is None:
+            await super().invoke(ctx)
+            return
+        if self.stopping:
+            # While handing off, the successor runs the messages this bot turns away,
+            # but only this bot can still answer an interaction
+            if not self.handing_off or isinstance(ctx, slash.SlashContext):
+                await ctx.send(handoff.RESTARTING_MESSAGE)
+            return
+
+        self._handled.append(ctx.message.id)
+        self._in_flight += 1
+        start = time.perf_counter()
+        try:
+            await super().invoke(ctx)
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight and self._drained is not None and not self._drained.done():
+                self._drained.set_result(None)
+        name = ctx.command.qualified_name
+        metrics.COMMAND_SECONDS.observe(time.perf_counter() - start, command=name)
+        metrics.COMMANDS_TOTAL.inc(
+            command=name, outcome='error' if ctx.command_failed else 'success')
+
+    async def process_commands(self, message) -> None:
+        """
+        Overrides the discord.ext.commands.Bot process_commands method.
+
+        Buffers the message while this bot is standing by to take over.
+        """
+        if self.standby is not None:
+            self.standby.buffer(message.id, self.process_commands, message)
+            return
+        await super().process_commands(message)
+
+    async def start(self, *args, **kwargs) -> None:
+        """
+        Overrides the discord.Client start method.
+
+        Replaces the SIGTERM and SIGINT handlers installed by discord.Client.run,
+        which stop the event loop at once, with a graceful shutdown, and hands off
+        to a successor on handoff.HANDOFF_SIGNAL.
+        """
+        handlers = {signal.SIGTERM: self.shutdown, signal.SIGINT: self.shutdown,
+                    handoff.HANDOFF_SIGNAL: self.hand_off}
+        for signo, handler in handlers.items():
+            try:
+                self.loop.add_signal_handler(
+                    signo, lambda handler=handler: self.loop.create_task(handler()))
+            except (AttributeError, NotImplementedError):
+                pass
+        await super().start(*args, **kwargs)
+
+    async def hand_off(self) -> None:
+        """
+        Stops gracefully for a successor that is already connected.
+
+        Commands received from now on are left to the successor, and the IDs of
+        those accepted are written to handoff.HANDOFF_PATH for it.
+        """
+        logger.info('Handing off to a new mcadminbot process')
+        self.handing_off = True
+        await self.shutdown()
+
+    async def shutdown(self) -> None:
+        """
+        Stops the bot gracefully.
+
+        New commands are turned away, commands that are already running are given
+        up to 'shutdown_timeout' seconds to finish, and then the bot closes.
+        """
+        if self.stopping:
+            return
+        self.stopping = True
+        if self._in_flight:
+            logger.info(f"Waiting for {self._in_flight} running command(s) before stopping")
+            self._drained = self.loop.create_future()
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(self._drained), config.CONFIG['shutdown_timeout'])
+            except asyncio.TimeoutError:
+                logger.warning(f"Stopping with {self._in_flight} command(s) still running")
+        if self.handing_off:
+            handoff.write_handled(self._handled)
+        logger.info('mcadminbot is stopping')
+        await self.close()
+
+    async def _take_over(self) -> None:
+        """
+        Warms the RCON connections, has the predecessor hand off, then runs the
+        buffered commands that it did not accept.
+        """
+        standby = self.standby
+        # rcon_command reports failures in its response, which is not needed here
+        await asyncio.gather(*(utils.rcon_command('list', server.name)
+                               for server in servers.all_servers()))
+        logger.info(f"Connected and ready, taking over from PID [{standby.predecessor}]")
+        standby.signalled = True
+        try:
+            os.kill(standby.predecessor, handoff.HANDOFF_SIGNAL)
+        except ProcessLookupError:
+            pass
+        if not await handoff.wait_for_exit(standby.predecessor, config.CONFIG['stop_timeout']):
+            logger.warning(f"PID [{standby.predecessor}] did not hand off in time, killing it")
+            try:
+                os.kill(standby.predecessor, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await handoff.wait_for_exit(standby.predecessor, config.CONFIG['shutdown_timeout'])
+
+        pending = standby.pending(handoff.read_handled())
+        self.standby = None
+        if config.CONFIG['metrics_port']:
+            await self._start_metrics_server()
+        if self._on_takeover is not None:
+            self._on_takeover()
+        logger.info(f"Took over, running {len(pending)} command(s) received during the handoff")
+        for function, args in pending:
+            self.loop.create_task(function(*args))
+
+    async def _announce_server_state(self, server_name: str, state: str, message: str) -> None:
+        """Posts circuit breaker outages and recoveries to 'status_channel', if configured."""
+        channel_id = config.CONFIG['status_channel']
+        if not channel_id:
+            return
+        await self.wait_until_ready()
+        try:
+            channel = await utils.find_channel(self, channel_id)
+            await channel.send(message)
+        except discord.HTTPException as error:
+            logger.error(f"Could not announce that [{server_name}] is {state}: {error}")
+
+    def _track_log_event(self, server_name: str, event: logtail.LogEvent) -> None:
+        """Applies joins and leaves from a server log to that server's PlayerTracker."""
+        try:
+            servers.get_server(server_name).players.observe_event(event)
+        except exceptions.McadminbotUnknownServerError:
+            pass
+
+    def _player_changed(self, server_name: str, change: str, player: str) -> None:
+        """Logs a join or leave and schedules a presence update."""
+        logger.info(f"[{server_name}] {player} {change}")
+        self._schedule_presence_update()
+
+    def _activity(self) -> discord.Activity:
+        """
+        Returns:
+            The number of online players once any server has been polled,
+            or the default activity until then.
+        """
+        tracked = [server.players for server in servers.all_servers()
+                   if server.players.updated is not None]
+        if not tracked:
+            return discord.Activity(name='Minecraft commands', type=discord.ActivityType.listening)
+        count = sum(len(tracker.online) for tracker in tracked)
+        return discord.Activity(
+            name=f"{count} player{'' if count == 1 else 's'} online",
+            type=discord.ActivityType.watching)
+
+    def _schedule_presence_update(self) -> None:
+        if not self._presence_pending:
+            self._presence_pending = True
+            self.loop.create_task(self._update_presence())
+
+    async def _update_presence(self) -> None:
+        """
+        Updates the bot's activity if the number of online players changed.
+
+        Changes are coalesced, at most one every PRESENCE_UPDATE_INTERVAL seconds,
+        to stay well inside Discord's presence rate limit.
+        """
+        await self.wait_until_ready()
+        await asyncio.sleep(PRESENCE_UPDATE_INTERVAL)
+        self._presence_pending = False
+        activity = self._activity()
+        if activity.name != self._activity_name:
+            self._activity_name = activity.name
+            await self.change_presence(activity=activity)
+
+    async def _poll_players(self) -> None:
+        """Refreshes every server's PlayerTracker with 'list' every 'player_poll_interval'."""
+        await self.wait_until_ready()
+        while not self.is_closed():
+            interval = config.CONFIG['player_poll_interval']
+            if interval <= 0:
+                return
+            # rcon_command feeds each successful response to the server's tracker
+            await asyncio.gather(*(
+                utils.rcon_command('list', server.name) for server in servers.all_servers()
+            ))
+            self._schedule_presence_update()
+            await asyncio.sleep(interval)
+
+    async def _start_metrics_server(self) -> None:
+        try:
+            self._metrics_server = await metrics.start_server(
+                config.CONFIG['metrics_address'], config.CONFIG['metrics_port'])
+        except OSError as error:
+            logger.error(f"Could not start the metrics endpoint: {error}")
+
+    async def reload_config(self) -> bool:
+        """
+        Re-reads the config files and swaps the new config in.
+
+        Nothing changes unless the whole config parses and validates. Servers whose
+        connection settings did not change keep their open RCON connections.
+
+        Returns:
+            True if the new config was applied, False if the old one was kept.
+        """
+        try:
+            new_config = config.parse_config(config.CONFIG_PATH)
+            retired = servers.load_servers(new_config)
+        except (config.McadminbotConfigPermissionsError,
+                config.McadminbotConfigValidationError,
+                exceptions.McadminbotConfigError,
+                OSError) as error:
+            logger.error(f"Config reload failed, keeping the current config: {error}")
+            return False
+
+        if new_config['token'] != config.CONFIG['token']:
+            logger.warning('A changed Discord token only takes effect after a restart')
+        config.apply_config(new_config)
+        self.command_prefix = new_config['command_prefix']
+        if self.jobs.loaded:
+            self.jobs.sync_config()
+
+        for server in retired:
+            await server.close()
+        logger.info(f"mcadminbot config has been reloaded ({len(retired)} server(s) reconnected)")
+        return True
+
+    async def _watch_config(self) -> None:
+        """Reloads the config whenever a config file's modification time changes."""
+        def snapshot():
+            try:
+                paths = config.source_paths(config.CONFIG_PATH)
+            except FileNotFoundError:
+                return None
+            mtimes = []
+            for path in paths:
+                try:
+                    mtimes.append((path, path.stat().st_mtime_ns))
+                except OSError:
+                    mtimes.append((path, None))
+            return mtimes
+
+        last_seen = snapshot()
+        while not self.is_closed():
+            interval = config.CONFIG['config_watch_interval']
+            if interval <= 0:
+                return
+            await asyncio.sleep(interval)
+            current = snapshot()
+            if current != last_seen:
+                last_seen = current
+                logger.info('A config file changed on disk, reloading')
+                await self.reload_config()
 
     async def on_ready(self) -> None:
         """
         Overrides the discord.ext.commands.Bot on_ready method.
 
-        Logs a message on successful connection to Discord.
+        Logs a message on successful connection to Discord and shows the
+        number of online players, if known, as the bot's activity.
         """
         logger.info(f"{self.user.name} has connected to Discord!")
-        activity = discord.Activity(
-            name='Minecraft commands',
-            type=discord.ActivityType.listening
-        )
+        if self.standby is not None and not self._taking_over:
+            self._taking_over = True
+            self.loop.create_task(self._take_over())
+        activity = self._activity()
+        self._activity_name = activity.name
         await self.change_presence(activity=activity)
 
+    async def close(self) -> None:
+        """
+        Overrides the discord.ext.commands.Bot close method.
+
+        Closes pooled RCON connections and the metrics endpoint and
+        writes any pending audit entries before disconnecting from Discord.
+        """
+        breaker.remove_listener(self._announce_server_state)
+        logtail.remove_listener(self._track_log_event)
+        players.remove_listener(self._player_changed)
+        self.jobs.close()
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+        await servers.close_servers()
+        if self.audit is not None:
+            self._audit_task.cancel()
+            await self.audit.close()
+        await super().close()
+
+
+class ShardedMcadminbot(Mcadminbot, commands.AutoShardedBot):
+    """An Mcadminbot that runs several gateway shards in one process."""
 
-def run_bot() -> None:
+    def __init__(self, shard_count: int, shard_ids: List[int] = None, **options):
+        """
+        Args:
+            shard_count: The total number of shards across every process.
+            shard_ids: The shards to run in this process, or None for all of them.
+            options: Passed on to Mcadminbot.
+        """
+        super().__init__(shard_count=shard_count, shard_ids=shard_ids, **options)
+
+
+def run_bot(shard_ids: List[int] = None, before_run: Callable[[], None] = None,
+            predecessor: int = None, on_takeover: Callable[[], None] = None) -> None:
     """
     Creates and starts an instance of Mcadminbot.
 
+    With 'shard_count' set, a ShardedMcadminbot is started instead.
+
+    Args:
+        shard_ids: The shards to run in this process, or None for all of them.
+        before_run: Called once the bot is created, just before it connects to Discord.
+        predecessor: The PID of a running bot to take over from; see handoff.
+        on_takeover: Called once the predecessor has exited.
+
     Raises:
         McadminbotConfigError: An invalid Discord token was provided.
     """
-    bot = Mcadminbot()
+    if config.CONFIG['shard_count']:
+        bot = ShardedMcadminbot(config.CONFIG['shard_count'], shard_ids,
+                                predecessor=predecessor, on_takeover=on_takeover)
+        logger.info(f"Running shards {shard_ids or 'all'} of {config.CONFIG['shard_count']}")
+    else:
+        bot = Mcadminbot(predecessor=predecessor, on_takeover=on_takeover)
 
+    if before_run is not None:
+        before_run()
     try:
         bot.run(config.CONFIG['token'])
     except discord.LoginFailure as error:
@@ -0,0 +1,181 @@
+"""
+bot/breaker.py - A circuit breaker that fails fast while an RCON server is down.
+
+After 'breaker_failure_threshold' consecutive failures a server's breaker opens.
+Commands then fail immediately with the last error instead of each waiting out
+the connect timeout, while a background task probes the server with a growing
+backoff. The first successful probe closes the breaker again.
+
+Functions registered with add_listener are called on every open and close, so
+that outages and recoveries can be announced.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+from . import exceptions
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Coroutine functions called with (server name, new state, message)
+_LISTENERS = []
+
+
+def add_listener(listener: Callable[[str, str, str], Awaitable[None]]) -> None:
+    """
+    Registers a coroutine function that is called whenever any breaker opens or closes.
+
+    Args:
+        listener: Called with the server name, the new state and a human-readable message.
+    """
+    if listener not in _LISTENERS:
+        _LISTENERS.append(listener)
+
+
+def remove_listener(listener: Callable[[str, str, str], Awaitable[None]]) -> None:
+    """Unregisters a listener added with add_listener."""
+    if listener in _LISTENERS:
+        _LISTENERS.remove(listener)
+
+
+class CircuitBreaker:
+    """Tracks consecutive RCON failures for one server and fails fast while it is down."""
+
+    def __init__(self, name: str, settings: dict, probe: Callable[[], Awaitable[object]]):
+        """
+        Args:
+            name: The name of the server, used in logs and announcements.
+            settings: The config that the threshold and backoff settings are read from.
+            probe: A coroutine function that raises McadminbotRCONError while
+                the server is still unreachable.
+        """
+        self.name = name
+        self.probe = probe
+        self.state = CLOSED
+        self.failures = 0
+        self.last_error = None
+        self.opened_at = None
+        self.retry_at = None
+        self._probe_task = None
+        self._counters = {'opened': 0, 'failed_fast': 0, 'probes': 0}
+        self.configure(settings)
+
+    def configure(self, settings: dict) -> None:
+        """
+        Applies new thresholds. An open breaker stays open until its next probe succeeds.
+
+        Args:
+            settings: The config that the threshold and backoff settings are read from.
+        """
+        self.threshold = settings['breaker_failure_threshold']
+        self.backoff = settings['breaker_backoff']
+        self.max_backoff = settings['breaker_max_backoff']
+
+    def check(self) -> None:
+        """
+        Raises:
+            McadminbotCircuitOpenError: The breaker is open, so the server is
+                known to be unreachable.
+        """
+        if self.state == CLOSED:
+            return
+        self._counters['failed_fast'] += 1
+        retry_in = max(0, self.retry_at - time.monotonic())
+        raise exceptions.McadminbotCircuitOpenError(
+            f"The RCON server is unreachable ({self.last_error}); "
+            f"the next reconnection attempt is in {retry_in:.0f}s.")
+
+    async def call(self, fetch: Callable[[], Awaitable[object]]):
+        """
+        Runs fetch() unless the breaker is open, recording whether the server answered.
+
+        Args:
+            fetch: A coroutine function that talks to the server.
+
+        Returns:
+            The result of fetch().
+
+        Raises:
+            McadminbotCircuitOpenError: The breaker is open.
+            McadminbotRCONError: fetch() failed to reach the server.
+        """
+        self.check()
+        try:
+            result = await fetch()
+        except exceptions.McadminbotRCONAuthError:
+            # The server answered, so it is up even though the password is wrong
+            self.failures = 0
+            raise
+        except exceptions.McadminbotRCONError as error:
+            self.record_failure(error)
+            raise
+        self.failures = 0
+        return result
+
+    def record_failure(self, error: Exception) -> None:
+        """Counts a failure to reach the server and opens the breaker at the threshold."""
+        self.failures += 1
+        self.last_error = error
+        if self.threshold > 0 and self.failures >= self.threshold and self.state == CLOSED:
+            self._open()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            The state, consecutive failures and lifetime counters of the breaker.
+        """
+        return dict(self._counters, state=self.state, failures=self.failures)
+
+    def close(self) -> None:
+        """Stops probing, for when the server is retired."""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.retry_at = self.opened_at + self.backoff
+        self._counters['opened'] += 1
+        message = (f"[{self.name}] is unreachable after {self.failures} consecutive failures "
+                   f"({self.last_error}); failing fast until it recovers.")
+        logger.error(message)
+        self._notify(OPEN, message)
+        self._probe_task = asyncio.ensure_future(self._probe_until_closed())
+
+    async def _probe_until_closed(self) -> None:
+        delay = self.backoff
+        while True:
+            await asyncio.sleep(max(0, self.retry_at - time.monotonic()))
+            self.state = HALF_OPEN
+            self._counters['probes'] += 1
+            try:
+                await self.probe()
+            except exceptions.McadminbotRCONAuthError:
+                break
+            except exceptions.McadminbotRCONError as error:
+                self.last_error = error
+                self.state = OPEN
+                delay = min(delay * 2, self.max_backoff)
+                self.retry_at = time.monotonic() + delay
+                logger.debug(f"[{self.name}] is still unreachable, retrying in {delay}s")
+                continue
+            break
+
+        downtime = time.monotonic() - self.opened_at
+        self.state = CLOSED
+        self.failures = 0
+        self._probe_task = None
+        message = f"[{self.name}] is reachable again after {downtime:.0f}s."
+        logger.info(message)
+        self._notify(CLOSED, message)
+
+    def _notify(self, state: str, message: str) -> None:
+        for listener in _LISTENERS:
+            asyncio.ensure_future(listener(self.name, state, message))
+
@@ -0,0 +1,230 @@
+"""
+bot/bulk.py - Bulk whitelist and ban imports.
+
+Entries are read lazily from CSV or plain-text lines, checked against the server's
+current list, and sent as a windowed pipeline over a single authenticated RCON
+connection instead of one connect-login-command cycle per player.
+"""
+
+import csv
+import io
+import pathlib
+import re
+import time
+from typing import Awaitable, Callable, Iterable, Iterator, Optional, Set, TextIO, Tuple
+
+from . import exceptions
+from . import servers
+from . import utils
+
+# Minecraft Java Edition usernames
+USERNAME_REGEX = re.compile(r'^[A-Za-z0-9_]{1,16}$')
+
+# The name characters before each entry of the 'banlist' response. Entries are
+# joined without a separator, so these may begin with the end of the previous reason
+BANLIST_ENTRY_REGEX = re.compile(r'([A-Za-z0-9_]+) was banned by ')
+
+# Header cells that are skipped when they appear in the first row
+HEADER_CELLS = frozenset(['name', 'username', 'player', 'minecraft_username'])
+
+DEFAULT_BAN_REASON = 'Imported ban'
+
+
+class ImportSummary:
+    """Running totals for one bulk import."""
+
+    def __init__(self, action: str):
+        """
+        Args:
+            action: A description of the import, such as 'whitelist import'.
+        """
+        self.action = action
+        self.succeeded = 0
+        self.already_present = 0
+        self.invalid = 0
+        self.failed = []
+        self.started = time.monotonic()
+
+    @property
+    def processed(self) -> int:
+        """The number of entries handled so far."""
+        return self.succeeded + self.already_present + self.invalid + len(self.failed)
+
+    def format(self, finished: bool = False) -> str:
+        """
+        Returns:
+            A one-message summary of the import so far.
+        """
+        state = 'finished' if finished else 'in progress'
+        lines = [
+            f"{self.action} {state} after {time.monotonic() - self.started:.1f}s: "
+            f"{self.processed} entries processed",
+            f"Succeeded: {self.succeeded}",
+            f"Already present: {self.already_present}",
+            f"Invalid names: {self.invalid}",
+            f"Rejected by the server: {len(self.failed)}",
+        ]
+        lines.extend(f"  {response}" for response in self.failed[:5])
+        if len(self.failed) > 5:
+            lines.append(f"  ...and {len(self.failed) - 5} more")
+        return '\n'.join(lines)
+
+
+def read_entries(lines: Iterable[str]) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    Parses CSV or plain-text lines into import entries.
+
+    The first cell of each row is the player name and the optional second cell
+    is a ban reason. Blank rows and a leading header row are skipped.
+
+    Args:
+        lines: The lines of the file, read lazily.
+
+    Yields:
+        Tuples of (name, reason or None).
+    """
+    for index, row in enumerate(csv.reader(lines)):
+        cells = [cell.strip() for cell in row]
+        if not cells or not cells[0]:
+            continue
+        if index == 0 and cells[0].lower() in HEADER_CELLS:
+            continue
+        reason = cells[1] if len(cells) > 1 and cells[1] else None
+        yield cells[0], reason
+
+
+def parse_whitelist(response: str) -> Set[str]:
+    """
+    Args:
+        response: The response to 'whitelist list'.
+
+    Returns:
+        The lowercased names of whitelisted players.
+    """
+    _, _, names = response.partition(':')
+    return {name.strip().lower() for name in names.split(',') if name.strip()}
+
+
+def parse_banlist(response: str) -> Set[str]:
+    """
+    Args:
+        response: The response to 'banlist'.
+
+    Returns:
+        The lowercased names of banned players. A name that follows a reason ending
+        in name characters cannot be told apart from it, so every ending of up to 16
+        characters is included; a new player is only taken for a banned one if their
+        name is such an ending.
+    """
+    names = set()
+    for run in BANLIST_ENTRY_REGEX.findall(response):
+        run = run[-16:].lower()
+        names.update(run[start:] for start in range(len(run)))
+    return names
+
+
+async def run_import(server: servers.Server, entries: Iterable[Tuple[str, Optional[str]]],
+                     kind: str, window: int,
+                     progress: Callable[[ImportSummary], Awaitable[None]],
+                     progress_interval: float = 2.0, user=None) -> ImportSummary:
+    """
+    Whitelists or bans every entry over one pooled RCON connection.
+
+    Args:
+        server: The targeted server.
+        entries: Tuples of (name, reason or None), read lazily.
+        kind: 'whitelist' or 'ban'.
+        window: The maximum number of commands in flight at once.
+        progress: A coroutine function called with the summary at most once
+            every progress_interval seconds.
+        progress_interval: Seconds between progress reports.
+        user: The ID of the Discord user running the import, for rate limiting.
+
+    Returns:
+        The final summary.
+
+    Raises:
+        McadminbotRCONError: The server could not be reached, or its breaker is open.
+        McadminbotRateLimitError: The import was rate limited or the server's queue is full.
+    """
+    summary = ImportSummary(f"{kind} import on [{server.name}]")
+    list_command, success_prefix, parse = {
+        'whitelist': ('whitelist list', 'Added ', parse_whitelist),
+        'ban': ('banlist', 'Banned ', parse_banlist),
+    }[kind]
+
+    def commands(present: Set[str]) -> Iterator[str]:
+        for name, reason in entries:
+            if not USERNAME_REGEX.match(name):
+                summary.invalid += 1
+            elif name.lower() in present:
+                summary.already_present += 1
+            else:
+                present.add(name.lower())
+                if kind == 'whitelist':
+                    yield f"whitelist add {name}"
+                else:
+                    reason = ' '.join((reason or DEFAULT_BAN_REASON).split())
+                    yield f"ban {name} {reason}"
+
+    server.breaker.check()
+    last_report = time.monotonic()
+    try:
+        async with server.scheduler.slot(kind, user), server.pool.session() as client:
+            present = parse(await client.command(list_command))
+            async for _, response in client.pipeline(commands(present), window):
+                response = utils.ansi_escape(response)
+                if response.startswith(success_prefix):
+                    summary.succeeded += 1
+                else:
+                    summary.failed.append(response)
+                if time.monotonic() - last_report >= progress_interval:
+                    last_report = time.monotonic()
+                    await progress(summary)
+    except exceptions.McadminbotRCONAuthError:
+        raise
+    except exceptions.McadminbotRCONError as error:
+        server.breaker.record_failure(error)
+        raise
+    finally:
+        server.cache.invalidate(*utils.INVALIDATED_BY[kind])
+    return summary
+
+
+def open_upload(data: bytes) -> TextIO:
+    """
+    Args:
+        data: The raw bytes of an uploaded file.
+
+    Returns:
+        A text stream that decodes the file as it is read.
+    """
+    return io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', errors='replace', newline='')
+
+
+def open_local(import_directory: str, path: str) -> TextIO:
+    """
+    Opens a file on the bot's host for import.
+
+    Args:
+        import_directory: The configured directory that imports may read from.
+        path: The requested path, relative to import_directory.
+
+    Returns:
+        A text stream of the file.
+
+    Raises:
+        McadminbotImportError: Path imports are disabled, or the path is outside
+            import_directory or cannot be read.
+    """
+    if not import_directory:
+        raise exceptions.McadminbotImportError(
+            "Importing from a path is disabled; attach the file instead.")
+    root = pathlib.Path(import_directory).resolve()
+    resolved = (root / path).resolve()
+    if root != resolved and root not in resolved.parents:
+        raise exceptions.McadminbotImportError(f"[{path}] is outside the import directory.")
+    try:
+        return resolved.open('r', encoding='utf-8-sig', errors='replace', newline='')
+    except OSError as error:
+        raise exceptions.McadminbotImportError(f"[{path}] could not be opened.") from error
@@ -0,0 +1,81 @@
+"""
+bot/cache.py - A short-lived cache for the responses of read-only RCON queries.
+
+Concurrent lookups of a key that is not cached share a single in-flight fetch
+instead of each sending their own query to the server.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+
+class ResponseCache:
+    """A TTL cache with request coalescing, keyed on command text."""
+
+    def __init__(self, ttl: float):
+        """
+        Instantiates an empty cache.
+
+        Args:
+            ttl: Seconds a fetched value stays valid. 0 disables caching,
+                but concurrent lookups are still coalesced.
+        """
+        self.ttl = ttl
+        self._entries = {}
+        self._in_flight = {}
+        self._counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'invalidations': 0}
+
+    async def get(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns the cached value for key, fetching it if it is missing or expired.
+
+        Args:
+            key: The cache key.
+            fetch: A coroutine function that produces the value. Exceptions it
+                raises are passed to every waiting caller and nothing is cached.
+
+        Returns:
+            The cached or freshly fetched value.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._counters['hits'] += 1
+            return entry[1]
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self._counters['coalesced'] += 1
+            return await asyncio.shield(task)
+
+        self._counters['misses'] += 1
+        task = asyncio.ensure_future(fetch())
+        self._in_flight[key] = task
+        try:
+            value = await asyncio.shield(task)
+        finally:
+            # An invalidation while the fetch was running already dropped it
+            if self._in_flight.get(key) is task:
+                del self._in_flight[key]
+                if not task.cancelled() and task.done() and task.exception() is None:
+                    self._entries[key] = (time.monotonic() + self.ttl, task.result())
+        return value
+
+    def invalidate(self, *keys: str) -> None:
+        """
+        Drops cached values and forgets in-flight fetches for the given keys.
+
+        Args:
+            keys: The cache keys to drop.
+        """
+        for key in keys:
+            self._entries.pop(key, None)
+            self._in_flight.pop(key, None)
+            self._counters['invalidations'] += 1
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            The cache's size and lifetime counters.
+        """
+        return dict(self._counters, entries=len(self._entries))
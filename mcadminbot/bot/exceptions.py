@@ -17,3 +17,47 @@ class McadminbotCommandPermissionsError(commands.CheckFailure):
     def __init__(self, message):
         self.message = message
         super().__init__(self.message)
+
+class McadminbotUnknownServerError(commands.CommandError):
+    """Thrown when a command targets a server that is not configured."""
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+class McadminbotImportError(commands.CommandError):
+    """Thrown when a bulk import cannot read its input."""
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+class McadminbotRCONError(Exception):
+    """Thrown when communication with an RCON server fails."""
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+class McadminbotRCONAuthError(McadminbotRCONError):
+    """Thrown when an RCON server rejects the configured password."""
+
+class McadminbotRCONNotSentError(McadminbotRCONError):
+    """Thrown when a connection fails before a command was sent, so it is safe to retry."""
+
+class McadminbotRateLimitError(commands.CommandError):
+    """Thrown when a command is rate limited or its server's queue is full."""
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+class McadminbotCircuitOpenError(McadminbotRCONError):
+    """Thrown instead of contacting an RCON server that is known to be unreachable."""
+
+class McadminbotMacroError(commands.CommandError):
+    """Thrown when a macro is unknown, invalid or given the wrong arguments."""
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,219 @@
+"""
+bot/gateway.py - Shares one set of RCON pools between several shard processes.
+
+When the bot runs its shards in several processes, the supervising process
+serves its RCON pools on a Unix socket with serve, and each shard process talks
+to them through a GatewayPool instead of opening its own connections. Requests
+and responses are single JSON lines tagged with an ID, so one socket carries any
+number of concurrent commands.
+
+Shard processes find the socket through the GATEWAY_ENVIRONMENT variable. The
+socket is readable and writable only by the bot's user, and where the platform
+reports peer credentials, connections from other users are refused.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import socket
+import struct
+from typing import Dict, Optional
+
+from loguru import logger
+
+from . import exceptions
+from . import rcon
+
+GATEWAY_ENVIRONMENT = 'MCADMINBOT_RCON_GATEWAY'
+
+# The longest JSON line accepted, enough for very long responses such as a large banlist
+_LINE_LIMIT = 16 * 1024 * 1024
+
+
+def gateway_path() -> Optional[str]:
+    """
+    Returns:
+        The socket path of the supervisor's gateway if this is a shard process, else None.
+    """
+    return os.environ.get(GATEWAY_ENVIRONMENT) or None
+
+
+async def serve(path: str, get_pool) -> asyncio.AbstractServer:
+    """
+    Serves RCON commands from shard processes on a Unix socket.
+
+    Args:
+        path: The socket path, in a directory only this user can reach. Any existing
+            file there is replaced, and the socket is made readable only by this user.
+        get_pool: Called with a server name to get its RCONPool. It raises
+            McadminbotUnknownServerError for an unknown name.
+
+    Returns:
+        The asyncio Server, which should be closed when the supervisor stops.
+    """
+    async def run(request: dict, writer: asyncio.StreamWriter) -> None:
+        reply = {'id': request.get('id')}
+        try:
+            reply['response'] = await get_pool(request['server']).command(request['command'])
+        except exceptions.McadminbotRCONAuthError as error:
+            reply.update(error='auth', message=error.message)
+        except exceptions.McadminbotRCONError as error:
+            reply.update(error='rcon', message=error.message)
+        except exceptions.McadminbotUnknownServerError as error:
+            reply.update(error='rcon', message=error.message)
+        except (KeyError, TypeError):
+            reply.update(error='rcon', message='Malformed gateway request')
+        if not writer.transport.is_closing():
+            writer.write(json.dumps(reply).encode('utf-8') + b'\n')
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer_uid = _peer_uid(writer)
+        if peer_uid is not None and peer_uid != os.getuid():
+            logger.warning(f"Refusing a gateway connection from user [{peer_uid}]")
+            writer.close()
+            return
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.ensure_future(run(json.loads(line), writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (OSError, ValueError, asyncio.LimitOverrunError) as error:
+            logger.warning(f"Dropping a shard's gateway connection: {error}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    if os.path.exists(path):
+        os.remove(path)
+    server = await asyncio.start_unix_server(handle, path, limit=_LINE_LIMIT)
+    os.chmod(path, 0o600)
+    logger.info(f"Serving RCON to shard processes on [{path}]")
+    return server
+
+
+def _peer_uid(writer: asyncio.StreamWriter) -> Optional[int]:
+    """
+    Returns:
+        The user ID of the process at the other end of a Unix socket connection, or
+        None if the platform does not report it.
+    """
+    peer_socket = writer.get_extra_info('socket')
+    if peer_socket is None or not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    credentials = peer_socket.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    _, uid, _ = struct.unpack('3i', credentials)
+    return uid
+
+
+class GatewayPool:
+    """
+    Stands in for an RCONPool in a shard process, sending commands to the supervisor.
+
+    Sessions, which bulk imports use to pipeline many commands over one connection,
+    cannot be shared and use a single connection of their own instead.
+    """
+
+    def __init__(self, path: str, server_name: str, local_pool: rcon.RCONPool):
+        """
+        Args:
+            path: The supervisor's gateway socket.
+            server_name: The name of the server that commands are sent to.
+            local_pool: A pool of size 1 used for sessions.
+        """
+        self.path = path
+        self.server_name = server_name
+        self.local_pool = local_pool
+        self._ids = itertools.count()
+        self._waiting: Dict[int, asyncio.Future] = {}
+        self._writer = None
+        self._reader_task = None
+        self._connecting = asyncio.Lock()
+        self._counters = {'gateway_commands': 0, 'gateway_reconnects': 0}
+
+    async def command(self, command: str) -> str:
+        """
+        Runs a command through the supervisor's pool.
+
+        Raises:
+            McadminbotRCONAuthError: The server rejected the password.
+            McadminbotRCONError: The server or the supervisor could not be reached.
+        """
+        await self._connect()
+        request_id = next(self._ids)
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiting[request_id] = waiter
+        try:
+            self._writer.write(json.dumps(
+                {'id': request_id, 'server': self.server_name, 'command': command}
+            ).encode('utf-8') + b'\n')
+            reply = await waiter
+        finally:
+            self._waiting.pop(request_id, None)
+        self._counters['gateway_commands'] += 1
+        if reply.get('error') == 'auth':
+            raise exceptions.McadminbotRCONAuthError(reply['message'])
+        if reply.get('error'):
+            raise exceptions.McadminbotRCONError(reply['message'])
+        return reply['response']
+
+    def session(self) -> rcon.RCONSession:
+        """See RCONPool.session."""
+        return self.local_pool.session()
+
+    async def close(self) -> None:
+        """Disconnects from the supervisor and closes the session connection."""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        await self.local_pool.close()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            Counters of commands sent through the gateway.
+        """
+        return dict(self._counters, waiting=len(self._waiting))
+
+    async def _connect(self) -> None:
+        async with self._connecting:
+            if self._writer is not None and not self._writer.transport.is_closing():
+                return
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(
+                    self.path, limit=_LINE_LIMIT)
+            except OSError as error:
+                raise exceptions.McadminbotRCONError(
+                    f"Failed to connect to the RCON gateway [{self.path}]") from error
+            if self._reader_task is not None:
+                self._counters['gateway_reconnects'] += 1
+            self._reader_task = asyncio.ensure_future(self._read_replies(reader))
+
+    async def _read_replies(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = json.loads(line)
+                waiter = self._waiting.get(reply.get('id'))
+                if waiter is not None and not waiter.done():
+                    waiter.set_result(reply)
+        except (OSError, ValueError, asyncio.LimitOverrunError) as error:
+            logger.warning(f"Lost the RCON gateway connection: {error}")
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+            lost = exceptions.McadminbotRCONError('Lost the connection to the RCON gateway')
+            for waiter in self._waiting.values():
+                if not waiter.done():
+                    waiter.set_exception(lost)
@@ -0,0 +1,167 @@
+"""
+bot/handoff.py - Lets a new bot process take over from a running one without a gap.
+
+A resumed gateway session is not sent the guilds, channels and roles that commands
+need, so the new process cannot resume its predecessor's session. Instead it
+connects with a session of its own and stands by:
+
+1. The successor connects to Discord, warms its RCON connections and, instead of
+   running message commands, buffers them in a Standby.
+2. It sends HANDOFF_SIGNAL to its predecessor, which stops accepting commands,
+   lets running ones finish, writes the IDs of the commands it accepted to
+   HANDOFF_PATH and exits.
+3. The successor runs the buffered commands that its predecessor did not accept,
+   and from then on runs commands as they arrive.
+
+Discord only accepts an answer to a slash command within 3 seconds, so those are
+never buffered: the predecessor answers them until it is told to hand off, and
+until the successor takes over they are answered with RESTARTING_MESSAGE.
+"""
+
+import asyncio
+import json
+import os
+import pathlib
+import select
+import signal
+import time
+from typing import Awaitable, Callable, Iterable, List, Set, Tuple
+
+from loguru import logger
+
+HANDOFF_SIGNAL = signal.SIGUSR1
+HANDOFF_PATH = pathlib.Path('/run/mcadminbot.handoff')
+
+# The number of accepted command IDs remembered for a successor
+HANDLED_HISTORY = 1000
+
+RESTARTING_MESSAGE = 'mcadminbot is restarting; try the command again in a moment.'
+
+
+class Standby:
+    """The commands a successor received while its predecessor was still running."""
+
+    def __init__(self, predecessor: int):
+        """
+        Args:
+            predecessor: The PID of the bot being taken over from.
+        """
+        self.predecessor = predecessor
+        self.buffered = []
+        # Set once the predecessor has been told to hand off
+        self.signalled = False
+
+    def buffer(self, item_id: int, function: Callable[..., Awaitable], *args) -> None:
+        """
+        Holds a command until the handoff.
+
+        Args:
+            item_id: The ID of the message or interaction, matched against the IDs
+                that the predecessor accepted.
+            function: The coroutine function that runs the command.
+            args: Passed to function.
+        """
+        self.buffered.append((item_id, function, args))
+
+    def pending(self, handled: Set[int]) -> List[Tuple[Callable[..., Awaitable], tuple]]:
+        """
+        Args:
+            handled: The IDs that the predecessor accepted.
+
+        Returns:
+            (function, args) for each buffered command the predecessor did not accept,
+            in the order they arrived.
+        """
+        return [(function, args) for item_id, function, args in self.buffered
+                if item_id not in handled]
+
+
+def write_handled(ids: Iterable[int]) -> None:
+    """Atomically writes the IDs of the commands a bot accepted to HANDOFF_PATH."""
+    temporary = HANDOFF_PATH.with_name(f"{HANDOFF_PATH.name}.tmp")
+    try:
+        with temporary.open('w') as handoff_file:
+            json.dump(list(ids), handoff_file)
+        os.replace(str(temporary), str(HANDOFF_PATH))
+    except OSError as error:
+        logger.error(f"Could not write the handoff file [{HANDOFF_PATH}]: {error}")
+
+
+def read_handled() -> Set[int]:
+    """
+    Reads and removes the IDs written by write_handled.
+
+    Returns:
+        The IDs, or an empty set if the predecessor wrote none.
+    """
+    try:
+        with HANDOFF_PATH.open('r') as handoff_file:
+            ids = set(json.load(handoff_file))
+        HANDOFF_PATH.unlink()
+    except FileNotFoundError:
+        return set()
+    except (OSError, ValueError) as error:
+        logger.error(f"Could not read the handoff file [{HANDOFF_PATH}]: {error}")
+        return set()
+    return ids
+
+
+def is_mcadminbot(pid: int) -> bool:
+    """
+    Returns:
+        Whether a process is running and, where /proc shows it, is mcadminbot, since
+        a PID from a stale pidfile may since have been reused by another program.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    try:
+        with open(f"/proc/{pid}/cmdline", 'rb') as cmdline:
+            return b'mcadminbot' in cmdline.read()
+    except OSError:
+        return True
+
+
+def wait_for_exit_blocking(pid: int, timeout: float) -> bool:
+    """
+    Waits for a process that is not a child of this one to exit, without spinning.
+
+    Returns:
+        True if the process exited within timeout seconds.
+    """
+    try:
+        descriptor = os.pidfd_open(pid)
+    except ProcessLookupError:
+        return True
+    except (AttributeError, OSError):
+        # pidfd_open needs Python 3.9 and Linux 5.3; check with a backoff instead
+        deadline = time.monotonic() + timeout
+        delay = 0.001
+        while is_mcadminbot(pid):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.1)
+        return True
+    try:
+        # A pidfd becomes readable when its process exits
+        poller = select.poll()
+        poller.register(descriptor, select.POLLIN)
+        return bool(poller.poll(max(timeout, 0) * 1000))
+    finally:
+        os.close(descriptor)
+
+
+async def wait_for_exit(pid: int, timeout: float) -> bool:
+    """
+    Runs wait_for_exit_blocking in a worker thread, so the event loop keeps running.
+
+    Returns:
+        True if the process exited within timeout seconds.
+    """
+    return await asyncio.get_event_loop().run_in_executor(
+        None, wait_for_exit_blocking, pid, timeout)
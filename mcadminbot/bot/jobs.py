@@ -0,0 +1,490 @@
+"""
+bot/jobs.py - Implements a discord.ext.commands.Cog that runs RCON commands on a
+    schedule, such as restart warnings, 'save-all' and timed broadcasts.
+
+Jobs come from the 'jobs' config key or the 'schedule' command. They wait in a
+JobQueue, a heap ordered by run time, and a single task sleeps until the earliest
+one is due, so thousands of jobs cost one timer. Every job, with the time it is
+next due, is saved to 'job_file', so jobs survive restarts.
+
+A job that runs more than 'job_misfire_grace' seconds late, because the bot was
+down or busy, misfired: its 'run_once' policy runs it once now, and 'skip' waits
+for its next time. Either way a recurring job then resumes its schedule instead
+of running once for every time it missed.
+"""
+
+import asyncio
+import datetime
+import heapq
+import itertools
+import json
+import math
+import random
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from discord.ext import commands
+from loguru import logger
+
+import mcadminbot.config as config
+from . import exceptions
+from . import servers
+from . import statefiles
+from . import utils
+from .servers import ALL_SERVERS, ServerTarget
+
+# Seconds that job runs are gathered for before the job file is saved
+SAVE_DELAY = 1
+
+
+class Job(NamedTuple):
+    """A command run on a server at a time, and optionally every interval after it."""
+
+    name: str
+    command: str
+    server: Optional[str]
+    interval: float
+    due: float
+    jitter: float
+    misfire: str
+    owner: Optional[str]
+
+    def format(self) -> str:
+        """
+        Returns:
+            The job as one line of a Discord message.
+        """
+        when = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(self.due))
+        schedule = f"every {_format_duration(self.interval)}" if self.interval else 'once'
+        source = f"added by {self.owner}" if self.owner else 'from the config'
+        return (f"{self.name}: [{self.command}] on [{self.server or servers.get_server().name}] "
+                f"{schedule}, next at {when} UTC ({source})")
+
+
+def job_from_config(name: str, definition: dict, now: float) -> Job:
+    """
+    Builds a job from its entry in the 'jobs' config key.
+
+    Args:
+        name: The job's key in 'jobs'.
+        definition: Its 'command' and optional 'server', 'every', 'at', 'jitter' and
+            'misfire'. A job with an 'at' time first runs at the next such local time,
+            then every day unless 'every' says otherwise.
+        now: The current time.
+
+    Returns:
+        The job, next due at its first time after now.
+    """
+    interval = config.parse_duration(definition.get('every', '1d'))
+    if 'at' in definition:
+        hour, minute = config.parse_time_of_day(definition['at'])
+        today = datetime.datetime.fromtimestamp(now)
+        first = today.replace(hour=hour, minute=minute, second=0, microsecond=0).timestamp()
+        due = _next_due(first - interval, interval, now)
+    else:
+        due = now + interval
+    server = definition.get('server')
+    return Job(
+        name=name,
+        command=definition['command'],
+        server=str(server).lstrip('@') if server else None,
+        interval=interval,
+        due=due,
+        jitter=config.parse_duration(definition.get('jitter', 0)),
+        misfire=definition.get('misfire', config.CONFIG['job_misfire_policy']),
+        owner=None)
+
+
+def _next_due(due: float, interval: float, now: float) -> float:
+    """Returns the first time after now in the series due, due + interval, ..."""
+    if due > now:
+        return due
+    return due + (math.floor((now - due) / interval) + 1) * interval
+
+
+def _format_duration(seconds: float) -> str:
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= size and seconds % size == 0:
+            return f"{int(seconds // size)}{unit}"
+    return f"{seconds:g}s"
+
+
+class JobQueue:
+    """Jobs ordered by the time they next run, with jitter applied."""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, str]] = []
+        self._entries: Dict[str, Tuple[Job, float, int]] = {}
+        self._sequence = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[Job]:
+        """Yields the jobs in the order they run."""
+        for job, _, _ in sorted(self._entries.values(), key=lambda entry: entry[1:]):
+            yield job
+
+    def get(self, name: str) -> Optional[Job]:
+        """Returns the job with a name, or None."""
+        entry = self._entries.get(name)
+        return entry[0] if entry else None
+
+    def push(self, job: Job) -> float:
+        """
+        Adds a job, replacing any with the same name.
+
+        Returns:
+            The time it will run: its due time plus up to 'jitter' seconds.
+        """
+        run_at = job.due + random.uniform(0, job.jitter) if job.jitter else job.due
+        sequence = next(self._sequence)
+        self._entries[job.name] = (job, run_at, sequence)
+        heapq.heappush(self._heap, (run_at, sequence, job.name))
+        return run_at
+
+    def remove(self, name: str) -> Optional[Job]:
+        """
+        Removes a job. Its heap entry is dropped when it reaches the top.
+
+        Returns:
+            The removed job, or None if there was none with that name.
+        """
+        entry = self._entries.pop(name, None)
+        return entry[0] if entry else None
+
+    def next_time(self) -> Optional[float]:
+        """Returns the time the next job runs, or None if there are no jobs."""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> List[Tuple[Job, float]]:
+        """
+        Removes the jobs that are due.
+
+        Returns:
+            (job, the time it was meant to run) for every job due by now, earliest first.
+        """
+        due = []
+        while self.next_time() is not None and self._heap[0][0] <= now:
+            run_at, _, name = heapq.heappop(self._heap)
+            due.append((self._entries.pop(name)[0], run_at))
+        return due
+
+    def _drop_stale(self) -> None:
+        # Replaced and removed jobs leave their heap entries behind
+        while self._heap:
+            _, sequence, name = self._heap[0]
+            entry = self._entries.get(name)
+            if entry is not None and entry[2] == sequence:
+                return
+            heapq.heappop(self._heap)
+
+
+class Jobs(commands.Cog):
+    """A subclass of discord.ext.commands.Cog that runs scheduled RCON commands."""
+
+    def __init__(self, bot: commands.Bot):
+        """
+        Instantiates an instance of this cog to be used by Mcadminbot.
+
+        With shards split across processes, only the process running shard 0 runs
+        and manages jobs, so each job runs once.
+
+        Args:
+            bot: An instance of discord.ext.commands.Bot.
+        """
+        self.bot = bot
+        self.queue = JobQueue()
+        self.loaded = False
+        self._wakeup = None
+        self._save_handle = None
+        self._running = set()
+        self._task = bot.loop.create_task(self._run()) if bot.primary else None
+
+    def cog_check(self, ctx) -> bool:
+        """
+        Overrides discord.ext.commands.Cog.cog_check.
+
+        Provides a global check in this cog for permission to run a command.
+
+        Returns:
+            True or False for permission granted or denied.
+        """
+        return utils.permission_check(ctx)
+
+    # Global cog command error handler for general errors
+    async def cog_command_error(self, ctx, error: Exception) -> None:
+        """
+        Overrides discord.ext.commands.Cog.cog_command_error.
+
+        Provides a global command error handler in this cog for any errors thrown
+        inside a command or check.
+
+        Args:
+            error: The Exception that was thrown by the cog command.
+        """
+        if isinstance(error, (exceptions.McadminbotCommandPermissionsError,
+                              exceptions.McadminbotUnknownServerError)):
+            await ctx.send(error)
+
+    def close(self) -> None:
+        """Stops running jobs and saves them with the time each is next due."""
+        if self._task is not None:
+            self._task.cancel()
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+        if self.loaded:
+            self.save()
+
+    def load(self, now: float = None) -> None:
+        """
+        Loads the saved jobs and the jobs in the config.
+
+        A config job keeps the time it was saved as next due, unless its
+        definition changed. Saved config jobs that were removed from the config
+        are dropped, and a config job replaces a command job of the same name.
+        """
+        now = time.time() if now is None else now
+        saved = {}
+        path = config.CONFIG['job_file']
+        if path:
+            try:
+                with statefiles.open_private(path) as job_file:
+                    saved = {job['name']: Job(**job) for job in json.load(job_file)}
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, TypeError, KeyError) as error:
+                logger.warning(f"Ignoring unreadable job file [{path}]: {error}")
+        for job in saved.values():
+            if job.owner is not None and job.name not in config.CONFIG['jobs']:
+                self.queue.push(job)
+        self.sync_config(now, saved)
+        self.loaded = True
+        logger.info(f"Loaded {len(self.queue)} scheduled job(s)")
+
+    def sync_config(self, now: float = None, saved: Dict[str, Job] = None) -> None:
+        """
+        Brings the config jobs in line with the 'jobs' config key after a reload.
+
+        Args:
+            now: The current time.
+            saved: Jobs to take the next due time of unchanged config jobs from,
+                instead of the queue.
+        """
+        now = time.time() if now is None else now
+        known = saved if saved is not None else {job.name: job for job in self.queue}
+        definitions = config.CONFIG['jobs']
+        for job in list(self.queue):
+            if job.owner is None and job.name not in definitions:
+                self.queue.remove(job.name)
+        for name, definition in definitions.items():
+            job = job_from_config(name, definition, now)
+            current = known.get(name)
+            if current is not None and current._replace(due=0) == job._replace(due=0):
+                if saved is None:
+                    continue
+                job = current
+            self.queue.push(job)
+        self._wake()
+
+    def save(self) -> None:
+        """Atomically writes every job to 'job_file', readable only by this user."""
+        self._save_handle = None
+        path = config.CONFIG['job_file']
+        if not path:
+            return
+        try:
+            statefiles.write_private(path, json.dumps([job._asdict() for job in self.queue]))
+        except OSError as error:
+            logger.warning(f"Could not save scheduled jobs to [{path}]: {error}")
+
+    def add(self, job: Job) -> None:
+        """Schedules a job and saves it."""
+        self.queue.push(job)
+        self._wake()
+        self.save()
+
+    async def fire(self, job: Job, run_at: float, now: float) -> Optional[str]:
+        """
+        Runs a job that is due through the same RCON path as the Minecraft commands,
+        unless it misfired under the 'skip' policy.
+
+        Args:
+            job: The job.
+            run_at: The time it was meant to run.
+            now: The time it is being run.
+
+        Returns:
+            The server's response, or None if the job was skipped.
+        """
+        late = now - run_at
+        if late > config.CONFIG['job_misfire_grace']:
+            if job.misfire == 'skip':
+                logger.warning(f"Skipping job [{job.name}], which is {late:.0f} seconds late")
+                return None
+            logger.warning(f"Running job [{job.name}] {late:.0f} seconds late")
+        try:
+            response = await utils.rcon_command(job.command, job.server)
+        except exceptions.McadminbotUnknownServerError as error:
+            logger.error(f"Job [{job.name}] was not run: {error}")
+            return None
+        logger.info(f"Job [{job.name}] ran [{job.command}]: {response}")
+        return response
+
+    def reschedule(self, job: Job, now: float) -> None:
+        """Schedules the next run of a recurring job after now."""
+        if job.interval:
+            self.queue.push(job._replace(due=_next_due(job.due, job.interval, now)))
+
+    async def _run(self) -> None:
+        """Sleeps until the next job is due, runs every due job, and repeats."""
+        await self.bot.wait_until_ready()
+        # A bot taking over from another one loads the jobs its predecessor saved
+        while getattr(self.bot, 'standby', None) is not None:
+            await asyncio.sleep(1)
+        self.load()
+        loop = asyncio.get_event_loop()
+        while not self.bot.is_closed():
+            now = time.time()
+            for job, run_at in self.queue.pop_due(now):
+                self.reschedule(job, now)
+                task = asyncio.ensure_future(self.fire(job, run_at, now))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+                if self._save_handle is None:
+                    self._save_handle = loop.call_later(SAVE_DELAY, self.save)
+
+            next_time = self.queue.next_time()
+            self._wakeup = loop.create_future()
+            timeout = None if next_time is None else max(next_time - time.time(), 0)
+            await asyncio.wait([self._wakeup], timeout=timeout)
+
+    def _wake(self) -> None:
+        # Lets the run loop sleep until a job that was just scheduled earlier
+        if self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    async def _managed_here(self, ctx) -> bool:
+        if self.bot.primary and self.loaded:
+            return True
+        if not self.bot.primary:
+            await ctx.send('Scheduled jobs are managed by the process running shard 0.')
+        else:
+            await ctx.send('Scheduled jobs have not been loaded yet; try again in a moment.')
+        return False
+
+    @commands.group(help='Schedule commands to run later or repeatedly')
+    async def schedule(self, ctx) -> None:
+        """Top-level schedule command that depends on subcommands."""
+        if ctx.invoked_subcommand is None:
+            if ctx.subcommand_passed:
+                await ctx.send(f"Wrong subcommand: {ctx.subcommand_passed}")
+            else:
+                await ctx.send("See help for 'schedule' command for list of valid subcommands")
+
+    @schedule.command(name='list', help='List the scheduled commands')
+    async def schedule_list(self, ctx) -> None:
+        """Lists every scheduled job, soonest first."""
+        logger.info(f"[{ctx.author.name}] is listing scheduled jobs")
+        if not await self._managed_here(ctx):
+            return
+        if not len(self.queue):
+            await ctx.send('No commands are scheduled.')
+            return
+        await utils.send_response(ctx, '\n'.join(job.format() for job in self.queue))
+
+    @schedule.command(
+        name='add',
+        help='Run a command every interval such as 15m, 6h or 1d '
+             '(surround the command with double quotes)'
+    )
+    async def schedule_add(self, ctx, target: Optional[ServerTarget], name: str, every: str,
+                           command: str) -> None:
+        """
+        Schedules a command to run on the targeted server every interval, starting
+        one interval from now.
+
+        Args:
+            target: The name of the targeted server, None for the default server, or 'all'.
+            name: A name for the job.
+            every: The interval, such as '15m', '6h' or '1d'.
+            command: The Minecraft command to run, without a leading '/'.
+        """
+        logger.info(f"[{ctx.author.name}] is scheduling [{command}] every [{every}]")
+        await self._schedule(ctx, target, name, every, command, recurring=True)
+
+    @schedule.command(
+        name='once',
+        help='Run a command once after a delay such as 15m '
+             '(surround the command with double quotes)'
+    )
+    async def schedule_once(self, ctx, target: Optional[ServerTarget], name: str, delay: str,
+                            command: str) -> None:
+        """
+        Schedules a command to run once on the targeted server after a delay.
+
+        Args:
+            target: The name of the targeted server, None for the default server, or 'all'.
+            name: A name for the job.
+            delay: How long from now to run it, such as '15m'.
+            command: The Minecraft command to run, without a leading '/'.
+        """
+        logger.info(f"[{ctx.author.name}] is scheduling [{command}] in [{delay}]")
+        await self._schedule(ctx, target, name, delay, command, recurring=False)
+
+    @schedule.command(name='remove', help='Remove a scheduled command')
+    async def schedule_remove(self, ctx, name: str) -> None:
+        """
+        Removes a job added with the schedule command.
+
+        Args:
+            name: The name of the job.
+        """
+        logger.info(f"[{ctx.author.name}] is removing scheduled job [{name}]")
+        self._check_admin(ctx)
+        if not await self._managed_here(ctx):
+            return
+        job = self.queue.get(name)
+        if job is None:
+            await ctx.send(f"No command named [{name}] is scheduled.")
+            return
+        if job.owner is None:
+            await ctx.send(f"[{name}] is scheduled in the config; remove it there.")
+            return
+        self.queue.remove(name)
+        self.save()
+        await ctx.send(f"Removed scheduled command [{name}].")
+
+    def _check_admin(self, ctx) -> None:
+        if not utils.is_admin(ctx.author):
+            logger.warning(f"{ctx.author.name} is not an admin and cannot change scheduled jobs")
+            raise exceptions.McadminbotCommandPermissionsError(
+                f"{ctx.author.name} must be an admin to change scheduled commands.")
+
+    async def _schedule(self, ctx, target: Optional[str], name: str, duration: str,
+                        command: str, recurring: bool) -> None:
+        # A job runs any console command, so only admins may schedule one
+        self._check_admin(ctx)
+        if not await self._managed_here(ctx):
+            return
+        if target != ALL_SERVERS:
+            # Fails now, rather than when the job first runs
+            servers.get_server(target)
+        try:
+            seconds = config.parse_duration(duration)
+        except ValueError as error:
+            await ctx.send(str(error))
+            return
+        if seconds <= 0:
+            await ctx.send('The interval must be longer than zero.')
+            return
+        if self.queue.get(name) is not None:
+            await ctx.send(f"A command named [{name}] is already scheduled.")
+            return
+        job = Job(
+            name=name, command=command.lstrip('/'), server=target,
+            interval=seconds if recurring else 0, due=time.time() + seconds, jitter=0,
+            misfire=config.CONFIG['job_misfire_policy'], owner=str(ctx.author))
+        self.add(job)
+        await ctx.send(f"Scheduled {job.format()}")
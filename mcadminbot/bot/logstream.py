@@ -0,0 +1,124 @@
+"""
+bot/logstream.py - Implements a discord.ext.commands.Cog that mirrors player
+    events from each server's latest.log into a Discord channel.
+"""
+
+import asyncio
+import time
+from typing import List
+
+import discord
+from discord.ext import commands
+from loguru import logger
+
+import mcadminbot.config as config
+from . import logtail
+from . import servers
+from . import utils
+
+# The most unsent log events kept while Discord cannot be reached
+MAX_PENDING = 1000
+
+
+class LogStream(commands.Cog):
+    """A subclass of discord.ext.commands.Cog that streams server log events to Discord."""
+
+    def __init__(self, bot: commands.Bot):
+        """
+        Instantiates an instance of this cog and starts following the log files.
+
+        Args:
+            bot: An instance of discord.ext.commands.Bot.
+        """
+        self.bot = bot
+        self.offsets = None
+        self.tailers = {}
+        self.pending = []
+        self._task = bot.loop.create_task(self._run())
+
+    def cog_unload(self) -> None:
+        """
+        Overrides discord.ext.commands.Cog.cog_unload.
+
+        Stops following the log files and saves how far they were read.
+        """
+        self._task.cancel()
+        if self.offsets is not None:
+            self.offsets.save()
+
+    async def poll(self) -> List[str]:
+        """
+        Reads every server's new log events once, notifying logtail listeners.
+
+        Returns:
+            The formatted events of the kinds listed in 'log_events'.
+        """
+        log_files = {
+            server.name: server.log_file for server in servers.all_servers() if server.log_file
+        }
+        self.tailers = logtail.tailers_for(log_files, self.tailers, self.offsets)
+        if not self.tailers:
+            return []
+
+        loop = asyncio.get_event_loop()
+        kinds = set(config.CONFIG['log_events'])
+        prefix_names = len(self.tailers) > 1
+        lines = []
+        for name, tailer in self.tailers.items():
+            for event in await loop.run_in_executor(None, tailer.read_events):
+                logtail.notify(name, event)
+                if event.kind in kinds:
+                    lines.append(f"[{name}] {event.format()}" if prefix_names
+                                 else event.format())
+        return lines
+
+    async def _run(self) -> None:
+        """Polls the log files and sends a batch of events every 'log_batch_interval' seconds."""
+        await self.bot.wait_until_ready()
+        # A bot taking over from another one starts where its predecessor stopped
+        while getattr(self.bot, 'standby', None) is not None:
+            await asyncio.sleep(config.CONFIG['log_poll_interval'])
+        self.offsets = logtail.OffsetStore(config.CONFIG['log_offset_file'])
+        last_sent = time.monotonic()
+        while not self.bot.is_closed():
+            try:
+                self.pending.extend(await self.poll())
+                if len(self.pending) > MAX_PENDING:
+                    logger.warning(f"Dropping {len(self.pending) - MAX_PENDING} log events "
+                                   'that could not be sent to Discord')
+                    del self.pending[:-MAX_PENDING]
+                if self.pending and (time.monotonic() - last_sent
+                                     >= config.CONFIG['log_batch_interval']):
+                    self.pending = await self._send(self.pending)
+                    last_sent = time.monotonic()
+                    self.offsets.save()
+            except asyncio.CancelledError:
+                # Before Python 3.8 this is an Exception, which the clause below would swallow
+                raise
+            except Exception as error:
+                logger.exception(f"Log streaming failed, retrying: {error}")
+            await asyncio.sleep(config.CONFIG['log_poll_interval'])
+
+    async def _send(self, lines: List[str]) -> List[str]:
+        """
+        Sends log events to the 'log_channel'. Players' chat cannot mention anyone.
+
+        Returns:
+            The messages that could not be sent, to be retried with the next batch.
+        """
+        channel_id = config.CONFIG['log_channel']
+        if not channel_id:
+            return []
+        messages = list(utils.split_message('\n'.join(lines)))
+        sent = 0
+        try:
+            channel = await utils.find_channel(self.bot, channel_id)
+            for message in messages:
+                await channel.send(message, allowed_mentions=discord.AllowedMentions.none())
+                sent += 1
+        except discord.HTTPException as error:
+            logger.error(f"Could not send {len(messages) - sent} messages of log events to "
+                         f"Discord, retrying with the next batch: {error}")
+            return messages[sent:]
+        return []
+
@@ -0,0 +1,241 @@
+"""
+bot/logtail.py - Follows a Minecraft server's latest.log and parses its events.
+
+LogTailer reads only the bytes appended since its last read, remembering its
+position in an OffsetStore so that a restarted bot neither repeats nor skips
+lines. When the server rotates the log (the file is replaced or truncated),
+reading restarts from the top of the new file.
+
+Functions registered with add_listener are called with every parsed LogEvent.
+"""
+
+import json
+import os
+import re
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from loguru import logger
+
+JOIN = 'join'
+LEAVE = 'leave'
+CHAT = 'chat'
+DEATH = 'death'
+EVENT_KINDS = (JOIN, LEAVE, CHAT, DEATH)
+
+# '[12:34:56] [Server thread/INFO]: <message>', with an optional '[Not Secure] ' chat prefix
+LINE_REGEX = re.compile(r'^\[[^\]]*\] \[Server thread/INFO\]: (?:\[Not Secure\] )?(.*)$')
+
+# Matched against the message part of LINE_REGEX, in order
+EVENT_REGEXES = (
+    (JOIN, re.compile(r'^(?P<player>[A-Za-z0-9_]{1,16}) joined the game$')),
+    (LEAVE, re.compile(r'^(?P<player>[A-Za-z0-9_]{1,16}) left the game$')),
+    (CHAT, re.compile(r'^<(?P<player>[A-Za-z0-9_]{1,16})> (?P<text>.*)$')),
+    (DEATH, re.compile(
+        r'^(?P<player>[A-Za-z0-9_]{1,16}) (?P<text>(?:'
+        r'was (?:slain|shot|killed|blown up|fireballed|pummeled|squashed|squished|impaled'
+        r'|pricked|stung|poked|frozen|struck by lightning|burnt|doomed|skewered|obliterated)'
+        r'|fell|drowned|died|burned|blew up|hit the ground|tried to swim in lava|suffocated'
+        r'|starved|withered|went up in flames|went off with a bang|froze to death'
+        r'|experienced kinetic energy|walked into|discovered the floor was lava'
+        r"|didn't want to live)\b.*)$")),
+)
+
+# Functions called with (server name, LogEvent)
+_LISTENERS = []
+
+
+class LogEvent(NamedTuple):
+    """One player event parsed from a log line."""
+
+    kind: str
+    player: str
+    text: str
+
+    def format(self) -> str:
+        """
+        Returns:
+            The event as one line of a Discord message.
+        """
+        if self.kind == CHAT:
+            return f"<{self.player}> {self.text}"
+        if self.kind == DEATH:
+            return f"{self.player} {self.text}"
+        return f"{self.player} {'joined' if self.kind == JOIN else 'left'} the game"
+
+
+def add_listener(listener: Callable[[str, LogEvent], None]) -> None:
+    """
+    Registers a function that is called with every event read from any server's log.
+
+    Args:
+        listener: Called with the server name and the LogEvent.
+    """
+    if listener not in _LISTENERS:
+        _LISTENERS.append(listener)
+
+
+def remove_listener(listener: Callable[[str, LogEvent], None]) -> None:
+    """Unregisters a listener added with add_listener."""
+    if listener in _LISTENERS:
+        _LISTENERS.remove(listener)
+
+
+def notify(server_name: str, event: LogEvent) -> None:
+    """Calls every registered listener with an event."""
+    for listener in _LISTENERS:
+        listener(server_name, event)
+
+
+def parse_line(line: str) -> Optional[LogEvent]:
+    """
+    Args:
+        line: One line of latest.log, without its newline.
+
+    Returns:
+        The player event on the line, or None if it is not one.
+    """
+    match = LINE_REGEX.match(line)
+    if match is None:
+        return None
+    message = match.group(1)
+    for kind, regex in EVENT_REGEXES:
+        event = regex.match(message)
+        if event is not None:
+            groups = event.groupdict()
+            return LogEvent(kind, groups['player'], groups.get('text') or '')
+    return None
+
+
+class OffsetStore:
+    """Remembers how far each log file has been read, in a JSON file."""
+
+    def __init__(self, path: Optional[str]):
+        """
+        Args:
+            path: The JSON file to load from and save to, or None to only remember in memory.
+        """
+        self.path = path
+        self.offsets = {}
+        if path:
+            try:
+                with open(path, 'r') as offset_file:
+                    self.offsets = json.load(offset_file)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as error:
+                logger.warning(f"Ignoring unreadable log offset file [{path}]: {error}")
+
+    def get(self, log_path: str) -> Optional[List[int]]:
+        """
+        Returns:
+            [inode, offset] of the last read of log_path, or None if it was never read.
+        """
+        return self.offsets.get(log_path)
+
+    def set(self, log_path: str, inode: int, offset: int) -> None:
+        """Records a read position, without saving it."""
+        self.offsets[log_path] = [inode, offset]
+
+    def save(self) -> None:
+        """Atomically writes every position to the JSON file."""
+        if not self.path:
+            return
+        temporary = f"{self.path}.tmp"
+        try:
+            with open(temporary, 'w') as offset_file:
+                json.dump(self.offsets, offset_file)
+            os.replace(temporary, self.path)
+        except OSError as error:
+            logger.warning(f"Could not save log offsets to [{self.path}]: {error}")
+
+
+class LogTailer:
+    """Reads the lines appended to one log file since the last read."""
+
+    def __init__(self, path: str, offsets: OffsetStore):
+        """
+        Starts where the previous bot left off, or at the end of the file if it
+        was never read or has been rotated since.
+
+        Args:
+            path: The path of the server's latest.log.
+            offsets: Where read positions are remembered.
+        """
+        self.path = path
+        self.offsets = offsets
+        self.inode = None
+        self.offset = 0
+        saved = offsets.get(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        if saved is not None and saved[0] == stat.st_ino and saved[1] <= stat.st_size:
+            self.inode, self.offset = saved
+        else:
+            self.inode, self.offset = stat.st_ino, stat.st_size
+
+    def read_lines(self) -> List[str]:
+        """
+        Reads complete lines appended since the last read. A trailing partial line
+        is left for the next read.
+
+        Returns:
+            The new lines, without newlines. Empty if the file is missing.
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return []
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            logger.info(f"[{self.path}] was rotated, reading the new file from the start")
+            self.inode, self.offset = stat.st_ino, 0
+        if stat.st_size == self.offset:
+            return []
+
+        try:
+            with open(self.path, 'rb') as log_file:
+                log_file.seek(self.offset)
+                data = log_file.read(stat.st_size - self.offset)
+        except OSError as error:
+            logger.warning(f"Could not read [{self.path}]: {error}")
+            return []
+        end = data.rfind(b'\n') + 1
+        if not end:
+            return []
+        self.offset += end
+        self.offsets.set(self.path, self.inode, self.offset)
+        return data[:end].decode('utf-8', errors='replace').splitlines()
+
+    def read_events(self) -> List[LogEvent]:
+        """
+        Returns:
+            The player events in the lines appended since the last read.
+        """
+        events = []
+        for line in self.read_lines():
+            event = parse_line(line)
+            if event is not None:
+                events.append(event)
+        return events
+
+
+def tailers_for(log_files: Dict[str, str], current: Dict[str, LogTailer],
+                offsets: OffsetStore) -> Dict[str, LogTailer]:
+    """
+    Reuses or creates a tailer for each server's log file.
+
+    Args:
+        log_files: Server names mapped to their log file paths.
+        current: The tailers currently in use, keyed by server name.
+        offsets: Where read positions are remembered.
+
+    Returns:
+        A tailer for every server in log_files, keyed by server name.
+    """
+    tailers = {}
+    for name, path in log_files.items():
+        existing = current.get(name)
+        tailers[name] = (existing if existing is not None and existing.path == path
+                         else LogTailer(path, offsets))
+    return tailers
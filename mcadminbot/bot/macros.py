@@ -0,0 +1,381 @@
+"""
+bot/macros.py - Implements a discord.ext.commands.Cog that runs named sequences of
+    RCON commands, such as kick, ban-ip, whitelist remove and say, as one command.
+
+A macro's commands name their arguments with placeholders such as {player}, which
+take the macro's arguments in the order they first appear; the last one takes the
+rest of the arguments, so a reason need not be quoted. Macros come from the
+'macros' config key or the 'macro add' command, which saves them to 'macro_file'.
+
+A macro runs its commands in order over one authenticated pooled connection, and
+stops at the first command the server rejects, so it takes one round trip per
+command rather than one connect-login-command cycle each. The bot replies once,
+with every command's response.
+"""
+
+import asyncio
+import json
+import os
+import re
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from discord.ext import commands
+from loguru import logger
+
+import mcadminbot.config as config
+from . import audit
+from . import exceptions
+from . import servers
+from . import statefiles
+from . import utils
+from .servers import ALL_SERVERS, ServerTarget
+
+PLACEHOLDER = re.compile(r'\{([A-Za-z_][A-Za-z0-9_]*)\}')
+
+class Macro(NamedTuple):
+    """A named sequence of command templates."""
+
+    name: str
+    steps: List[str]
+    owner: Optional[str]
+
+    @property
+    def parameters(self) -> List[str]:
+        """The placeholder names, in the order they first appear."""
+        names = []
+        for step in self.steps:
+            for name in PLACEHOLDER.findall(step):
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def render(self, arguments: Sequence[str]) -> List[str]:
+        """
+        Fills in the placeholders.
+
+        Args:
+            arguments: One value per parameter. The last parameter takes every
+                remaining argument, joined with spaces.
+
+        Returns:
+            The commands to run.
+
+        Raises:
+            McadminbotMacroError: Too few or too many arguments were given.
+        """
+        parameters = self.parameters
+        if len(arguments) < len(parameters) or (arguments and not parameters):
+            raise exceptions.McadminbotMacroError(f"Usage: macro {self.usage()}")
+        values = dict(zip(parameters, arguments))
+        if parameters:
+            values[parameters[-1]] = ' '.join(arguments[len(parameters) - 1:])
+        # A value cannot end one command and start another
+        values = {name: ' '.join(value.split()) for name, value in values.items()}
+        return [PLACEHOLDER.sub(lambda match: values[match.group(1)], step)
+                for step in self.steps]
+
+    def usage(self) -> str:
+        """
+        Returns:
+            The macro's name and parameters, such as 'punish <player> <reason>'.
+        """
+        return ' '.join([self.name] + [f"<{name}>" for name in self.parameters])
+
+    def format(self) -> str:
+        """
+        Returns:
+            The macro as one line of a Discord message.
+        """
+        source = f"added by {self.owner}" if self.owner else 'from the config'
+        return f"{self.usage()}: {'; '.join(self.steps)} ({source})"
+
+
+class MacroResult:
+    """The responses to one run of a macro on one server."""
+
+    def __init__(self, server_name: str, steps: List[str]):
+        """
+        Args:
+            server_name: The server the macro ran on.
+            steps: The commands the macro runs.
+        """
+        self.server_name = server_name
+        self.steps = steps
+        self.responses = []
+        self.rejected = False
+        self.error = None
+
+    @property
+    def succeeded(self) -> bool:
+        """Whether every command ran and was accepted."""
+        return len(self.responses) == len(self.steps) and not self.rejected
+
+    def format(self) -> str:
+        """
+        Returns:
+            Each command with its response, and the commands that were not run.
+        """
+        status = 'OK' if self.succeeded else 'FAILED'
+        lines = [f"[{self.server_name}] {status}: "
+                 f"{len(self.responses) - self.rejected}/{len(self.steps)} commands succeeded"]
+        for step, response in zip(self.steps, self.responses):
+            lines.append(f"> {step}: {response}" if response else f"> {step}")
+        if self.error:
+            lines.append(self.error)
+        lines.extend(f"> {step}: not run" for step in self.steps[len(self.responses):])
+        return '\n'.join(lines)
+
+
+async def run_macro(server: servers.Server, steps: List[str], user=None,
+                    timeout: float = None) -> MacroResult:
+    """
+    Runs commands in order over one pooled RCON connection, stopping at the first
+    that fails.
+
+    The macro takes one slot in the server's CommandScheduler, prioritized as its
+    first command and charged to the rate limit of every command, and fails fast
+    while the server's CircuitBreaker is open.
+
+    Args:
+        server: The targeted server.
+        steps: The commands to run.
+        user: The ID of the Discord user running the macro, for rate limiting.
+        timeout: Seconds to wait for the whole macro, or None to rely on rcon_timeout.
+
+    Returns:
+        The responses so far, and why the macro stopped if it did not finish.
+    """
+    result = MacroResult(server.name, steps)
+
+    async def run() -> None:
+        slot = server.scheduler.slot(steps[0], user, follow_up=steps[1:])
+        async with slot, server.pool.session() as client:
+            for step in steps:
+                response = utils.ansi_escape(await client.command(step))
+                result.responses.append(response)
+                if utils.is_rejected(response):
+                    result.rejected = True
+                    return
+
+    try:
+        # The breaker counts failures to reach the server and resets once it answers
+        await asyncio.wait_for(server.breaker.call(run), timeout)
+    except (exceptions.McadminbotRateLimitError,
+            exceptions.McadminbotCircuitOpenError) as error:
+        result.error = error.message
+    except exceptions.McadminbotRCONAuthError:
+        result.error = 'RCON authentication failed. Please check your RCON password in your config.'
+        logger.error(f"[{server.name}] {result.error}")
+    except exceptions.McadminbotRCONError as error:
+        result.error = 'The RCON server is unreachable.'
+        logger.error(f"[{server.name}] {result.error} ({error})")
+    except asyncio.TimeoutError:
+        result.error = f"The RCON server did not respond within {timeout} seconds."
+        logger.error(f"[{server.name}] {result.error}")
+    finally:
+        for step in steps[:len(result.responses)]:
+            server.cache.invalidate(*utils.INVALIDATED_BY.get(step.split(' ', 1)[0], ()))
+    return result
+
+
+class Macros(commands.Cog):
+    """A subclass of discord.ext.commands.Cog that runs macros of RCON commands."""
+
+    def __init__(self, bot: commands.Bot):
+        """
+        Instantiates an instance of this cog to be used by Mcadminbot.
+
+        Args:
+            bot: An instance of discord.ext.commands.Bot.
+        """
+        self.bot = bot
+        self.defined: Dict[str, Macro] = {}
+        self._file_state = None
+
+    def cog_check(self, ctx) -> bool:
+        """
+        Overrides discord.ext.commands.Cog.cog_check.
+
+        Provides a global check in this cog for permission to run a command.
+
+        Returns:
+            True or False for permission granted or denied.
+        """
+        return utils.permission_check(ctx)
+
+    # Global cog command error handler for general errors
+    async def cog_command_error(self, ctx, error: Exception) -> None:
+        """
+        Overrides discord.ext.commands.Cog.cog_command_error.
+
+        Provides a global command error handler in this cog for any errors thrown
+        inside a command or check.
+
+        Args:
+            error: The Exception that was thrown by the cog command.
+        """
+        if isinstance(error, (exceptions.McadminbotCommandPermissionsError,
+                              exceptions.McadminbotUnknownServerError,
+                              exceptions.McadminbotMacroError)):
+            await ctx.send(error)
+
+    def get(self, name: str) -> Macro:
+        """
+        Returns:
+            The macro with a name. The config takes precedence over 'macro add'.
+
+        Raises:
+            McadminbotMacroError: There is no such macro.
+        """
+        steps = config.CONFIG['macros'].get(name)
+        if steps is not None:
+            return Macro(name, list(steps), None)
+        self.refresh()
+        if name not in self.defined:
+            raise exceptions.McadminbotMacroError(f"No macro is named [{name}].")
+        return self.defined[name]
+
+    def all(self) -> List[Macro]:
+        """Returns every macro, sorted by name."""
+        self.refresh()
+        names = set(config.CONFIG['macros']) | set(self.defined)
+        return [self.get(name) for name in sorted(names)]
+
+    def refresh(self) -> None:
+        """
+        Loads the macros in 'macro_file' if it changed since they were last loaded,
+        such as by another shard process.
+        """
+        path = config.CONFIG['macro_file']
+        try:
+            stat = os.stat(str(statefiles.state_path(path))) if path else None
+        except FileNotFoundError:
+            stat = None
+        state = stat and (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if state == self._file_state:
+            return
+        self._file_state = state
+        if state is None:
+            return
+        try:
+            with statefiles.open_private(path) as macro_file:
+                self.defined = {macro['name']: Macro(**macro) for macro in json.load(macro_file)}
+        except (OSError, ValueError, TypeError, KeyError) as error:
+            logger.warning(f"Ignoring unreadable macro file [{path}]: {error}")
+
+    def save(self) -> None:
+        """
+        Atomically writes the macros added with 'macro add' to 'macro_file', readable
+        only by this user.
+        """
+        path = config.CONFIG['macro_file']
+        if not path:
+            return
+        try:
+            stat = statefiles.write_private(
+                path, json.dumps([macro._asdict() for macro in self.defined.values()]))
+        except OSError as error:
+            logger.warning(f"Could not save macros to [{path}]: {error}")
+            return
+        self._file_state = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    @commands.group(
+        help='Run a macro of several commands over one connection (see macro list)',
+        invoke_without_command=True
+    )
+    async def macro(self, ctx, target: Optional[ServerTarget], name: str, *arguments: str) -> None:
+        """
+        Runs a macro on the targeted Minecraft server and replies once with every
+        command's response.
+
+        Args:
+            target: The name of the targeted server, None for the default server, or 'all'.
+            name: The name of the macro.
+            arguments: The values of the macro's placeholders.
+        """
+        logger.info(f"[{ctx.author.name}] is running macro [{name}] with {list(arguments)}")
+        steps = self.get(name).render(arguments)
+        if target == ALL_SERVERS:
+            targets, timeout = servers.all_servers(), config.CONFIG['broadcast_timeout']
+        else:
+            targets, timeout = [servers.get_server(target)], None
+        results = await asyncio.gather(*(
+            run_macro(server, steps, ctx.author.id, timeout) for server in targets))
+
+        audit_log = getattr(self.bot, 'audit', None)
+        if audit_log is not None:
+            for result in results:
+                for index, step in enumerate(steps[:len(result.responses)]):
+                    failed = result.rejected and index == len(result.responses) - 1
+                    entry = audit.entry_from_command(
+                        ctx.author, result.server_name, step, f"macro {name}",
+                        'rejected' if failed else 'sent')
+                    if entry is not None:
+                        audit_log.record(entry)
+
+        await utils.send_response(ctx, '\n'.join(result.format() for result in results))
+
+    @macro.command(name='list', help='List the macros and their commands')
+    async def macro_list(self, ctx) -> None:
+        """Lists every macro."""
+        logger.info(f"[{ctx.author.name}] is listing macros")
+        macros = self.all()
+        if not macros:
+            await ctx.send('No macros are defined.')
+            return
+        await utils.send_response(ctx, '\n'.join(macro.format() for macro in macros))
+
+    @macro.command(
+        name='add',
+        help='Define a macro: its name, then each command in double quotes, '
+             'with {placeholders} for its arguments'
+    )
+    async def macro_add(self, ctx, name: str, *steps: str) -> None:
+        """
+        Defines a macro and saves it to 'macro_file'. Only admins may define macros,
+        since a macro may run any command.
+
+        Args:
+            name: The name of the macro.
+            steps: Its commands, such as 'kick {player} {reason}'.
+        """
+        logger.info(f"[{ctx.author.name}] is defining macro [{name}] as {list(steps)}")
+        self._check_admin(ctx)
+        if not config.MACRO_NAME.fullmatch(name) or name in config.RESERVED_MACRO_NAMES:
+            raise exceptions.McadminbotMacroError(
+                f"[{name}] is not a valid macro name: use up to 32 letters, digits, "
+                "'-' and '_'.")
+        if not steps:
+            raise exceptions.McadminbotMacroError('A macro needs at least one command.')
+        self.refresh()
+        if name in config.CONFIG['macros'] or name in self.defined:
+            raise exceptions.McadminbotMacroError(f"A macro named [{name}] already exists.")
+        macro = Macro(name, [step.lstrip('/') for step in steps], str(ctx.author))
+        self.defined[name] = macro
+        self.save()
+        await ctx.send(f"Defined macro {macro.format()}")
+
+    @macro.command(name='remove', help='Remove a macro defined with macro add')
+    async def macro_remove(self, ctx, name: str) -> None:
+        """
+        Removes a macro defined with 'macro add'.
+
+        Args:
+            name: The name of the macro.
+        """
+        logger.info(f"[{ctx.author.name}] is removing macro [{name}]")
+        self._check_admin(ctx)
+        if name in config.CONFIG['macros']:
+            raise exceptions.McadminbotMacroError(
+                f"[{name}] is defined in the config; remove it there.")
+        self.refresh()
+        if self.defined.pop(name, None) is None:
+            raise exceptions.McadminbotMacroError(f"No macro is named [{name}].")
+        self.save()
+        await ctx.send(f"Removed macro [{name}].")
+
+    def _check_admin(self, ctx) -> None:
+        if not utils.is_admin(ctx.author):
+            logger.warning(f"{ctx.author.name} is not an admin and cannot change macros")
+            raise exceptions.McadminbotCommandPermissionsError(
+                f"{ctx.author.name} must be an admin to change macros.")
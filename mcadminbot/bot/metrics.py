@@ -0,0 +1,224 @@
+"""
+bot/metrics.py - Latency histograms and counters for each stage of handling a command.
+
+Metrics are kept in memory, rendered in the Prometheus text format by render, and
+served over HTTP by start_server when 'metrics_port' is configured.
+"""
+
+import asyncio
+import bisect
+import contextlib
+import time
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from loguru import logger
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STARTED = time.monotonic()
+
+_REGISTRY = []
+
+
+class Counter:
+    """A monotonically increasing count, split by label values."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        """
+        Instantiates and registers a counter.
+
+        Args:
+            name: The Prometheus metric name.
+            documentation: The HELP text of the metric.
+            labels: The names of the labels every observation must provide.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        _REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increases the counter for the given label values."""
+        key = tuple(str(labels[label]) for label in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        """Yields (metric name, labels, value) for every label combination."""
+        for key, value in self.values.items():
+            yield self.name, dict(zip(self.labels, key)), value
+
+
+class Histogram:
+    """Observations sorted into cumulative buckets, split by label values."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        Instantiates and registers a histogram.
+
+        Args:
+            name: The Prometheus metric name.
+            documentation: The HELP text of the metric.
+            labels: The names of the labels every observation must provide.
+            buckets: The sorted upper bounds of the buckets, in seconds.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Label values -> [per-bucket counts (last is +Inf), sum]
+        self.values = {}
+        _REGISTRY.append(self)
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Records one observation for the given label values."""
+        key = tuple(str(labels[label]) for label in self.labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observes the time spent inside the with block, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        """Returns the number of observations for the given label values."""
+        entry = self.values.get(tuple(str(labels[label]) for label in self.labels))
+        return sum(entry[0]) if entry else 0
+
+    def quantile(self, quantile: float, **labels: str) -> float:
+        """
+        Estimates a quantile by interpolating within the bucket that contains it.
+
+        Args:
+            quantile: The quantile to estimate, between 0 and 1.
+
+        Returns:
+            The estimate in seconds, 0.0 with no observations, or the largest
+            bucket bound if the quantile falls in the +Inf bucket.
+        """
+        entry = self.values.get(tuple(str(labels[label]) for label in self.labels))
+        if not entry:
+            return 0.0
+        rank = quantile * sum(entry[0])
+        seen = 0
+        for index, bucket_count in enumerate(entry[0][:-1]):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        """Yields (metric name, labels, value) for the buckets, sum and count."""
+        for key, (bucket_counts, total) in self.values.items():
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), bucket_counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f"{self.name}_bucket", dict(labels, le=le), cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+STAGE_SECONDS = Histogram(
+    'mcadminbot_stage_seconds',
+    'Time spent in each stage of handling a command',
+    ['stage'])
+COMMAND_SECONDS = Histogram(
+    'mcadminbot_command_seconds',
+    'Time from a command being parsed to its handler finishing',
+    ['command'])
+COMMANDS_TOTAL = Counter(
+    'mcadminbot_commands_total',
+    'Commands handled, by outcome',
+    ['command', 'outcome'])
+
+# The stages timed in STAGE_SECONDS, in the order a command passes through them
+STAGES = [
+    'parse', 'permission_check', 'rcon_connect', 'rcon_login', 'rcon_command', 'discord_send'
+]
+
+
+def render() -> str:
+    """
+    Returns:
+        Every registered metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in _REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            label_text = ','.join(
+                f'{key}="{_escape(label)}"' for key, label in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def summary() -> List[str]:
+    """
+    Returns:
+        Human-readable lines of per-stage latency and overall throughput.
+    """
+    uptime = time.monotonic() - STARTED
+    handled = sum(COMMANDS_TOTAL.values.values())
+    lines = [f"{handled} commands in {uptime:.0f}s ({handled / uptime * 60:.2f}/min)"]
+    for stage in STAGES:
+        count = STAGE_SECONDS.count(stage=stage)
+        if count:
+            lines.append(
+                f"{stage}: n={count}, "
+                f"p50={STAGE_SECONDS.quantile(0.5, stage=stage) * 1000:.1f}ms, "
+                f"p99={STAGE_SECONDS.quantile(0.99, stage=stage) * 1000:.1f}ms")
+    return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+async def start_server(address: str, port: int):
+    """
+    Serves render() to any HTTP GET on the given address and port.
+
+    Args:
+        address: The address to bind to.
+        port: The port to bind to.
+
+    Returns:
+        The asyncio Server, which should be closed when the bot stops.
+    """
+    async def handle(reader, writer):
+        try:
+            # Only the request line matters; drain the headers and answer every path
+            await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+            body = render().encode('utf-8')
+            writer.write(
+                b'HTTP/1.1 200 OK\r\n'
+                b'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                + f"Content-Length: {len(body)}\r\n".encode('ascii')
+                + b'Connection: close\r\n\r\n' + body)
+            await writer.drain()
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, address, port)
+    logger.info(f"Serving metrics on http://{address}:{port}/metrics")
+    return server
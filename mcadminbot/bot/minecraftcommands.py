@@ -3,11 +3,17 @@ bot/minecraftcommands.py - Implements a discord.ext.commands.Cog to organize and
     expose Minecraft RCON commands to users of the bot.
 """
 
+from typing import Optional
 from discord.ext import commands
 from loguru import logger
 
+import mcadminbot.config as config
+from . import audit
+from . import bulk
 from . import exceptions
+from . import servers
 from . import utils
+from .servers import ALL_SERVERS, ServerTarget
 
 
 # Command Checks
@@ -51,6 +57,17 @@ class MinecraftCommands(commands.Cog):
         """
         return utils.permission_check(ctx)
 
+    async def cog_after_invoke(self, ctx) -> None:
+        """
+        Overrides discord.ext.commands.Cog.cog_after_invoke.
+
+        Records every command in audit.AUDITED_COMMANDS that passed its checks in
+        the bot's audit log, whether or not it succeeded.
+        """
+        audit_log = getattr(self.bot, 'audit', None)
+        if audit_log is not None and ctx.command.qualified_name in audit.AUDITED_COMMANDS:
+            audit_log.record(audit.entry_from_context(ctx))
+
     # Global cog command error handler for general errors
     async def cog_command_error(self, ctx, error: Exception) -> None:
         """
@@ -62,46 +79,66 @@ class MinecraftCommands(commands.Cog):
         Args:
             error: The Exception that was thrown by the cog command.
         """
-        if isinstance(error, exceptions.McadminbotCommandPermissionsError):
+        if isinstance(error, (exceptions.McadminbotCommandPermissionsError,
+                              exceptions.McadminbotUnknownServerError,
+                              exceptions.McadminbotImportError,
+                              exceptions.McadminbotRateLimitError)):
             await ctx.send(error)
 
     @commands.command(help='List all online players')
-    async def list(self, ctx) -> None:
-        """Lists all players logged in to the configured Minecraft server."""
+    async def list(self, ctx, target: Optional[ServerTarget]) -> None:
+        """Lists all players logged in to the targeted Minecraft server."""
         logger.info(f"[{ctx.author.name}] is listing connected players")
-        response = utils.rcon_command('list')
-        await ctx.send(response)
+        if target != ALL_SERVERS:
+            # Answer from the tracked players while the polled snapshot is recent
+            tracker = servers.get_server(target).players
+            interval = config.CONFIG['player_poll_interval']
+            age = tracker.age()
+            if interval > 0 and age is not None and age <= interval * 2:
+                await utils.send_response(ctx, tracker.format())
+                return
+        response = await utils.rcon_command('list', target, ctx.author.id, ctx)
+        await utils.send_response(ctx, response)
 
     @commands.command(
         help='Send a message to every online player (surround the message with double quotes)'
     )
-    async def say(self, ctx, message: str) -> None:
+    async def say(self, ctx, target: Optional[ServerTarget], message: str) -> None:
         """
-        Broadcasts a message to all players logged in to the configured Minecraft server.
+        Broadcasts a message to all players logged in to the targeted Minecraft server.
 
         Args:
+            target: The name of the targeted server, None for the default server, or 'all'.
             message: The message to send to players.
         """
         logger.info(f"[{ctx.author.name}] is broadcasting message [{message}]")
-        utils.rcon_command(f"say {message}")
-        await ctx.send(f"Message [{message}] sent")
+        response = await utils.rcon_command(f"say {message}", target, ctx.author.id, ctx)
+        if target == ALL_SERVERS:
+            await utils.send_response(ctx, response)
+        else:
+            await ctx.send(f"Message [{message}] sent")
 
     @commands.command(
         help='Send a private message to an online player (surround the message with double quotes)',
         aliases=['msg', 'w']
     )
-    async def tell(self, ctx, username: str, message: str) -> None:
+    async def tell(self, ctx, target: Optional[ServerTarget], username: str, message: str) -> None:
         """
-        Sends a private message to a single player logged in to the configured Minecraft server.
+        Sends a private message to a single player logged in to the targeted Minecraft server.
 
         Args:
+            target: The name of the targeted server, None for the default server, or 'all'.
             username: The user to send a message to.
             message: The message to send.
         """
         logger.info(
             f"[{ctx.author.name}] is sending message [{message}] to player [{username}]")
-        utils.rcon_command(f"tell {username} {message}")
-        await ctx.send(f"Message [{message}] sent to player [{username}]")
+        response = await utils.rcon_command(
+            f"tell {username} {message}", target, ctx.author.id, ctx)
+        if target == ALL_SERVERS:
+            await utils.send_response(ctx, response)
+        else:
+            await ctx.send(f"Message [{message}] sent to player [{username}]")
 
     @commands.group(help='Whitelist commands')
     async def whitelist(self, ctx) -> None:
@@ -113,74 +150,119 @@ class MinecraftCommands(commands.Cog):
                 await ctx.send("See help for 'whitelist' command for list of valid subcommands")
 
     @whitelist.command(name='list', help='List players on the whitelist')
-    async def whitelist_list(self, ctx) -> None:
-        """List all players whitelisted on the configured Minecraft server."""
+    async def whitelist_list(self, ctx, target: Optional[ServerTarget]) -> None:
+        """List all players whitelisted on the targeted Minecraft server."""
         logger.info(f"[{ctx.author.name}] is listing whitelisted players")
-        response = utils.rcon_command('whitelist list')
-        await ctx.send(response)
+        response = await utils.rcon_command('whitelist list', target, ctx.author.id, ctx)
+        await utils.send_response(ctx, response)
 
     @whitelist.command(name='add', help='Add a player to the whitelist')
-    async def whitelist_add(self, ctx, username: str) -> None:
+    async def whitelist_add(self, ctx, target: Optional[ServerTarget], username: str) -> None:
         """
-        Add a player to the whitelist of the configured Minecraft server.
+        Add a player to the whitelist of the targeted Minecraft server.
 
         Args:
+            target: The name of the targeted server, None for the default server, or 'all'.
             username: The Minecraft username of the player to whitelist.
         """
         logger.info(
             f"[{ctx.author.name}] is whitelisting Minecraft player [{username}]")
-        response = utils.rcon_command(f"whitelist add {username}")
-        await ctx.send(response)
+        response = await utils.rcon_command(f"whitelist add {username}", target, ctx.author.id, ctx)
+        await utils.send_response(ctx, response)
 
     @whitelist.command(name='off', help='Turn the whitelist off')
-    async def whitelist_off(self, ctx) -> None:
-        """Turns off the whitelist for the configured Minecraft server."""
+    async def whitelist_off(self, ctx, target: Optional[ServerTarget]) -> None:
+        """Turns off the whitelist for the targeted Minecraft server."""
         logger.info(f"[{ctx.author.name}] is turning off the whitelist")
-        response = utils.rcon_command('whitelist off')
-        await ctx.send(response)
+        response = await utils.rcon_command('whitelist off', target, ctx.author.id, ctx)
+        await utils.send_response(ctx, response)
 
     @whitelist.command(name='on', help='Turn the whitelist on')
-    async def whitelist_on(self, ctx) -> None:
-        """Turns on the whitelist for the configured Minecraft server."""
+    async def whitelist_on(self, ctx, target: Optional[ServerTarget]) -> None:
+        """Turns on the whitelist for the targeted Minecraft server."""
         logger.info(f"[{ctx.author.name}] is turning on the whitelist")
-        response = utils.rcon_command('whitelist on')
-        await ctx.send(response)
+        response = await utils.rcon_command('whitelist on', target, ctx.author.id, ctx)
+        await utils.send_response(ctx, response)
 
     @whitelist.command(name='reload', help='Reloads the whitelist')
-    async def whitelist_reload(self, ctx) -> None:
-        """Reloads the whitelist for the configured Minecraft server."""
+    async def whitelist_reload(self, ctx, target: Optional[ServerTarget]) -> None:
+        """Reloads the whitelist for the targeted Minecraft server."""
         logger.info(f"[{ctx.author.name}] is reloading the whitelist")
-        response = utils.rcon_command('whitelist reload')
-        await ctx.send(response)
+        response = await utils.rcon_command('whitelist reload', target, ctx.author.id, ctx)
+        await utils.send_response(ctx, response)
 
     @whitelist.command(name='remove', help='Removes a player from the whitelist')
-    async def whitelist_remove(self, ctx, username: str) -> None:
+    async def whitelist_remove(self, ctx, target: Optional[ServerTarget], username: str) -> None:
         """
-        Removes a player from the whitelist for the configured Minecraft server.
+        Removes a player from the whitelist for the targeted Minecraft server.
 
         Args:
+            target: The name of the targeted server, None for the default server, or 'all'.
             username: The Minecraft username of the player to remove.
         """
         logger.info(
             f"[{ctx.author.name}] is removing Minecraft player [{username}] from the whitelist"
         )
-        response = utils.rcon_command(f"whitelist remove {username}")
-        await ctx.send(response)
+        response = await utils.rcon_command(
+            f"whitelist remove {username}", target, ctx.author.id, ctx)
+        await utils.send_response(ctx, response)
 
-    @commands.command(help='Ban a player from the server (surround the reason in double quotes)')
-    async def ban(self, ctx, username: str, reason: str) -> None:
+    @whitelist.command(
+        name='import',
+        help="""
+        Whitelist every player in an attached CSV/TXT file (one name per line)
+        or in a file under the configured import directory
+        """
+    )
+    async def whitelist_import(self, ctx, target: Optional[ServerTarget], path: str = None) -> None:
+        """
+        Whitelists every player listed in an attachment or local file on the targeted
+        Minecraft server.
+
+        Args:
+            target: The name of the targeted server, or None for the default server.
+            path: A file path relative to 'import_directory', used if nothing is attached.
+        """
+        logger.info(f"[{ctx.author.name}] is importing a whitelist")
+        await self._bulk_import(ctx, target, path, 'whitelist')
+
+    @commands.group(
+        help='Ban a player from the server (surround the reason in double quotes)',
+        invoke_without_command=True
+    )
+    async def ban(self, ctx, target: Optional[ServerTarget], username: str, reason: str) -> None:
         """
-        Bans a player from the configured Minecraft server.
+        Bans a player from the targeted Minecraft server.
 
         Args:
+            target: The name of the targeted server, None for the default server, or 'all'.
             username: The Minecraft username of the player to ban.
             reason: The reason that the player is being banned.
         """
         logger.info(
             f"[{ctx.author.name}] is banning Minecraft player [{username}] because [{reason}]"
         )
-        response = utils.rcon_command(f"ban {username} {reason}")
-        await ctx.send(response)
+        response = await utils.rcon_command(f"ban {username} {reason}", target, ctx.author.id, ctx)
+        await utils.send_response(ctx, response)
+
+    @ban.command(
+        name='import',
+        help="""
+        Ban every player in an attached CSV/TXT file (name and optional reason per line)
+        or in a file under the configured import directory
+        """
+    )
+    async def ban_import(self, ctx, target: Optional[ServerTarget], path: str = None) -> None:
+        """
+        Bans every player listed in an attachment or local file on the targeted
+        Minecraft server.
+
+        Args:
+            target: The name of the targeted server, or None for the default server.
+            path: A file path relative to 'import_directory', used if nothing is attached.
+        """
+        logger.info(f"[{ctx.author.name}] is importing bans")
+        await self._bulk_import(ctx, target, path, 'ban')
 
     @commands.command(
         name='ban-ip',
@@ -189,92 +271,139 @@ class MinecraftCommands(commands.Cog):
         You can also submit a player username to ban their connected IP
         """
     )
-    async def ban_ip(self, ctx, ip_address: str, reason: str) -> None:
+    async def ban_ip(self, ctx, target: Optional[ServerTarget], ip_address: str, reason: str) -> None:
         """
-        Bans an IP address from the configured Minecraft server.
+        Bans an IP address from the targeted Minecraft server.
 
         Args:
+            target: The name of the targeted server, None for the default server, or 'all'.
             ip_address: The IP address to ban.
             reason: The reason that the IP address is being banned.
         """
         logger.info(
             f"[{ctx.author.name}] is banning IP address [{ip_address}] because [{reason}]")
-        response = utils.rcon_command(f"ban-ip {ip_address} {reason}")
-        await ctx.send(response)
+        response = await utils.rcon_command(
+            f"ban-ip {ip_address} {reason}", target, ctx.author.id, ctx)
+        await utils.send_response(ctx, response)
 
     @commands.command(help='Display the list of banned players and IP addresses')
-    async def banlist(self, ctx) -> None:
-        """Displays the banlist of the configured Minecraft server."""
+    async def banlist(self, ctx, target: Optional[ServerTarget]) -> None:
+        """Displays the banlist of the targeted Minecraft server."""
         logger.info(f"[{ctx.author.name}] is getting the banlist")
-        response = utils.rcon_command('banlist')
-        await ctx.send(response)
+        response = await utils.rcon_command('banlist', target, ctx.author.id, ctx)
+        await utils.send_response(ctx, response)
 
     @commands.command(help='Kick a player off of the server (surround the reason in double quotes)')
-    async def kick(self, ctx, username: str, reason: str) -> None:
+    async def kick(self, ctx, target: Optional[ServerTarget], username: str, reason: str) -> None:
         """
-        Kick a player off of the configured Minecraft server.
+        Kick a player off of the targeted Minecraft server.
 
         Args:
+            target: The name of the targeted server, None for the default server, or 'all'.
             username: The Minecraft username of the player to kick.
             reason: The reason that the player is being kicked.
         """
         logger.info(
             f"[{ctx.author.name}] is kicking Minecraft player [{username}] because [{reason}]"
         )
-        response = utils.rcon_command(f"kick {username} {reason}")
-        await ctx.send(response)
+        response = await utils.rcon_command(f"kick {username} {reason}", target, ctx.author.id, ctx)
+        await utils.send_response(ctx, response)
 
     @commands.command(help='Pardon (unban) a player from the server')
-    async def pardon(self, ctx, username: str) -> None:
+    async def pardon(self, ctx, target: Optional[ServerTarget], username: str) -> None:
         """
-        Pardon a player from the configured Minecraft server.
+        Pardon a player from the targeted Minecraft server.
 
         Args:
+            target: The name of the targeted server, None for the default server, or 'all'.
             username: The Minecraft username of the player to pardon.
         """
         logger.info(
             f"[{ctx.author.name}] is pardoning Minecraft player [{username}]")
-        response = utils.rcon_command(f"pardon {username}")
-        await ctx.send(response)
+        response = await utils.rcon_command(f"pardon {username}", target, ctx.author.id, ctx)
+        await utils.send_response(ctx, response)
 
     @commands.command(name='pardon-ip', help='Pardon (unban) an IP address from the server')
-    async def pardon_ip(self, ctx, ip_address: str) -> None:
+    async def pardon_ip(self, ctx, target: Optional[ServerTarget], ip_address: str) -> None:
         """
-        Pardon an IP address from the configured Minecraft server.
+        Pardon an IP address from the targeted Minecraft server.
 
         Args:
+            target: The name of the targeted server, None for the default server, or 'all'.
             ip_address: The IP address to pardon.
         """
         logger.info(
             f"[{ctx.author.name}] is pardoning IP address [{ip_address}]")
-        response = utils.rcon_command(f"pardon-ip {ip_address}")
-        await ctx.send(response)
+        response = await utils.rcon_command(f"pardon-ip {ip_address}", target, ctx.author.id, ctx)
+        await utils.send_response(ctx, response)
 
     @commands.command(help='Grant OP status to a player')
-    async def op(self, ctx, username: str) -> None:
+    async def op(self, ctx, target: Optional[ServerTarget], username: str) -> None:
         """
-        Grant OP status to a Minecraft user on the configured Minecraft server.
+        Grant OP status to a Minecraft user on the targeted Minecraft server.
 
         Args:
+            target: The name of the targeted server, None for the default server, or 'all'.
             username: The Minecraft username of the player to grant OP status.
         """
         logger.info(
             f"[{ctx.author.name}] is granting OP status to Minecraft player [{username}]")
-        response = utils.rcon_command(f"op {username}")
-        await ctx.send(response)
+        response = await utils.rcon_command(f"op {username}", target, ctx.author.id, ctx)
+        await utils.send_response(ctx, response)
 
     @commands.command(help='Revoke OP status from a player')
-    async def deop(self, ctx, username: str) -> None:
+    async def deop(self, ctx, target: Optional[ServerTarget], username: str) -> None:
         """
-        Revoke OP status from a Minecraft user on the configured Minecraft server.
+        Revoke OP status from a Minecraft user on the targeted Minecraft server.
 
         Args:
+            target: The name of the targeted server, None for the default server, or 'all'.
             username: The Minecraft username of the player to revoke OP status from.
         """
         logger.info(
             f"[{ctx.author.name}] is revoking OP status from Minecraft player [{username}]")
-        response = utils.rcon_command(f"deop {username}")
-        await ctx.send(response)
+        response = await utils.rcon_command(f"deop {username}", target, ctx.author.id, ctx)
+        await utils.send_response(ctx, response)
+
+    async def _bulk_import(self, ctx, target: Optional[str], path: Optional[str],
+                           kind: str) -> None:
+        """
+        Runs a bulk import and keeps a single summary message up to date.
+
+        Raises:
+            McadminbotImportError: No input was given or it cannot be read.
+        """
+        if target == ALL_SERVERS:
+            raise exceptions.McadminbotImportError('Imports run against one server at a time.')
+        server = servers.get_server(target)
+
+        if ctx.message.attachments:
+            source = bulk.open_upload(await ctx.message.attachments[0].read())
+        elif path:
+            source = bulk.open_local(config.CONFIG['import_directory'], path)
+        else:
+            raise exceptions.McadminbotImportError('Attach a CSV/TXT file or give a path.')
+
+        message = await ctx.send(f"Starting {kind} import on [{server.name}]")
+
+        async def progress(summary: bulk.ImportSummary) -> None:
+            await message.edit(content=summary.format())
+
+        with source:
+            try:
+                summary = await bulk.run_import(
+                    server, bulk.read_entries(source), kind,
+                    config.CONFIG['import_pipeline_window'], progress, user=ctx.author.id)
+            except exceptions.McadminbotRCONError as error:
+                ctx.rcon_outcome = 'failed'
+                logger.error(f"[{server.name}] {kind} import failed: {error}")
+                await message.edit(content=f"The {kind} import on [{server.name}] failed: "
+                                           'the RCON server is unreachable.')
+                return
+        if summary.failed:
+            ctx.rcon_outcome = 'rejected'
+        logger.info(f"[{server.name}] {kind} import finished: {summary.succeeded} succeeded")
+        await message.edit(content=summary.format(finished=True))
 
     # Granular Command Error Handling
     # @list.error
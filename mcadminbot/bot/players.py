@@ -0,0 +1,131 @@
+"""
+bot/players.py - Keeps track of who is online on each server.
+
+Every successful 'list' response is parsed into a snapshot and diffed against the
+previous one, and join and leave events from the server log are applied between
+snapshots. Changes are passed to functions registered with add_listener.
+"""
+
+import re
+import time
+from typing import Callable, FrozenSet, Optional, Tuple
+
+from . import logtail
+
+JOINED = 'joined'
+LEFT = 'left'
+
+# 'There are 2 of a max of 20 players online: Steve, Alex', or '2/20' before 1.13
+LIST_REGEX = re.compile(
+    r'^There are (\d+)(?: of a max(?: of)? |/)(\d+) players online:(.*)$', re.DOTALL)
+
+# Functions called with (server name, JOINED or LEFT, player name)
+_LISTENERS = []
+
+
+def add_listener(listener: Callable[[str, str, str], None]) -> None:
+    """
+    Registers a function that is called whenever a player joins or leaves any server.
+
+    Args:
+        listener: Called with the server name, JOINED or LEFT, and the player name.
+    """
+    if listener not in _LISTENERS:
+        _LISTENERS.append(listener)
+
+
+def remove_listener(listener: Callable[[str, str, str], None]) -> None:
+    """Unregisters a listener added with add_listener."""
+    if listener in _LISTENERS:
+        _LISTENERS.remove(listener)
+
+
+def parse_list(response: str) -> Optional[Tuple[FrozenSet[str], int]]:
+    """
+    Args:
+        response: The response to 'list'.
+
+    Returns:
+        A tuple of (the names of online players, the player limit), or None if the
+        response is not a player list.
+    """
+    match = LIST_REGEX.match(response.strip())
+    if match is None:
+        return None
+    names = frozenset(name.strip() for name in match.group(3).split(',') if name.strip())
+    return names, int(match.group(2))
+
+
+class PlayerTracker:
+    """The online players of one server."""
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name: The name of the server, passed to listeners.
+        """
+        self.name = name
+        # Player name -> time.monotonic() of when they were first seen online
+        self.online = {}
+        self.max_players = None
+        self.updated = None
+
+    def age(self) -> Optional[float]:
+        """
+        Returns:
+            Seconds since the last 'list' snapshot, or None if there has not been one.
+        """
+        return None if self.updated is None else time.monotonic() - self.updated
+
+    def observe_list(self, response: str) -> None:
+        """
+        Replaces the tracked players with those in a 'list' response.
+
+        Args:
+            response: The response to 'list'. Anything else is ignored.
+        """
+        parsed = parse_list(response)
+        if parsed is None:
+            return
+        names, self.max_players = parsed
+        now = time.monotonic()
+        first = self.updated is None
+        self.updated = now
+        tracked = set(self.online)
+        for player in names - tracked:
+            self.online[player] = now
+            if not first:
+                self._notify(JOINED, player)
+        for player in tracked - names:
+            del self.online[player]
+            self._notify(LEFT, player)
+
+    def observe_event(self, event: logtail.LogEvent) -> None:
+        """
+        Applies a join or leave from the server log. Other events are ignored.
+
+        Args:
+            event: An event parsed from the server log.
+        """
+        if self.updated is None:
+            # Without a snapshot to apply it to, the event would leave a partial list
+            return
+        if event.kind == logtail.JOIN and event.player not in self.online:
+            self.online[event.player] = time.monotonic()
+            self._notify(JOINED, event.player)
+        elif event.kind == logtail.LEAVE and event.player in self.online:
+            del self.online[event.player]
+            self._notify(LEFT, event.player)
+
+    def format(self) -> str:
+        """
+        Returns:
+            The tracked players in the same format as a 'list' response.
+        """
+        names = sorted(self.online, key=str.lower)
+        return (f"There are {len(names)} of a max of {self.max_players} players online: "
+                f"{', '.join(names)}")
+
+    def _notify(self, change: str, player: str) -> None:
+        for listener in _LISTENERS:
+            listener(self.name, change, player)
@@ -0,0 +1,427 @@
+"""
+bot/rcon.py - A native asyncio implementation of the Source RCON protocol
+    that is spoken by Minecraft servers.
+
+RCONClient never blocks the event loop; every socket operation is awaited
+and bounded by a timeout. Minecraft splits responses longer than 4096 bytes
+across several packets, so every command is followed by a sentinel packet
+whose answer marks the end of the response. RCONPool keeps a bounded set of authenticated
+RCONClients alive so that commands skip the connect and login round trips.
+"""
+
+import asyncio
+import collections
+import itertools
+import struct
+import time
+from typing import AsyncIterator, Iterable, Tuple, Union
+
+from . import exceptions
+from . import metrics
+
+PACKET_TYPE_RESPONSE = 0
+PACKET_TYPE_COMMAND = 2
+PACKET_TYPE_LOGIN = 3
+
+# The request ID the server answers with when a login is rejected
+AUTH_FAILURE_ID = -1
+
+# The largest body Minecraft puts in one response packet
+MAX_RESPONSE_BODY = 4096
+
+# Little-endian int32 fields: request ID and packet type
+_HEADER = struct.Struct('<ii')
+_LENGTH = struct.Struct('<i')
+
+
+def encode_packet(request_id: int, packet_type: int, body: Union[str, bytes]) -> bytes:
+    """
+    Encodes a single RCON packet.
+
+    Args:
+        request_id: The client-chosen ID echoed back by the server.
+        packet_type: One of the PACKET_TYPE_* constants.
+        body: The packet payload, encoded as UTF-8 if it is a str.
+
+    Returns:
+        The packet as bytes, including its length prefix.
+    """
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    payload = _HEADER.pack(request_id, packet_type) + body + b'\x00\x00'
+    return _LENGTH.pack(len(payload)) + payload
+
+
+class RCONClient:
+    """An asyncio client for a single RCON connection."""
+
+    def __init__(self, host: str, port: int, timeout: float = 5.0):
+        """
+        Instantiates an unconnected RCON client.
+
+        Args:
+            host: The address of the RCON server.
+            port: The port of the RCON server.
+            timeout: Seconds to wait on any single network operation.
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.authenticated = False
+        self._reader = None
+        self._writer = None
+        self._request_ids = itertools.count(1)
+
+    @property
+    def connected(self) -> bool:
+        """True if the underlying stream is open."""
+        return self._writer is not None and not self._reader.at_eof()
+
+    async def connect(self) -> None:
+        """
+        Opens the TCP connection to the RCON server.
+
+        Raises:
+            McadminbotRCONError: The connection could not be established.
+        """
+        try:
+            with metrics.STAGE_SECONDS.time(stage='rcon_connect'):
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout)
+        except (OSError, asyncio.TimeoutError) as error:
+            raise exceptions.McadminbotRCONError(
+                f"Could not connect to RCON server [{self.host}:{self.port}]") from error
+
+    async def login(self, password: str) -> bool:
+        """
+        Authenticates this connection.
+
+        Args:
+            password: The RCON password of the server.
+
+        Returns:
+            True if the server accepted the password, False if not.
+        """
+        request_id = next(self._request_ids)
+        with metrics.STAGE_SECONDS.time(stage='rcon_login'):
+            await self._send(request_id, PACKET_TYPE_LOGIN, password)
+            response_id, _, _ = await self._read_packet()
+        self.authenticated = response_id == request_id and response_id != AUTH_FAILURE_ID
+        return self.authenticated
+
+    async def command(self, command: str) -> str:
+        """
+        Runs a command on the server and reassembles its possibly fragmented response.
+
+        Args:
+            command: The command to run, without a leading slash.
+
+        Returns:
+            The full response body from the server.
+
+        Raises:
+            McadminbotRCONNotSentError: The connection failed before the command was sent.
+            McadminbotRCONError: The connection failed or is not authenticated.
+        """
+        if not self.authenticated:
+            raise exceptions.McadminbotRCONError('RCON connection is not authenticated')
+        with metrics.STAGE_SECONDS.time(stage='rcon_command'):
+            request_id, sentinel_id = await self._send_command(command)
+            return await self._read_response(request_id, sentinel_id)
+
+    async def pipeline(self, commands: Iterable[str],
+                       window: int = 8) -> AsyncIterator[Tuple[str, str]]:
+        """
+        Runs many commands without waiting for each response before sending the next.
+
+        At most window commands are unanswered at any time, so a long iterable of
+        commands is consumed lazily and never floods the server.
+
+        Args:
+            commands: The commands to run, in order.
+            window: The maximum number of commands in flight.
+
+        Yields:
+            Tuples of (command, full response body), in the order the commands were given.
+
+        Raises:
+            McadminbotRCONError: The connection failed or is not authenticated.
+        """
+        if not self.authenticated:
+            raise exceptions.McadminbotRCONError('RCON connection is not authenticated')
+        commands = iter(commands)
+        in_flight = collections.deque()
+        while True:
+            while len(in_flight) < window:
+                command = next(commands, None)
+                if command is None:
+                    break
+                in_flight.append((command,) + await self._send_command(command))
+            if not in_flight:
+                return
+            command, request_id, sentinel_id = in_flight.popleft()
+            yield command, await self._read_response(request_id, sentinel_id)
+
+    async def close(self) -> None:
+        """Closes the connection. Safe to call more than once."""
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+        self.authenticated = False
+
+    async def _send_command(self, command: str) -> Tuple[int, int]:
+        """
+        Sends a command followed by its sentinel packet.
+
+        Returns:
+            A tuple of (command request ID, sentinel request ID).
+
+        Raises:
+            McadminbotRCONNotSentError: The connection was closed, or failed while
+                the command was written, so the server cannot have run it.
+        """
+        request_id = next(self._request_ids)
+        sentinel_id = next(self._request_ids)
+        if self._reader is None or self._reader.at_eof():
+            await self.close()
+            raise exceptions.McadminbotRCONNotSentError('RCON connection was closed by the server')
+        await self._send(request_id, PACKET_TYPE_COMMAND, command, before_command=True)
+        # The server answers packets in order, so the reply to this
+        # unknown-type packet arrives after the last response fragment
+        await self._send(sentinel_id, PACKET_TYPE_RESPONSE, '')
+        return request_id, sentinel_id
+
+    async def _read_response(self, request_id: int, sentinel_id: int) -> str:
+        """
+        Reads response fragments for request_id until the sentinel is answered.
+
+        Returns:
+            The reassembled response body.
+        """
+        fragments = []
+        while True:
+            response_id, _, body = await self._read_packet(decode=False)
+            if response_id == sentinel_id:
+                break
+            if response_id == request_id:
+                fragments.append(body)
+        # Fragments may split a multi-byte character, so decode only once joined
+        return b''.join(fragments).decode('utf-8', errors='replace')
+
+    async def _send(self, request_id: int, packet_type: int, body: str,
+                    before_command: bool = False) -> None:
+        if self._writer is None:
+            raise exceptions.McadminbotRCONError('RCON connection is not open')
+        try:
+            self._writer.write(encode_packet(request_id, packet_type, body))
+            await asyncio.wait_for(self._writer.drain(), self.timeout)
+        except asyncio.TimeoutError as error:
+            # Caught first: since Python 3.11 it is an OSError, but a command whose
+            # write timed out may still have arrived, so it must not be retried
+            await self.close()
+            raise exceptions.McadminbotRCONError('Failed to send to RCON server') from error
+        except OSError as error:
+            await self.close()
+            # A reset reported while the command is written means it never arrived
+            if before_command:
+                raise exceptions.McadminbotRCONNotSentError(
+                    'Failed to send to RCON server') from error
+            raise exceptions.McadminbotRCONError('Failed to send to RCON server') from error
+
+    async def _read_packet(self, decode: bool = True):
+        """
+        Reads one packet from the stream.
+
+        Args:
+            decode: Decode the body as UTF-8 instead of returning bytes.
+
+        Returns:
+            A tuple of (request ID, packet type, body).
+        """
+        try:
+            raw_length = await asyncio.wait_for(
+                self._reader.readexactly(_LENGTH.size), self.timeout)
+            length = _LENGTH.unpack(raw_length)[0]
+            payload = await asyncio.wait_for(self._reader.readexactly(length), self.timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as error:
+            await self.close()
+            raise exceptions.McadminbotRCONError('Failed to read from RCON server') from error
+
+        request_id, packet_type = _HEADER.unpack_from(payload)
+        body = payload[_HEADER.size:-2]
+        if decode:
+            body = body.decode('utf-8', errors='replace')
+        return request_id, packet_type, body
+
+
+class RCONPool:
+    """A bounded pool of long-lived, authenticated RCONClients for one server."""
+
+    def __init__(self, host: str, port: int, password: str, size: int = 4,
+                 idle_timeout: float = 300.0, timeout: float = 5.0):
+        """
+        Instantiates an empty pool. Connections are opened on demand.
+
+        Args:
+            host: The address of the RCON server.
+            port: The port of the RCON server.
+            password: The RCON password of the server.
+            size: The maximum number of simultaneous connections.
+            idle_timeout: Seconds an unused connection is kept before it is closed.
+            timeout: Seconds to wait on any single network operation.
+        """
+        self.host = host
+        self.port = port
+        self.password = password
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = []
+        self._in_use = 0
+        self._semaphore = asyncio.Semaphore(size)
+        self._counters = {'created': 0, 'reused': 0, 'expired': 0, 'relogins': 0}
+
+    async def command(self, command: str) -> str:
+        """
+        Runs a command over a pooled connection.
+
+        A connection that was reset while idle is replaced with a freshly
+        authenticated one and the command is retried once, but only if it failed
+        before the command was sent. A command that may have reached the server,
+        such as one whose response timed out, is never sent twice.
+
+        Args:
+            command: The command to run, without a leading slash.
+
+        Returns:
+            The raw response body from the server.
+
+        Raises:
+            McadminbotRCONAuthError: The server rejected the password.
+            McadminbotRCONError: The server could not be reached.
+        """
+        async with self._semaphore:
+            client, reused = await self._acquire()
+            try:
+                try:
+                    response = await client.command(command)
+                except exceptions.McadminbotRCONNotSentError:
+                    if not reused:
+                        raise
+                    await client.close()
+                    self._counters['relogins'] += 1
+                    client = await self._open()
+                    response = await client.command(command)
+            except BaseException:
+                await client.close()
+                self._in_use -= 1
+                raise
+            self._release(client)
+            await self._prune()
+            return response
+
+    def session(self) -> 'RCONSession':
+        """
+        Borrows one connection for several commands, for example:
+
+            async with pool.session() as client:
+                async for command, response in client.pipeline(commands):
+                    ...
+
+        Returns:
+            An async context manager that yields an authenticated RCONClient.
+        """
+        return RCONSession(self)
+
+    async def close(self) -> None:
+        """Closes every idle connection in the pool."""
+        idle, self._idle = self._idle, []
+        for client, _ in idle:
+            await client.close()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            A snapshot of the pool's size, occupancy and lifetime counters.
+        """
+        return dict(
+            self._counters, size=self.size, in_use=self._in_use, idle=len(self._idle))
+
+    async def _acquire(self):
+        """
+        Returns:
+            A tuple of (authenticated client, whether it was reused).
+        """
+        self._in_use += 1
+        now = time.monotonic()
+        while self._idle:
+            client, last_used = self._idle.pop()
+            if client.connected and now - last_used < self.idle_timeout:
+                self._counters['reused'] += 1
+                return client, True
+            self._counters['expired'] += 1
+            await client.close()
+        try:
+            return await self._open(), False
+        except BaseException:
+            self._in_use -= 1
+            raise
+
+    async def _open(self) -> RCONClient:
+        client = RCONClient(self.host, self.port, timeout=self.timeout)
+        await client.connect()
+        try:
+            success = await client.login(self.password)
+        except BaseException:
+            await client.close()
+            raise
+        if not success:
+            await client.close()
+            raise exceptions.McadminbotRCONAuthError(
+                f"RCON server [{self.host}:{self.port}] rejected the password")
+        self._counters['created'] += 1
+        return client
+
+    def _release(self, client: RCONClient) -> None:
+        self._in_use -= 1
+        self._idle.append((client, time.monotonic()))
+
+    async def _prune(self) -> None:
+        """Closes idle connections that have outlived idle_timeout."""
+        cutoff = time.monotonic() - self.idle_timeout
+        expired = [entry for entry in self._idle if entry[1] <= cutoff]
+        if expired:
+            self._idle = [entry for entry in self._idle if entry[1] > cutoff]
+            self._counters['expired'] += len(expired)
+            for client, _ in expired:
+                await client.close()
+
+
+class RCONSession:
+    """An async context manager that holds one pooled connection. See RCONPool.session."""
+
+    def __init__(self, pool: RCONPool):
+        self.pool = pool
+        self.client = None
+
+    async def __aenter__(self) -> RCONClient:
+        await self.pool._semaphore.acquire()
+        try:
+            self.client, _ = await self.pool._acquire()
+        except BaseException:
+            self.pool._semaphore.release()
+            raise
+        return self.client
+
+    async def __aexit__(self, exc_type, exc, traceback) -> None:
+        try:
+            if exc_type is None and self.client.connected:
+                self.pool._release(self.client)
+            else:
+                # The connection may be part-way through a response
+                await self.client.close()
+                self.pool._in_use -= 1
+        finally:
+            self.client = None
+            self.pool._semaphore.release()
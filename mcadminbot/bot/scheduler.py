@@ -0,0 +1,244 @@
+"""
+bot/scheduler.py - Rate limiting and priority queueing of RCON commands for one server.
+
+Every RCON command takes one of a server's slots, of which there are as many as
+its pool has connections. When all slots are busy, commands wait in a bounded
+priority queue so that moderation commands run before informational ones.
+Token buckets limit how fast each user, and each kind of command, may send.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Sequence
+
+from . import exceptions
+from . import metrics
+
+# Lower numbers leave the queue first
+PRIORITY_MODERATION = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_INFORMATIONAL = 2
+
+MODERATION_COMMANDS = frozenset(['ban', 'ban-ip', 'kick'])
+INFORMATIONAL_COMMANDS = frozenset(['list', 'banlist', 'say', 'tell'])
+
+QUEUE_WAIT_SECONDS = metrics.Histogram(
+    'mcadminbot_queue_wait_seconds',
+    'Time RCON commands waited for a free connection slot',
+    ['server'])
+
+
+def command_name(command: str) -> str:
+    """
+    Returns:
+        The first word of an RCON command, which rate limits and priorities are keyed on.
+    """
+    return command.split(' ', 1)[0]
+
+
+def priority_of(command: str) -> int:
+    """
+    Returns:
+        The queue priority of an RCON command.
+    """
+    name = command_name(command)
+    if name in MODERATION_COMMANDS:
+        return PRIORITY_MODERATION
+    if name in INFORMATIONAL_COMMANDS or command == 'whitelist list':
+        return PRIORITY_INFORMATIONAL
+    return PRIORITY_DEFAULT
+
+
+class TokenBucket:
+    """Allows bursts of up to 'burst' actions, refilled at 'rate' actions per second."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def try_take(self) -> bool:
+        """
+        Returns:
+            True and takes a token if one is available, False if not.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    @property
+    def full(self) -> bool:
+        """True if the bucket would be full now, so forgetting it changes nothing."""
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.burst
+
+
+class CommandScheduler:
+    """Admits RCON commands for one server in priority order, within rate limits."""
+
+    def __init__(self, name: str, settings: dict):
+        """
+        Args:
+            name: The name of the server, used to label metrics.
+            settings: The config that slot, queue and rate limit settings are read from.
+        """
+        self.name = name
+        self._queue = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._user_buckets = {}
+        self._command_buckets = {}
+        self._counters = {'admitted': 0, 'rate_limited': 0, 'queue_full': 0, 'max_depth': 0}
+        self.configure(settings)
+
+    def configure(self, settings: dict) -> None:
+        """
+        Applies new limits. Rate limit buckets start over full.
+
+        Args:
+            settings: The config that slot, queue and rate limit settings are read from.
+        """
+        self.slots = settings['rcon_pool_size']
+        self.max_queue = settings['rcon_queue_size']
+        self.user_rate = settings['user_rate_limit']
+        self.user_burst = settings['user_rate_burst']
+        self.command_limits = {
+            name: (limit['rate'], limit['burst'])
+            for name, limit in settings['command_rate_limits'].items()
+        }
+        self._user_buckets.clear()
+        self._command_buckets.clear()
+
+    def slot(self, command: str, user=None, follow_up: Sequence[str] = ()) -> 'SchedulerSlot':
+        """
+        Waits for permission to run a command, for example:
+
+            async with scheduler.slot('ban Griefer', ctx.author.id):
+                ...
+
+        Args:
+            command: The RCON command, used for its priority and rate limit.
+            user: The ID of the Discord user running the command, if any.
+            follow_up: Further commands run in the same slot, such as the rest of a
+                macro, which are charged to their command rate limits too.
+
+        Returns:
+            An async context manager that holds a slot while it is entered.
+
+        Raises:
+            McadminbotRateLimitError: A rate limit was exceeded or the queue is full,
+                raised on entering the context manager.
+        """
+        return SchedulerSlot(self, command, user, follow_up)
+
+    async def run(self, command: str, user, fetch):
+        """
+        Runs fetch() once a slot is available. See slot.
+
+        Args:
+            command: The RCON command, used for its priority and rate limit.
+            user: The ID of the Discord user running the command, if any.
+            fetch: A coroutine function that runs the command.
+
+        Returns:
+            The result of fetch().
+        """
+        async with self.slot(command, user):
+            return await fetch()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            The current queue depth, busy slots and lifetime counters.
+        """
+        waits = QUEUE_WAIT_SECONDS
+        return dict(
+            self._counters, queued=len(self._queue), active=self._active,
+            wait_p99_ms=round(waits.quantile(0.99, server=self.name) * 1000, 1))
+
+    def _check_rate_limits(self, commands: Sequence[str], user) -> None:
+        if user is not None and self.user_rate > 0:
+            bucket = self._user_buckets.get(user)
+            if bucket is None:
+                if len(self._user_buckets) > 1000:
+                    self._forget_full_buckets()
+                bucket = self._user_buckets[user] = TokenBucket(self.user_rate, self.user_burst)
+            if not bucket.try_take():
+                self._counters['rate_limited'] += 1
+                raise exceptions.McadminbotRateLimitError(
+                    'You are sending commands too quickly. Please wait a moment.')
+
+        for command in commands:
+            name = command_name(command)
+            if name not in self.command_limits:
+                continue
+            bucket = self._command_buckets.get(name)
+            if bucket is None:
+                bucket = self._command_buckets[name] = TokenBucket(*self.command_limits[name])
+            if not bucket.try_take():
+                self._counters['rate_limited'] += 1
+                raise exceptions.McadminbotRateLimitError(
+                    f"[{name}] is being run too often. Please wait a moment.")
+
+    def _forget_full_buckets(self) -> None:
+        for user in [user for user, bucket in self._user_buckets.items() if bucket.full]:
+            del self._user_buckets[user]
+
+    async def _acquire(self, command: str, user, follow_up: Sequence[str] = ()) -> None:
+        self._check_rate_limits([command, *follow_up], user)
+        start = time.perf_counter()
+        if self._active < self.slots and not self._queue:
+            self._active += 1
+        else:
+            if len(self._queue) >= self.max_queue:
+                self._counters['queue_full'] += 1
+                raise exceptions.McadminbotRateLimitError(
+                    'The server is busy with other commands. Please try again shortly.')
+            waiter = asyncio.get_event_loop().create_future()
+            heapq.heappush(self._queue, (priority_of(command), next(self._sequence), waiter))
+            self._counters['max_depth'] = max(self._counters['max_depth'], len(self._queue))
+            try:
+                # _release hands its slot straight to this waiter
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release()
+                else:
+                    # Leave the queue now, so it no longer counts against max_queue
+                    waiter.cancel()
+                    self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+                    heapq.heapify(self._queue)
+                raise
+        self._counters['admitted'] += 1
+        QUEUE_WAIT_SECONDS.observe(time.perf_counter() - start, server=self.name)
+
+    def _release(self) -> None:
+        while self._queue:
+            _, _, waiter = heapq.heappop(self._queue)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+
+class SchedulerSlot:
+    """An async context manager that holds one scheduler slot. See CommandScheduler.slot."""
+
+    def __init__(self, scheduler: CommandScheduler, command: str, user,
+                 follow_up: Sequence[str] = ()):
+        self.scheduler = scheduler
+        self.command = command
+        self.user = user
+        self.follow_up = follow_up
+
+    async def __aenter__(self) -> None:
+        await self.scheduler._acquire(self.command, self.user, self.follow_up)
+
+    async def __aexit__(self, exc_type, exc, traceback) -> None:
+        self.scheduler._release()
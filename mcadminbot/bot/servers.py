@@ -0,0 +1,242 @@
+"""
+bot/servers.py - Tracks the Minecraft servers fronted by the bot.
+
+load_servers builds one Server per entry of the 'servers' config map, or a single
+server named 'default' from the top-level server_address/rcon_port/rcon_password
+keys when the map is empty. Every Server owns its own RCON connection state.
+
+Commands select a server with a leading '@name' argument, parsed by ServerTarget.
+The reserved selector '@all' targets every server at once.
+"""
+
+from typing import List
+from discord.ext import commands
+
+import mcadminbot.config as config
+from . import breaker
+from . import cache
+from . import exceptions
+from . import gateway
+from . import players
+from . import rcon
+from . import scheduler
+
+DEFAULT_SERVER_NAME = 'default'
+ALL_SERVERS = 'all'
+
+_SERVERS = {}
+_DEFAULT = None
+
+
+class Server:
+    """A single Minecraft server and the connection, queue, cache and player state kept for it."""
+
+    def __init__(self, name: str, address: str, port: int, password: str, settings: dict,
+                 log_file: str = None):
+        """
+        Instantiates a server. No connections are opened until first use.
+
+        Args:
+            name: The name used to target this server from Discord.
+            address: The IP address or domain name of the server.
+            port: The port of the server's RCON server.
+            password: The RCON password of the server.
+            settings: The config that pool, queue and cache settings are read from.
+            log_file: The path of the server's latest.log, if the bot can read it.
+        """
+        self.name = name
+        self.address = address
+        self.port = port
+        self.password = password
+        self.log_file = log_file
+        self.pool_size = settings['rcon_pool_size']
+        self.pool_idle_timeout = settings['rcon_pool_idle_timeout']
+        self.rcon_timeout = settings['rcon_timeout']
+        self.cache = cache.ResponseCache(settings['rcon_cache_ttl'])
+        self.scheduler = scheduler.CommandScheduler(name, settings)
+        self.breaker = breaker.CircuitBreaker(name, settings, self._probe)
+        self.players = players.PlayerTracker(name)
+        self._pool = None
+
+    @property
+    def connection_settings(self) -> tuple:
+        """Everything that a new RCON connection to this server depends on."""
+        return (self.address, self.port, self.password,
+                self.pool_size, self.pool_idle_timeout, self.rcon_timeout)
+
+    @property
+    def pool(self) -> rcon.RCONPool:
+        """
+        The RCON connection pool for this server, created on first use.
+
+        In a shard process this is a GatewayPool that sends commands to the
+        supervising process's pool instead.
+        """
+        if self._pool is None:
+            path = gateway.gateway_path()
+            self._pool = rcon.RCONPool(
+                self.address,
+                self.port,
+                self.password,
+                size=1 if path else self.pool_size,
+                idle_timeout=self.pool_idle_timeout,
+                timeout=self.rcon_timeout)
+            if path:
+                self._pool = gateway.GatewayPool(path, self.name, self._pool)
+        return self._pool
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            The stats of this server's RCON pool, or an empty dict if it was never used.
+        """
+        return self._pool.stats() if self._pool is not None else {}
+
+    async def close(self) -> None:
+        """Stops probing and closes any idle RCON connections held for this server."""
+        self.breaker.close()
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _probe(self) -> None:
+        # Any answer will do; 'list' is cheap and changes nothing
+        await self.pool.command('list')
+
+
+class ServerTarget(commands.Converter):
+    """
+    A command argument converter for '@name' server selectors.
+
+    Use as typing.Optional[ServerTarget] so that the argument may be omitted. Only
+    '@all' and the names of configured servers are selectors, so a message such as
+    '@here restarting' or a player name such as '@Steve' is passed on to the next
+    argument.
+    """
+
+    async def convert(self, ctx, argument: str) -> str:
+        """
+        Returns:
+            The server name without the leading '@'.
+
+        Raises:
+            BadArgument: The argument does not select ALL_SERVERS or a configured server.
+        """
+        name = argument[1:]
+        if not argument.startswith('@') or not name:
+            raise commands.BadArgument(f"[{argument}] is not a server selector")
+        if name != ALL_SERVERS:
+            try:
+                get_server(name)
+            except exceptions.McadminbotUnknownServerError as error:
+                raise commands.BadArgument(f"[{argument}] is not a server selector") from error
+        return name
+
+
+def load_servers(new_config: dict = None) -> List[Server]:
+    """
+    Builds the set of servers from a config and makes it current.
+
+    When servers are already loaded, a server whose connection settings are
+    unchanged is kept along with its open connections, queued commands and
+    cached responses; its rate limits and breaker thresholds are updated in place.
+
+    Args:
+        new_config: The config to build from, or None for the current config.
+
+    Returns:
+        The previously loaded servers that were replaced or removed. Their
+        connections should be closed with Server.close.
+
+    Raises:
+        McadminbotConfigError: A server entry or the default server is invalid.
+    """
+    global _SERVERS, _DEFAULT
+
+    if new_config is None:
+        new_config = config.CONFIG
+
+    entries = new_config.get('servers') or {
+        DEFAULT_SERVER_NAME: {}
+    }
+    if not isinstance(entries, dict):
+        raise exceptions.McadminbotConfigError("'servers' must be a map of server names.")
+
+    # Build and validate every entry before changing anything, so that an invalid
+    # entry leaves the current servers exactly as they were
+    built = {}
+    for name, entry in entries.items():
+        if str(name) == ALL_SERVERS:
+            raise exceptions.McadminbotConfigError(
+                f"[{ALL_SERVERS}] is reserved and cannot be used as a server name.")
+        entry = entry or {}
+        try:
+            server = Server(
+                str(name),
+                entry.get('server_address', new_config['server_address']),
+                int(entry.get('rcon_port', new_config['rcon_port'])),
+                str(entry.get('rcon_password', new_config['rcon_password'])),
+                new_config,
+                # The top-level log_file only belongs to the single default server
+                entry.get('log_file') if new_config.get('servers') else new_config['log_file'])
+        except (AttributeError, TypeError, ValueError) as error:
+            raise exceptions.McadminbotConfigError(
+                f"Server [{name}] in 'servers' is invalid.") from error
+        built[server.name] = server
+
+    default = new_config.get('default_server') or next(iter(built))
+    if default not in built:
+        raise exceptions.McadminbotConfigError(
+            f"'default_server' [{default}] is not one of the configured servers.")
+
+    loaded = {}
+    for name, server in built.items():
+        existing = _SERVERS.get(name)
+        if existing is not None and existing.connection_settings == server.connection_settings:
+            existing.cache.ttl = server.cache.ttl
+            existing.scheduler.configure(new_config)
+            existing.breaker.configure(new_config)
+            existing.log_file = server.log_file
+            server = existing
+        loaded[name] = server
+
+    retired = [server for name, server in _SERVERS.items() if loaded.get(name) is not server]
+    _SERVERS = loaded
+    _DEFAULT = default
+    return retired
+
+
+def get_server(name: str = None) -> Server:
+    """
+    Args:
+        name: The name of a configured server, or None for the default server.
+
+    Returns:
+        The matching Server.
+
+    Raises:
+        McadminbotUnknownServerError: No server is configured with that name.
+    """
+    if not _SERVERS:
+        load_servers()
+    try:
+        return _SERVERS[name or _DEFAULT]
+    except KeyError as error:
+        raise exceptions.McadminbotUnknownServerError(
+            f"There is no server named [{name}].") from error
+
+
+def all_servers() -> List[Server]:
+    """
+    Returns:
+        Every configured Server, in config order.
+    """
+    if not _SERVERS:
+        load_servers()
+    return list(_SERVERS.values())
+
+
+async def close_servers() -> None:
+    """Closes the RCON connections held for every server."""
+    for server in _SERVERS.values():
+        await server.close()
@@ -0,0 +1,475 @@
+"""
+bot/slash.py - Exposes the bot's commands as Discord slash commands.
+
+discord.py 1.x has no support for application commands, so the SlashCommands cog
+registers them over HTTP and handles the raw INTERACTION_CREATE gateway events
+itself. A slash command runs the same cog command as its prefix form, with the
+same checks, error handlers, audit hooks and metrics, through a SlashContext
+that answers the interaction instead of a message.
+
+Every command is acknowledged with a deferred response as soon as it arrives, so
+Discord shows that the bot is working while a slow RCON command runs. Server and
+player name options autocomplete from memory: player names come from the players
+each server's PlayerTracker has seen online, so no server is contacted.
+"""
+
+import inspect
+import json
+from typing import Dict, List, Optional, Tuple
+
+import discord
+from discord.ext import commands
+from discord.ext.commands.view import StringView
+from discord.http import Route
+from loguru import logger
+
+import mcadminbot.config as config
+from . import exceptions
+from . import handoff
+from . import metrics
+from . import servers
+from . import utils
+from .servers import ALL_SERVERS
+
+# Interaction and interaction response types
+APPLICATION_COMMAND = 2
+AUTOCOMPLETE = 4
+CHANNEL_MESSAGE = 4
+DEFERRED_CHANNEL_MESSAGE = 5
+AUTOCOMPLETE_RESULT = 8
+
+# Application command option types
+SUB_COMMAND = 1
+STRING = 3
+INTEGER = 4
+
+# The most choices Discord shows for an autocompleted option
+MAX_CHOICES = 25
+
+# The most characters Discord accepts in a command or option description
+MAX_DESCRIPTION = 100
+
+TARGET_OPTION = 'target'
+PLAYER_OPTIONS = frozenset(['username', 'player'])
+
+OPTION_DESCRIPTIONS = {
+    'target': "The server to run the command on, or 'all'",
+    'username': 'The Minecraft username of the player',
+    'player': 'The Minecraft username or IP address',
+    'ip_address': 'The IP address, or the username of an online player',
+    'message': 'The message to send',
+    'reason': 'The reason shown to the player',
+    'path': "A file path relative to the bot's import directory",
+    'name': 'The name of the scheduled command or macro',
+    'every': 'How often to run it, such as 15m, 6h or 1d',
+    'delay': 'How long from now to run it, such as 15m',
+    'command': "The Minecraft command to run, without a leading '/'",
+    'arguments': 'The values of the macro placeholders, in order',
+    'steps': 'Each command in double quotes, with {placeholders} for arguments',
+}
+
+
+class _Route(Route):
+    """A discord.py Route on the API version that supports application commands."""
+
+    BASE = 'https://discord.com/api/v10'
+
+    def __init__(self, method: str, path: str, **parameters):
+        super().__init__(method, path, **parameters)
+        self.token = parameters.get('token')
+
+    @property
+    def bucket(self) -> str:
+        # discord.py serializes requests in the same bucket. Interaction tokens are
+        # rate limited separately, so replies to different commands need not wait.
+        return f"{self.token}:{self.path}"
+
+
+def command_definitions(cogs) -> Tuple[List[dict], Dict[Tuple[str, ...], commands.Command]]:
+    """
+    Describes the commands of some cogs as Discord application commands.
+
+    A group becomes a slash command with a subcommand for each of its commands. A
+    group that is also a command by itself, like 'ban', stays a slash command with
+    options, and each of its subcommands becomes a slash command named
+    '<group>-<subcommand>'.
+
+    Args:
+        cogs: The cogs whose commands are exposed.
+
+    Returns:
+        A tuple of (the application command definitions, a map of each slash command
+        name, followed by its subcommand name if it has one, to the command it runs).
+    """
+    definitions = []
+    routes = {}
+    for cog in cogs:
+        for command in cog.get_commands():
+            if not isinstance(command, commands.Group):
+                definitions.append(_definition(command, command.name))
+                routes[(command.name,)] = command
+            elif command.invoke_without_command:
+                definitions.append(_definition(command, command.name))
+                routes[(command.name,)] = command
+                for subcommand in command.commands:
+                    name = f"{command.name}-{subcommand.name}"
+                    definitions.append(_definition(subcommand, name))
+                    routes[(name,)] = subcommand
+            else:
+                definitions.append({
+                    'name': command.name,
+                    'description': _description(command),
+                    'options': [dict(_definition(subcommand, subcommand.name), type=SUB_COMMAND)
+                                for subcommand in command.commands],
+                })
+                for subcommand in command.commands:
+                    routes[(command.name, subcommand.name)] = subcommand
+    return definitions, routes
+
+
+def _definition(command: commands.Command, name: str) -> dict:
+    options = []
+    for parameter in command.clean_params.values():
+        options.append({
+            'type': INTEGER if parameter.annotation is int else STRING,
+            'name': parameter.name,
+            'description': OPTION_DESCRIPTIONS.get(parameter.name, parameter.name),
+            'required': _is_required(parameter),
+            'autocomplete': parameter.name == TARGET_OPTION or parameter.name in PLAYER_OPTIONS,
+        })
+    # Discord requires every required option to come before the optional ones
+    options.sort(key=lambda option: not option['required'])
+    return {'name': name, 'description': _description(command), 'options': options}
+
+
+def _description(command: commands.Command) -> str:
+    description = ' '.join(command.short_doc.split()) or command.name
+    return description[:MAX_DESCRIPTION]
+
+
+def _is_required(parameter: inspect.Parameter) -> bool:
+    optional = type(None) in getattr(parameter.annotation, '__args__', ())
+    return (parameter.default is inspect.Parameter.empty and not optional
+            and parameter.kind is not inspect.Parameter.VAR_POSITIONAL)
+
+
+def command_text(command: commands.Command, options: dict) -> str:
+    """
+    Writes slash command options as the arguments of the command's prefix form.
+
+    Every value is quoted, so the command's converters see each one as a single
+    argument, except that of a variable number of arguments, which is given as it
+    would be typed after the command. The target is always given, defaulting to the default server, so that
+    a message starting with '@' is never mistaken for a server selector.
+
+    Args:
+        command: The command being run.
+        options: The option values, keyed by parameter name.
+
+    Returns:
+        The arguments, to be parsed as if they followed the command in a message.
+    """
+    words = []
+    for name in command.clean_params:
+        value = options.get(name)
+        if name == TARGET_OPTION:
+            words.append(f"@{str(value or servers.get_server().name).lstrip('@')}")
+        elif command.clean_params[name].kind is inspect.Parameter.VAR_POSITIONAL:
+            if value is not None:
+                words.append(str(value))
+        elif value is not None:
+            # A quoted argument cannot end in a backslash, which would escape the quote
+            words.append('"' + str(value).rstrip('\\').replace('"', '\\"') + '"')
+    return ' '.join(words)
+
+
+def player_names(target: Optional[str], prefix: str) -> List[str]:
+    """
+    Args:
+        target: The server whose online players are wanted, or None or 'all' for every server.
+        prefix: The start of the name being typed, matched case-insensitively.
+
+    Returns:
+        Up to MAX_CHOICES online player names, sorted case-insensitively.
+    """
+    if target and target.lstrip('@') != ALL_SERVERS:
+        try:
+            trackers = [servers.get_server(target.lstrip('@')).players]
+        except exceptions.McadminbotUnknownServerError:
+            return []
+    else:
+        trackers = [server.players for server in servers.all_servers()]
+    prefix = prefix.lower()
+    names = {name for tracker in trackers for name in tracker.online
+             if name.lower().startswith(prefix)}
+    return sorted(names, key=str.lower)[:MAX_CHOICES]
+
+
+class Interaction:
+    """Answers one interaction through Discord's interaction webhooks."""
+
+    def __init__(self, http, payload: dict):
+        """
+        Args:
+            http: The bot's discord.http.HTTPClient.
+            payload: The INTERACTION_CREATE event data.
+        """
+        self.http = http
+        self.id = payload['id']
+        self.token = payload['token']
+        self.application_id = payload['application_id']
+        self.responded = False
+
+    async def respond(self, response_type: int, data: dict = None) -> None:
+        """Sends the initial response, which Discord requires within 3 seconds."""
+        payload = {'type': response_type}
+        if data is not None:
+            payload['data'] = data
+        await self.http.request(_Route(
+            'POST', '/interactions/{interaction_id}/{token}/callback',
+            interaction_id=self.id, token=self.token), json=payload)
+
+    async def send(self, content: str = None, file: discord.File = None,
+                   embed: discord.Embed = None,
+                   allowed_mentions: discord.AllowedMentions = None) -> 'InteractionMessage':
+        """
+        Replaces the deferred response with the first message, and follows up with the rest.
+
+        Returns:
+            The message that was sent, which can be edited.
+        """
+        payload = {'content': content or ''}
+        if embed is not None:
+            payload['embeds'] = [embed.to_dict()]
+        if allowed_mentions is not None:
+            payload['allowed_mentions'] = allowed_mentions.to_dict()
+        if not self.responded:
+            self.responded = True
+            message_id = '@original'
+            await self._request('PATCH', '/webhooks/{application_id}/{token}/messages/@original',
+                                payload, file)
+        else:
+            message = await self._request('POST', '/webhooks/{application_id}/{token}',
+                                          payload, file)
+            message_id = message['id']
+        return InteractionMessage(self, message_id)
+
+    async def edit(self, message_id: str, content: str) -> None:
+        """Changes the content of a message sent with send."""
+        await self._request('PATCH', '/webhooks/{application_id}/{token}/messages/{message_id}',
+                            {'content': content}, message_id=message_id)
+
+    async def _request(self, method: str, path: str, payload: dict,
+                       file: discord.File = None, **parameters):
+        route = _Route(method, path, application_id=self.application_id, token=self.token,
+                       **parameters)
+        if file is None:
+            return await self.http.request(route, json=payload)
+        payload['attachments'] = [{'id': 0, 'filename': file.filename}]
+        form = [
+            {'name': 'payload_json', 'value': json.dumps(payload)},
+            {'name': 'files[0]', 'value': file.fp, 'filename': file.filename,
+             'content_type': 'application/octet-stream'},
+        ]
+        return await self.http.request(route, form=form, files=[file])
+
+
+class InteractionMessage:
+    """A message sent in answer to an interaction, standing in for discord.Message."""
+
+    def __init__(self, interaction: Interaction, message_id: str):
+        self.interaction = interaction
+        self.id = message_id
+
+    async def edit(self, *, content: str = None) -> None:
+        """See discord.Message.edit."""
+        await self.interaction.edit(self.id, content)
+
+
+class _SlashMessage:
+    """The attributes of discord.Message that commands and their context read."""
+
+    def __init__(self, bot: commands.Bot, payload: dict, author):
+        self._state = bot._connection
+        self.id = int(payload['id'])
+        self.author = author
+        self.channel = bot.get_channel(int(payload.get('channel_id') or 0))
+        self.guild = getattr(author, 'guild', None)
+        self.attachments = []
+        self.edited_at = None
+        self.created_at = discord.utils.snowflake_time(self.id)
+
+
+class SlashContext(commands.Context):
+    """A command context whose replies answer an interaction."""
+
+    def __init__(self, bot: commands.Bot, interaction: Interaction, **attrs):
+        """
+        Args:
+            bot: The running bot.
+            interaction: The interaction being answered.
+            attrs: Passed on to discord.ext.commands.Context.
+        """
+        super().__init__(bot=bot, prefix='/', **attrs)
+        self.interaction = interaction
+
+    async def send(self, content=None, *, file: discord.File = None, embed: discord.Embed = None,
+                   allowed_mentions: discord.AllowedMentions = None, **kwargs):
+        """
+        Overrides discord.ext.commands.Context.send.
+
+        Records the time spent sending under the 'discord_send' stage. Like a
+        message, a reply takes the bot's allowed_mentions, overridden by the given ones.
+
+        Raises:
+            TypeError: An option that interaction replies do not support was given.
+        """
+        if kwargs:
+            raise TypeError(
+                f"Slash command replies do not support {', '.join(sorted(kwargs))}")
+        if self.bot.allowed_mentions is not None:
+            allowed_mentions = (self.bot.allowed_mentions if allowed_mentions is None
+                                else self.bot.allowed_mentions.merge(allowed_mentions))
+        with metrics.STAGE_SECONDS.time(stage='discord_send'):
+            return await self.interaction.send(
+                None if content is None else str(content), file, embed, allowed_mentions)
+
+
+class SlashCommands(commands.Cog):
+    """A subclass of discord.ext.commands.Cog that serves the other cogs as slash commands."""
+
+    def __init__(self, bot: commands.Bot, cogs):
+        """
+        Instantiates an instance of this cog to be used by Mcadminbot.
+
+        Args:
+            bot: An instance of discord.ext.commands.Bot.
+            cogs: The cogs whose commands are exposed.
+        """
+        self.bot = bot
+        self.definitions, self.routes = command_definitions(cogs)
+        self._registered = False
+
+    @commands.Cog.listener()
+    async def on_ready(self) -> None:
+        """Registers the slash commands once, from the process running shard 0."""
+        if self._registered or not getattr(self.bot, 'primary', True):
+            return
+        self._registered = True
+        application_id = (await self.bot.application_info()).id
+        guild_ids = config.CONFIG['slash_command_guilds']
+        try:
+            if guild_ids:
+                for guild_id in guild_ids:
+                    await self.bot.http.request(_Route(
+                        'PUT', '/applications/{application_id}/guilds/{guild_id}/commands',
+                        application_id=application_id, guild_id=guild_id), json=self.definitions)
+            else:
+                await self.bot.http.request(_Route(
+                    'PUT', '/applications/{application_id}/commands',
+                    application_id=application_id), json=self.definitions)
+        except discord.HTTPException as error:
+            logger.error(f"Could not register slash commands: {error}")
+            return
+        logger.info(f"Registered {len(self.definitions)} slash commands")
+
+    @commands.Cog.listener()
+    async def on_socket_response(self, message: dict) -> None:
+        """Handles the INTERACTION_CREATE events that discord.py 1.x does not parse."""
+        if message.get('t') != 'INTERACTION_CREATE':
+            return
+        payload = message['d']
+        standby = getattr(self.bot, 'standby', None)
+        try:
+            if standby is not None or getattr(self.bot, 'handing_off', False):
+                # An interaction would expire before a buffered one could run, so the
+                # running bot answers them until it is told to hand off, and the
+                # successor turns commands away from then until it has taken over
+                if (standby is not None and standby.signalled
+                        and payload['type'] == APPLICATION_COMMAND):
+                    await Interaction(self.bot.http, payload).respond(
+                        CHANNEL_MESSAGE, {'content': handoff.RESTARTING_MESSAGE})
+                return
+            if payload['type'] == APPLICATION_COMMAND:
+                await self._run(payload)
+            elif payload['type'] == AUTOCOMPLETE:
+                await self._autocomplete(payload)
+        except discord.HTTPException as error:
+            logger.error(f"Could not answer a slash command: {error}")
+
+    async def _run(self, payload: dict) -> None:
+        """Defers the response, then runs the command as if it had been sent as a message."""
+        interaction = Interaction(self.bot.http, payload)
+        name, options = _resolve(payload['data'])
+        command = self.routes.get(name)
+        if command is None:
+            logger.warning(f"Received unknown slash command [{' '.join(name)}]")
+            return
+        await interaction.respond(DEFERRED_CHANNEL_MESSAGE)
+
+        author = self._author(payload)
+        ctx = SlashContext(
+            self.bot, interaction, message=_SlashMessage(self.bot, payload, author),
+            command=command, invoked_with=name[-1],
+            view=StringView(command_text(command, options)))
+        logger.debug(f"[{author}] ran slash command [{' '.join(name)}]")
+        await self.bot.invoke(ctx)
+        if not interaction.responded:
+            # A command that failed without explaining itself would otherwise
+            # leave Discord showing that the bot is still thinking
+            await ctx.send('The command failed.' if ctx.command_failed else 'Done.')
+
+    async def _autocomplete(self, payload: dict) -> None:
+        """Suggests server names for the target and online players for player names."""
+        name, options = _resolve(payload['data'])
+        command = self.routes.get(name)
+        focused = options.pop(None, None)
+        choices = []
+        if command is not None and focused is not None and self._allowed(payload, command):
+            option, typed = focused
+            if option == TARGET_OPTION:
+                names = [server.name for server in servers.all_servers()] + [ALL_SERVERS]
+                choices = [server for server in names
+                           if server.lower().startswith(typed.lstrip('@').lower())]
+            elif option in PLAYER_OPTIONS:
+                choices = player_names(options.get(TARGET_OPTION), typed)
+        await Interaction(self.bot.http, payload).respond(AUTOCOMPLETE_RESULT, {
+            'choices': [{'name': choice, 'value': choice} for choice in choices[:MAX_CHOICES]]})
+
+    def _author(self, payload: dict):
+        """Builds the member who ran a command, with their roles, or the user in a DM."""
+        guild = self.bot.get_guild(int(payload['guild_id'])) if payload.get('guild_id') else None
+        if guild is not None and 'member' in payload:
+            return discord.Member(data=payload['member'], guild=guild, state=self.bot._connection)
+        user = payload.get('user') or payload['member']['user']
+        return discord.User(state=self.bot._connection, data=user)
+
+    def _allowed(self, payload: dict, command: commands.Command) -> bool:
+        """Whether the user may run a command, so that suggestions reveal nothing to others."""
+        author = self._author(payload)
+        root = command.root_parent or command
+        return utils.is_admin(author) or config.get_grant(root.name).allows(
+            author.name, author.id, getattr(author, 'roles', ()))
+
+
+def _resolve(data: dict) -> Tuple[Tuple[str, ...], dict]:
+    """
+    Args:
+        data: The data of an application command or autocomplete interaction.
+
+    Returns:
+        A tuple of (the command name, followed by the subcommand name if there is
+        one, the option values keyed by name). The option being autocompleted is
+        also keyed by None, as a tuple of its name and what has been typed.
+    """
+    name = [data['name']]
+    options = data.get('options') or []
+    if options and options[0]['type'] == SUB_COMMAND:
+        name.append(options[0]['name'])
+        options = options[0].get('options') or []
+    values = {}
+    for option in options:
+        values[option['name']] = option.get('value')
+        if option.get('focused'):
+            values[None] = (option['name'], str(option.get('value') or ''))
+    return tuple(name), values
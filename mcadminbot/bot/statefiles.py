@@ -0,0 +1,100 @@
+"""
+bot/statefiles.py - Reads and writes the files in which the bot keeps state between
+    runs, such as saved jobs and macros and the audit database.
+
+State files are created readable and writable only by the bot's user, in directories
+only it can list, and are only read back if no one else could have written them,
+like the config snapshot.
+"""
+
+import os
+import pathlib
+from typing import IO
+
+
+def state_path(path: str) -> pathlib.Path:
+    """
+    Returns:
+        The configured path of a state file with a leading ~ expanded.
+    """
+    return pathlib.Path(path).expanduser()
+
+
+def secure(path: str) -> pathlib.Path:
+    """
+    Creates a state file and its directory if they do not exist, readable only by
+    this user, such as before SQLite opens it.
+
+    Args:
+        path: The configured path of the file.
+
+    Returns:
+        The expanded path.
+
+    Raises:
+        PermissionError: The file could have been written by another user.
+    """
+    target = state_path(path)
+    target.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    os.close(os.open(str(target), os.O_WRONLY | os.O_CREAT, 0o600))
+    _check(os.stat(str(target)), target)
+    return target
+
+
+def open_private(path: str) -> IO[str]:
+    """
+    Opens a state file for reading.
+
+    Args:
+        path: The configured path of the file.
+
+    Returns:
+        The open file.
+
+    Raises:
+        FileNotFoundError: There is no such file.
+        PermissionError: The file could have been written by another user.
+    """
+    target = state_path(path)
+    state_file = target.open('r')
+    try:
+        _check(os.fstat(state_file.fileno()), target)
+    except PermissionError:
+        state_file.close()
+        raise
+    return state_file
+
+
+def write_private(path: str, text: str) -> os.stat_result:
+    """
+    Atomically replaces a state file with one readable only by this user.
+
+    Args:
+        path: The configured path of the file.
+        text: The new content of the file.
+
+    Returns:
+        The status of the written file.
+
+    Raises:
+        OSError: The file could not be written.
+    """
+    target = state_path(path)
+    temporary = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    target.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    try:
+        descriptor = os.open(str(temporary), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, 'w') as state_file:
+            state_file.write(text)
+        os.replace(str(temporary), str(target))
+    except OSError:
+        if temporary.exists():
+            temporary.unlink()
+        raise
+    return os.stat(str(target))
+
+
+def _check(stat: os.stat_result, path: pathlib.Path) -> None:
+    """Raises PermissionError if a file is not owned by this user or is writable by others."""
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+        raise PermissionError(f"{path} is not owned by this user or is writable by others")
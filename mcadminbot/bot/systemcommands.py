@@ -9,6 +9,8 @@ from loguru import logger
 
 import mcadminbot.config as config
 from . import exceptions
+from . import metrics
+from . import servers
 from . import utils
 from . import __version__
 
@@ -59,4 +61,44 @@ class SystemCommands(commands.Cog):
         Sends bot information to the Discord channel it was requested from.
         """
         logger.info(f"Bot info requested by user [{ctx.author.name}]")
-        await ctx.send(f"mcadminbot version {__version__}")
+        lines = [f"mcadminbot version {__version__}"]
+        for server in servers.all_servers():
+            pool_stats = utils.format_stats(server.stats()) or 'not connected'
+            lines.append(f"[{server.name}] RCON pool: {pool_stats}")
+            cache_stats = utils.format_stats(server.cache.stats())
+            lines.append(f"[{server.name}] Response cache: {cache_stats}")
+            lines.append(f"[{server.name}] Command queue: "
+                         f"{utils.format_stats(server.scheduler.stats())}")
+            lines.append(f"[{server.name}] Circuit breaker: "
+                         f"{utils.format_stats(server.breaker.stats())}")
+        await ctx.send('\n'.join(lines))
+
+    @commands.command(
+        name='bot-stats',
+        help='Send command latency and throughput statistics to the Discord channel.'
+    )
+    async def stats(self, ctx) -> None:
+        """
+        Sends per-stage command latency and throughput to the Discord channel
+        it was requested from.
+        """
+        logger.info(f"Bot stats requested by user [{ctx.author.name}]")
+        await ctx.send('\n'.join(metrics.summary()))
+
+    @commands.command(help='Show the latest admin actions taken on a player or IP address')
+    async def audit(self, ctx, player: str) -> None:
+        """
+        Sends the latest audited commands that targeted a player or IP address.
+
+        Args:
+            player: The Minecraft username or IP address, matched case-insensitively.
+        """
+        logger.info(f"Audit log for [{player}] requested by user [{ctx.author.name}]")
+        if self.bot.audit is None:
+            await ctx.send("The audit log is disabled; set 'audit_database' to enable it.")
+            return
+        entries = await self.bot.audit.query(player)
+        if not entries:
+            await ctx.send(f"No admin actions have been recorded for [{player}].")
+            return
+        await utils.send_response(ctx, '\n'.join(entry.format() for entry in entries))
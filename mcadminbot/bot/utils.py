@@ -2,13 +2,43 @@
 bot/utils.py - common utility functions used by other bot-related modules
 """
 
-import mctools
+import asyncio
+import io
 import re
+import discord
 from loguru import logger
-from typing import List
+from typing import Awaitable, Callable, Iterator, List, Tuple
 
 import mcadminbot.config as config
 from . import exceptions
+from . import metrics
+from . import servers
+
+# The most characters Discord accepts in one message
+DISCORD_MESSAGE_LIMIT = 2000
+
+# Read-only queries whose responses are served from each server's ResponseCache
+CACHED_COMMANDS = frozenset(['list', 'whitelist list', 'banlist'])
+
+# The cached queries made stale by each mutating command, keyed on its first word.
+# op and deop change nothing that a cached query reports.
+INVALIDATED_BY = {
+    'whitelist': ('whitelist list',),
+    'ban': ('banlist', 'list'),
+    'ban-ip': ('banlist', 'list'),
+    'pardon': ('banlist',),
+    'pardon-ip': ('banlist',),
+    'kick': ('list',),
+}
+
+# The starts of the responses with which a Minecraft server rejects a command
+REJECTED_PREFIXES = (
+    'Unknown or incomplete command', 'Unknown command', 'Incorrect argument for command',
+    'Expected ', 'Invalid ', 'No player was found', 'That player does not exist',
+)
+
+# Marks where a command failed to parse
+PARSE_ERROR_MARKER = '<--[HERE]'
 
 # https://stackoverflow.com/questions/14693701/how-can-i-remove-the-ansi-escape-sequences-from-a-string-in-python
 
@@ -27,63 +57,255 @@ def ansi_escape(dirty_string: str) -> str:
     return ansi_escape_regex.sub('', dirty_string)
 
 
-def rcon_command(command: str) -> str:
+def split_message(text: str, limit: int = DISCORD_MESSAGE_LIMIT) -> Iterator[str]:
+    """
+    Splits text into pieces that each fit in one Discord message.
+
+    Pieces end at the last newline, ', ' or space that fits, in that order of
+    preference, so that player names are not cut in half.
+
+    Args:
+        text: The text to split.
+        limit: The maximum length of each piece.
+
+    Yields:
+        The pieces of text, in order.
+    """
+    start = 0
+    while len(text) - start > limit:
+        end = start + limit
+        for separator in ('\n', ', ', ' '):
+            index = text.rfind(separator, start + 1, end - len(separator) + 1)
+            if index != -1:
+                cut = index + len(separator)
+                break
+        else:
+            cut = end
+        yield text[start:cut]
+        start = cut
+    if start < len(text):
+        yield text[start:]
+
+
+def is_rejected(response: str) -> bool:
+    """
+    Returns:
+        Whether a response says that the server rejected its command.
+    """
+    return response.startswith(REJECTED_PREFIXES) or PARSE_ERROR_MARKER in response
+
+
+async def send_response(ctx, response: str) -> None:
+    """
+    Sends an RCON response to Discord, however long it is.
+
+    Responses longer than 'discord_attachment_threshold' characters are attached
+    as a text file; shorter ones are split across as many messages as needed.
+
+    Args:
+        ctx: The context of the command that produced the response.
+        response: The response to send.
+    """
+    if len(response) > config.CONFIG['discord_attachment_threshold']:
+        filename = f"{ctx.command.qualified_name.replace(' ', '-')}.txt"
+        await ctx.send(
+            f"The response is {len(response)} characters long, so it is attached as [{filename}]",
+            file=discord.File(io.BytesIO(response.encode('utf-8')), filename=filename))
+        return
+    for message in split_message(response):
+        await ctx.send(message)
+
+
+async def find_channel(bot, channel_id: int):
+    """
+    Finds a channel by ID, even one in a guild served by another shard process.
+
+    Args:
+        bot: The running bot.
+        channel_id: The ID of the channel.
+
+    Returns:
+        The channel, from the cache if it is there.
+
+    Raises:
+        HTTPException: The channel does not exist or the bot cannot see it.
     """
-    Connects to the configured Minecraft server's RCON server and executes the provided command.
+    return bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+
+
+def format_stats(stats: dict) -> str:
+    """
+    Formats a stats dict for display in Discord.
 
     Args:
+        stats: A dict of counter names to values.
+
+    Returns:
+        The stats as comma-separated 'key: value' pairs.
+    """
+    return ', '.join(f"{key}: {value}" for key, value in stats.items())
+
+
+async def _server_command(server: servers.Server, command: str, timeout: float = None,
+                          user=None) -> Tuple[bool, str]:
+    """
+    Executes a command on a single server, converting RCON failures into messages.
+
+    Responses to CACHED_COMMANDS are served from the server's cache, and
+    mutating commands invalidate the cached queries that they make stale.
+    Responses to 'list' also update the server's PlayerTracker. Commands that
+    reach the server wait their turn in its CommandScheduler, and fail fast
+    without waiting while its CircuitBreaker is open.
+
+    Args:
+        server: The targeted server.
         command: The command to run on the Minecraft server.
+        timeout: Seconds to wait for the whole command, or None to rely on rcon_timeout.
+        user: The ID of the Discord user running the command, for rate limiting.
 
     Returns:
-        The response from the RCON server or a notification of connection failure.
+        A tuple of (whether the command reached the server, response or failure message).
     """
-    rcon = mctools.RCONClient(
-        config.CONFIG['server_address'], config.CONFIG['rcon_port'])
+    if command in CACHED_COMMANDS:
+        request = server.cache.get(
+            command, lambda: _guarded_command(server, command, user, server.pool.command))
+    else:
+        request = _guarded_command(
+            server, command, user, lambda command: _invalidating_command(server, command))
 
     try:
-        success = rcon.login(config.CONFIG['rcon_password'])
-    except ConnectionResetError:
+        response = ansi_escape(await asyncio.wait_for(request, timeout))
+        if command == 'list':
+            server.players.observe_list(response)
+        return True, response
+    except exceptions.McadminbotRateLimitError as error:
+        response = error.message
+        logger.warning(f"[{server.name}] [{command}] was not run: {response}")
+    except exceptions.McadminbotCircuitOpenError as error:
+        response = error.message
+        logger.debug(f"[{server.name}] [{command}] failed fast: {response}")
+    except exceptions.McadminbotRCONAuthError:
+        response = 'RCON authentication failed. Please check your RCON password in your config.'
+        logger.error(f"[{server.name}] {response}")
+    except exceptions.McadminbotRCONError as error:
         response = 'The RCON server is unreachable.'
-        logger.error(response)
-        rcon.stop()
-        return response
+        logger.error(f"[{server.name}] {response} ({error})")
+    except asyncio.TimeoutError:
+        response = f"The RCON server did not respond within {timeout} seconds."
+        logger.error(f"[{server.name}] {response}")
+    return False, response
+
+
+def _guarded_command(server: servers.Server, command: str, user,
+                     send: Callable[[str], Awaitable[str]]) -> Awaitable[str]:
+    return server.breaker.call(
+        lambda: server.scheduler.run(command, user, lambda: send(command)))
+
+
+async def _invalidating_command(server: servers.Server, command: str) -> str:
+    try:
+        return await server.pool.command(command)
+    finally:
+        server.cache.invalidate(*INVALIDATED_BY.get(command.split(' ', 1)[0], ()))
+
+
+async def rcon_command(command: str, server_name: str = None, user=None, ctx=None) -> str:
+    """
+    Executes the provided command on a configured Minecraft server's RCON server.
 
-    if success:
-        response = ansi_escape(rcon.command(command))
+    The command runs over a pooled, already-authenticated connection and all
+    network I/O is awaited so that the Discord event loop is never blocked.
+
+    Args:
+        command: The command to run on the Minecraft server.
+        server_name: The name of the targeted server, None for the default server,
+            or servers.ALL_SERVERS to run it on every server with rcon_broadcast.
+        user: The ID of the Discord user running the command, for rate limiting.
+        ctx: The context of the bot command running it, if any. Its rcon_outcome is
+            set to 'failed' if the command did not reach a targeted server, or
+            'rejected' if a server rejected it, for the audit log.
+
+    Returns:
+        The response from the RCON server or a notification of connection or
+        rate limit failure.
+
+    Raises:
+        McadminbotUnknownServerError: No server is configured with that name.
+    """
+    if server_name == servers.ALL_SERVERS:
+        results, response = await _broadcast(command, user)
     else:
-        response = 'RCON authentication failed. Please check your RCON password in your config.'
-        logger.error(response)
-    rcon.stop()
+        result = await _server_command(servers.get_server(server_name), command, user=user)
+        results, response = [result], result[1]
+    if ctx is not None:
+        if not all(success for success, _ in results):
+            ctx.rcon_outcome = 'failed'
+        elif any(is_rejected(response) for _, response in results):
+            ctx.rcon_outcome = 'rejected'
     return response
 
 
-def is_admin(username: str, user_roles: List[str]) -> bool:
+async def rcon_broadcast(command: str, user=None) -> str:
+    """
+    Executes the provided command on every configured server concurrently.
+
+    Each server gets at most 'broadcast_timeout' seconds, so one slow or
+    unreachable server does not hold up the reply for the others.
+
+    Args:
+        command: The command to run on the Minecraft servers.
+        user: The ID of the Discord user running the command, for rate limiting.
+
+    Returns:
+        One aggregated reply listing the result from each server.
+    """
+    _, response = await _broadcast(command, user)
+    return response
+
+
+async def _broadcast(command: str, user=None) -> Tuple[List[Tuple[bool, str]], str]:
+    """
+    Returns:
+        A tuple of (the result of _server_command on each server, the aggregated reply).
+    """
+    targets = servers.all_servers()
+    results = await asyncio.gather(*(
+        _server_command(server, command, timeout=config.CONFIG['broadcast_timeout'], user=user)
+        for server in targets
+    ))
+
+    succeeded = sum(1 for success, _ in results if success)
+    lines = [f"Succeeded on {succeeded}/{len(targets)} servers"]
+    for server, (success, response) in zip(targets, results):
+        status = 'OK' if success else 'FAILED'
+        lines.append(f"[{server.name}] {status}: {response}" if response
+                     else f"[{server.name}] {status}")
+    return results, '\n'.join(lines)
+
+
+def is_admin(author) -> bool:
     """
     Checks to see if a Discord user is configured as an administrator
     of the configured Minecraft server targeted by a command.
 
-    Admin status is granted by the username being included in the
-    'admin_users' list or if one of the user's roles is included
-    in the 'admin_roles' list.
+    Admin status is granted by the username or user ID being included in the
+    'admin_users' list or if one of the user's role names or role IDs is
+    included in the 'admin_roles' list.
 
     Args:
-        username: The Discord username that ran a command.
-        user_roles: The roles of the Discord user that ran a command.
+        author: The Discord user or member that ran a command.
 
     Returns:
         True if the user is an admin, False if not.
     """
-    if 'ALL' in config.CONFIG['admin_users'] or 'ALL' in config.CONFIG['admin_roles']:
-        return True
-    elif username in config.CONFIG['admin_users']:
-        return True
-    else:
-        return not set(user_roles).isdisjoint(set(config.CONFIG['admin_roles']))
+    return config.PERMISSIONS.admin.allows(
+        author.name, author.id, getattr(author, 'roles', ()))
+
 
 def permission_check(ctx) -> bool:
     """
-    Checks the module config for permissions granted to a user based on
-    username or their roles.
+    Checks the compiled config permissions granted to a user based on
+    username, user ID or their roles.
 
     Returns:
         True or False for permission granted or denied in the config file.
@@ -92,22 +314,14 @@ def permission_check(ctx) -> bool:
         McadminbotCommandPermissionsError: The user that tried to run
             the command does not have permission to do so.
     """
-    if is_admin(ctx.author.name, ctx.author.roles):
-        return True
-
-    if ctx.invoked_subcommand:
-        # Top-level command check returned true, so permission granted
-        return True
-    else:
-        if 'ALL' in config.CONFIG[f"{ctx.command}_allowed_users"]:
-            return True
-        elif 'ALL' in config.CONFIG[f"{ctx.command}_allowed_roles"]:
+    with metrics.STAGE_SECONDS.time(stage='permission_check'):
+        if is_admin(ctx.author):
             return True
-        elif ctx.author.name in config.CONFIG[f"{ctx.command}_allowed_users"]:
-            return True
-        elif not set(ctx.author.roles).isdisjoint(
-                set(config.CONFIG[f"{ctx.command}_allowed_users"])
-        ):
+
+        # Subcommands are granted by the permissions of their top-level command
+        command = ctx.command.root_parent or ctx.command
+        if config.get_grant(command.name).allows(
+                ctx.author.name, ctx.author.id, getattr(ctx.author, 'roles', ())):
             return True
         else:
             logger.warning(
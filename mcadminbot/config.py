@@ -2,15 +2,43 @@
 config.py - mcadminbot configuration handling.
 
 load_config is executed by the entrypoint to load defaults.yaml and then either:
-    1. If a config path is passed via --config, merge it and return.
-    2. Load and merge config from CONFIG_LOCATIONS in order of importance, then return.
+    1. If a config path is passed via --config, merge it.
+    2. Load and merge config from CONFIG_LOCATIONS in order of importance.
 
 Config is stored in the module variable CONFIG which can be accessed via config.CONFIG
     in other modules.
+
+Once the config is merged and validated, the admin_* and <command>_allowed_* lists are
+    compiled into the immutable PermissionIndex stored in config.PERMISSIONS.
+
+parse_config and apply_config split loading in two so that a running bot can reload
+    its config: nothing is replaced until the new config has parsed and validated.
+
+Every merged and validated config is saved to SNAPSHOT_PATH, and reused without
+    parsing any YAML for as long as config.py, defaults.yaml and the merged config
+    files are unchanged.
 """
 
+import os
 import pathlib
-from yaml import load, FullLoader
+import pickle
+import re
+import types
+from typing import FrozenSet, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+
+class McadminbotConfigValidationError(Exception):
+    """Thrown when a config value is missing or has the wrong type."""
+
+    def __init__(self, message):
+        """
+        Instantiate an instance of McadminbotConfigValidationError.
+
+        Args:
+            message: The exception message.
+        """
+        self.message = message
+        super().__init__(self.message)
 
 
 class McadminbotConfigPermissionsError(Exception):
@@ -27,60 +55,453 @@ class McadminbotConfigPermissionsError(Exception):
         super().__init__(self.message)
 
 
+class Grant(NamedTuple):
+    """The users and roles allowed to run one command, compiled from the config."""
+
+    allow_all: bool
+    allow_none: bool
+    user_names: FrozenSet[str]
+    user_ids: FrozenSet[int]
+    role_names: FrozenSet[str]
+    role_ids: FrozenSet[int]
+
+    def allows(self, user_name: str, user_id: int, roles: Iterable) -> bool:
+        """
+        Checks whether a Discord user is covered by this grant.
+
+        Args:
+            user_name: The Discord username.
+            user_id: The Discord user ID.
+            roles: The user's discord.Role objects.
+
+        Returns:
+            True if the user is granted access, False if not.
+        """
+        if self.allow_all:
+            return True
+        if self.allow_none:
+            return False
+        if user_name in self.user_names or user_id in self.user_ids:
+            return True
+        return any(role.name in self.role_names or role.id in self.role_ids for role in roles)
+
+
+class PermissionIndex(NamedTuple):
+    """Every Grant in the config: one for admins and one per command name."""
+
+    admin: Grant
+    commands: Mapping[str, Grant]
+
+
 CONFIG_LOCATIONS = [
     pathlib.Path('/etc/mcadminbot/mcadminbot.yaml'),
     pathlib.Path(pathlib.Path.home() / 'mcadminbot.yaml')
 ]
 
+DEFAULTS_PATH = pathlib.Path(__file__).parent / 'defaults.yaml'
+
+SNAPSHOT_PATH = pathlib.Path(
+    os.environ.get('XDG_CACHE_HOME') or pathlib.Path.home() / '.cache',
+    'mcadminbot', 'config.pickle')
+
 CONFIG = {}
+CONFIG_PATH = None
+PERMISSIONS = None
+
+# Types that the core config keys must have for the bot to start or reload
+_EXPECTED_TYPES = {
+    'token': str,
+    'command_prefix': str,
+    'server_address': str,
+    'rcon_port': int,
+    'rcon_password': str,
+    'rcon_timeout': (int, float),
+    'rcon_pool_size': int,
+    'rcon_pool_idle_timeout': (int, float),
+    'servers': dict,
+    'broadcast_timeout': (int, float),
+    'rcon_cache_ttl': (int, float),
+    'config_watch_interval': (int, float),
+    'metrics_address': str,
+    'metrics_port': int,
+    'discord_attachment_threshold': int,
+    'import_directory': (str, type(None)),
+    'import_pipeline_window': int,
+    'rcon_queue_size': int,
+    'user_rate_limit': (int, float),
+    'user_rate_burst': (int, float),
+    'command_rate_limits': dict,
+    'breaker_failure_threshold': int,
+    'breaker_backoff': (int, float),
+    'breaker_max_backoff': (int, float),
+    'status_channel': (int, type(None)),
+    'log_file': (str, type(None)),
+    'log_channel': (int, type(None)),
+    'log_events': list,
+    'log_poll_interval': (int, float),
+    'log_batch_interval': (int, float),
+    'log_offset_file': (str, type(None)),
+    'player_poll_interval': (int, float),
+    'audit_database': (str, type(None)),
+    'audit_batch_interval': (int, float),
+    'log_level': str,
+    'log_sinks': list,
+    'log_path': (str, type(None)),
+    'log_rotation_mb': (int, float),
+    'log_compression': (str, type(None)),
+    'log_queue_size': int,
+    'shard_count': int,
+    'shard_processes': int,
+    'discord_intents': list,
+    'member_cache': list,
+    'message_cache_size': int,
+    'slash_commands': bool,
+    'slash_command_guilds': list,
+    'shutdown_timeout': (int, float),
+    'stop_timeout': (int, float),
+    'jobs': dict,
+    'job_file': (str, type(None)),
+    'job_misfire_policy': str,
+    'job_misfire_grace': (int, float),
+    'macros': dict,
+    'macro_file': (str, type(None)),
+}
+
+# How a scheduled job that missed its time by more than 'job_misfire_grace' is handled
+MISFIRE_POLICIES = ('run_once', 'skip')
+
+_DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)([smhd]?)')
+_TIME_OF_DAY = re.compile(r'([01]?\d|2[0-3]):([0-5]\d)')
+
+# Macro names, which must not be taken for a server selector or a subcommand
+MACRO_NAME = re.compile(r'[A-Za-z0-9_-]{1,32}')
+RESERVED_MACRO_NAMES = frozenset(['list', 'add', 'remove'])
+
+_NO_GRANT = Grant(False, True, frozenset(), frozenset(), frozenset(), frozenset())
 
 
 def load_config(config_path: str = None) -> None:
     """
-    Load and merge the config for mcadminbot.
+    Load, merge and apply the config for mcadminbot.
 
     Args:
         config_path: The user-supplied path to a config file.
 
     Raises:
         McadminbotConfigPermissionsError: No read permissions on file.
+        McadminbotConfigValidationError: A config file is not valid YAML, or a
+            config value has the wrong type.
         FileNotFoundError: File does not exist at user-supplied path.
     """
-    global CONFIG
+    global CONFIG_PATH
+
+    apply_config(parse_config(config_path))
+    CONFIG_PATH = config_path
+
+
+def parse_config(config_path: str = None) -> dict:
+    """
+    Load, merge and validate the config for mcadminbot without applying it.
+
+    Args:
+        config_path: The user-supplied path to a config file.
+
+    Returns:
+        The merged config.
+
+    Raises:
+        McadminbotConfigPermissionsError: No read permissions on file.
+        McadminbotConfigValidationError: A config file is not valid YAML, or a
+            config value has the wrong type.
+        FileNotFoundError: File does not exist at user-supplied path.
+    """
+    paths = source_paths(config_path)
+    key = _snapshot_key(paths)
+    snapshot = _read_snapshot(key)
+    if snapshot is not None:
+        return snapshot
 
     # Load the defaults first to ensure no missing config values
-    parent_dir = pathlib.Path(__file__).parent
-    default_path = parent_dir / 'defaults.yaml'
+    merged = load_defaults()
+
+    # Merge config files in order of importance
+    for path in paths:
+        try:
+            with path.open('r') as config_file:
+                to_merge = _load_yaml(config_file.read())
+            merged.update(to_merge or {})
+        except PermissionError as error:
+            raise McadminbotConfigPermissionsError(
+                f"No read permissions to config file [{path.absolute()}].") from error
+        except ValueError as error:
+            raise McadminbotConfigValidationError(
+                f"Config file [{path.absolute()}] is not valid YAML: {error}") from error
+
+    _validate(merged)
+    _write_snapshot(key, merged)
+    return merged
+
+
+def load_defaults() -> dict:
+    """
+    Returns:
+        The config in defaults.yaml, without merging any other file.
+
+    Raises:
+        McadminbotConfigPermissionsError: No read permissions on defaults.yaml.
+    """
     try:
-        with default_path.open('r') as default_config_file:
-            CONFIG = load(default_config_file.read(), Loader=FullLoader)
+        with DEFAULTS_PATH.open('r') as default_config_file:
+            return _load_yaml(default_config_file.read())
     except PermissionError as error:
         raise McadminbotConfigPermissionsError(
-            f"No read permissions to default config file [{default_path.absolute()}].") from error
+            f"No read permissions to default config file [{DEFAULTS_PATH.absolute()}].") from error
+
+
+def _load_yaml(text: str):
+    """
+    Raises:
+        ValueError: The text is not valid YAML.
+    """
+    # PyYAML is only imported when a config file has changed, and libyaml's
+    # loader is used when PyYAML was built with it
+    import yaml
+    try:
+        return yaml.load(text, Loader=getattr(yaml, 'CFullLoader', yaml.FullLoader))
+    except yaml.YAMLError as error:
+        raise ValueError(str(error)) from error
+
+
+def _snapshot_key(paths: List[pathlib.Path]) -> list:
+    """
+    Returns:
+        The identity of every file a config is built from. A change to any of them
+        makes the saved snapshot stale.
+    """
+    key = []
+    for path in [pathlib.Path(__file__), DEFAULTS_PATH, *paths]:
+        stat = path.stat()
+        key.append((str(path.absolute()), stat.st_ino, stat.st_size, stat.st_mtime_ns))
+    return key
+
 
-    # Merge a config file specified on the command line and return
+def _read_snapshot(key: list) -> Optional[dict]:
+    """
+    Returns:
+        The config saved with key, or None if there is no usable snapshot.
+    """
+    try:
+        with SNAPSHOT_PATH.open('rb') as snapshot_file:
+            stat = os.fstat(snapshot_file.fileno())
+            # Unpickling can run code, so only trust a file no one else could have written
+            if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+                return None
+            saved_key, snapshot = pickle.load(snapshot_file)
+    except (OSError, EOFError, ValueError, TypeError, AttributeError, pickle.UnpicklingError):
+        return None
+    return snapshot if saved_key == key else None
+
+
+def _write_snapshot(key: list, merged: dict) -> None:
+    """Saves a validated config to SNAPSHOT_PATH, readable only by this user."""
+    temporary = SNAPSHOT_PATH.with_name(f"{SNAPSHOT_PATH.name}.{os.getpid()}.tmp")
+    try:
+        SNAPSHOT_PATH.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        descriptor = os.open(str(temporary), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, 'wb') as snapshot_file:
+            pickle.dump((key, merged), snapshot_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(str(temporary), str(SNAPSHOT_PATH))
+    except (OSError, pickle.PicklingError):
+        # The snapshot only speeds up the next start
+        if temporary.exists():
+            temporary.unlink()
+
+
+def source_paths(config_path: str = None) -> List[pathlib.Path]:
+    """
+    Args:
+        config_path: The user-supplied path to a config file.
+
+    Returns:
+        The config files merged on top of the defaults, in order of importance.
+
+    Raises:
+        FileNotFoundError: File does not exist at user-supplied path.
+    """
     if config_path:
         path = pathlib.Path(config_path)
-        if path.exists():
-            try:
-                with path.open('r') as config_file:
-                    to_merge = load(config_file.read(), Loader=FullLoader)
-                CONFIG.update(to_merge)
-            except PermissionError as error:
-                raise McadminbotConfigPermissionsError(
-                    f"No read permissions to config file [{path}].") from error
-            return
-        else:
-            raise FileNotFoundError(
-                f"No config file found at {config_path.absolute()}")
+        if not path.exists():
+            raise FileNotFoundError(f"No config file found at {path.absolute()}")
+        return [path]
+    return [path for path in CONFIG_LOCATIONS if path.exists()]
 
-    # Merge config files in order of importance
-    for path in CONFIG_LOCATIONS:
-        if path.exists():
-            try:
-                with path.open('r') as config_file:
-                    to_merge = load(config_file.read(), Loader=FullLoader)
-                CONFIG.update(to_merge)
-            except PermissionError as error:
-                raise McadminbotConfigPermissionsError(
-                    f"No read permissions to config file [{path.absolute()}].") from error
+
+def apply_config(new_config: dict) -> None:
+    """
+    Compiles the permissions of a parsed config and makes both current at once.
+
+    Args:
+        new_config: A config returned by parse_config.
+    """
+    global CONFIG, PERMISSIONS
+
+    permissions = _compile_permissions(new_config)
+    CONFIG, PERMISSIONS = new_config, permissions
+
+
+def _validate(new_config: dict) -> None:
+    """
+    Raises:
+        McadminbotConfigValidationError: A config value has the wrong type.
+    """
+    for key, expected in _EXPECTED_TYPES.items():
+        value = new_config.get(key)
+        if not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool):
+            raise McadminbotConfigValidationError(
+                f"Config key [{key}] must be of type {_type_names(expected)}, "
+                f"not [{value!r}].")
+    for key, value in new_config.items():
+        if key.endswith(('_users', '_roles')) and not isinstance(value, list):
+            raise McadminbotConfigValidationError(f"Config key [{key}] must be a list.")
+    for name, limit in new_config['command_rate_limits'].items():
+        if not isinstance(limit, dict) or not all(
+                isinstance(limit.get(field), (int, float)) for field in ('rate', 'burst')):
+            raise McadminbotConfigValidationError(
+                f"Rate limit [{name}] in 'command_rate_limits' must have a 'rate' and a 'burst'.")
+    processes = new_config['shard_processes']
+    if processes > 1 and new_config['shard_count'] < processes:
+        raise McadminbotConfigValidationError(
+            "Config key [shard_count] must be at least [shard_processes] when running "
+            "several shard processes.")
+    _validate_jobs(new_config)
+    _validate_macros(new_config)
+
+
+def parse_duration(value) -> float:
+    """
+    Args:
+        value: A number of seconds, or a string such as '90', '30s', '15m', '6h',
+            '1d' or '1h30m'.
+
+    Returns:
+        The duration in seconds.
+
+    Raises:
+        ValueError: The value is not a duration.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    text = str(value).strip().lower()
+    parts = _DURATION_PART.findall(text)
+    if not parts or ''.join(number + unit for number, unit in parts) != text:
+        raise ValueError(f"[{value}] is not a duration such as 90s, 15m, 6h or 1d")
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def parse_time_of_day(value: str) -> Tuple[int, int]:
+    """
+    Returns:
+        (hour, minute) of an 'HH:MM' string.
+
+    Raises:
+        ValueError: The value is not an 'HH:MM' time.
+    """
+    match = _TIME_OF_DAY.fullmatch(str(value).strip())
+    if match is None:
+        raise ValueError(f"[{value}] is not a time of day such as 04:30")
+    return int(match.group(1)), int(match.group(2))
+
+
+def _validate_jobs(new_config: dict) -> None:
+    if new_config['job_misfire_policy'] not in MISFIRE_POLICIES:
+        raise McadminbotConfigValidationError(
+            f"Config key [job_misfire_policy] must be one of {list(MISFIRE_POLICIES)}.")
+    for name, job in new_config['jobs'].items():
+        if not isinstance(job, dict) or not isinstance(job.get('command'), str):
+            raise McadminbotConfigValidationError(
+                f"Job [{name}] in 'jobs' must have a 'command'.")
+        if 'every' not in job and 'at' not in job:
+            raise McadminbotConfigValidationError(
+                f"Job [{name}] in 'jobs' must have an 'every' interval, an 'at' time, or both.")
+        if job.get('misfire', MISFIRE_POLICIES[0]) not in MISFIRE_POLICIES:
+            raise McadminbotConfigValidationError(
+                f"Job [{name}] in 'jobs' has a 'misfire' policy not in {list(MISFIRE_POLICIES)}.")
+        try:
+            if 'every' in job and parse_duration(job['every']) <= 0:
+                raise ValueError('the interval must be positive')
+            parse_duration(job.get('jitter', 0))
+            if 'at' in job:
+                parse_time_of_day(job['at'])
+        except ValueError as error:
+            raise McadminbotConfigValidationError(f"Job [{name}] in 'jobs': {error}") from error
+
+
+def _validate_macros(new_config: dict) -> None:
+    for name, steps in new_config['macros'].items():
+        if not MACRO_NAME.fullmatch(str(name)) or name in RESERVED_MACRO_NAMES:
+            raise McadminbotConfigValidationError(
+                f"Macro [{name}] in 'macros' must be named with up to 32 letters, digits, "
+                f"'-' and '_', and not {sorted(RESERVED_MACRO_NAMES)}.")
+        if not isinstance(steps, list) or not steps or not all(
+                isinstance(step, str) for step in steps):
+            raise McadminbotConfigValidationError(
+                f"Macro [{name}] in 'macros' must be a list of commands.")
+
+
+def _type_names(expected) -> str:
+    if isinstance(expected, tuple):
+        return ' or '.join(kind.__name__ for kind in expected)
+    return expected.__name__
+
+
+def _compile_grant(users: list, roles: list) -> Grant:
+    """
+    Compiles one pair of users/roles config lists into a Grant.
+
+    Integers in either list are Discord IDs; strings are names.
+    """
+    entries = list(users or []) + list(roles or [])
+    return Grant(
+        allow_all='ALL' in entries,
+        allow_none=all(entry == 'NONE' for entry in entries),
+        user_names=frozenset(str(user) for user in users or [] if not isinstance(user, int)),
+        user_ids=frozenset(user for user in users or [] if isinstance(user, int)),
+        role_names=frozenset(str(role) for role in roles or [] if not isinstance(role, int)),
+        role_ids=frozenset(role for role in roles or [] if isinstance(role, int)))
+
+
+def _compile_permissions(new_config: dict) -> PermissionIndex:
+    """
+    Compiles the permission lists in a config.
+
+    Args:
+        new_config: A merged config.
+
+    Returns:
+        The compiled PermissionIndex.
+    """
+    command_names = {
+        key[:-len('_allowed_users')] for key in new_config if key.endswith('_allowed_users')
+    } | {
+        key[:-len('_allowed_roles')] for key in new_config if key.endswith('_allowed_roles')
+    }
+    return PermissionIndex(
+        admin=_compile_grant(new_config.get('admin_users'), new_config.get('admin_roles')),
+        commands=types.MappingProxyType({
+            name: _compile_grant(
+                new_config.get(f"{name}_allowed_users"), new_config.get(f"{name}_allowed_roles"))
+            for name in command_names
+        }))
+
+
+def get_grant(command_name: str) -> Grant:
+    """
+    Args:
+        command_name: The name of a top-level bot command.
+
+    Returns:
+        The compiled Grant for the command, or one that denies everyone
+        if the config does not mention the command.
+    """
+    return PERMISSIONS.commands.get(command_name, _NO_GRANT)
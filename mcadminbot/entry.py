@@ -5,30 +5,223 @@ An interface to _main is created when installing the package through pip.
 In your virtualenv directory, you will find this script at bin/mcadminbot.
 """
 
+import time
+
+# Taken before the other imports so that --profile-startup includes them
+_STARTED = time.perf_counter()
+
 import os
 import sys
+import asyncio
 import atexit
 import signal
 import argparse
 import pathlib
+import tempfile
+from typing import List
 from loguru import logger
-from cysystemd.journal import JournaldLogHandler
 
 import mcadminbot.config as config
-from mcadminbot.bot.bot import run_bot
+import mcadminbot.logsinks as logsinks
+from mcadminbot.bot import handoff
+
+# discord.py and the bot are imported by the functions that use them, so that 'stop'
+# never imports them and the config is checked before paying for them
 
 PIDFILE = pathlib.Path('/run/mcadminbot.pid')
 
+# Seconds to wait for the daemon to die after it is sent SIGKILL
+_KILL_TIMEOUT = 5
+
+
+class _StartupProfile:
+    """Times each phase of startup for --profile-startup."""
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = []
+        self._last = _STARTED
+
+    def mark(self, phase: str) -> None:
+        """Records the time since the previous mark as the duration of a phase."""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self) -> None:
+        """Called just before the bot connects; logs every phase if profiling was requested."""
+        self.mark('create bot')
+        if not self.enabled:
+            return
+        total = sum(seconds for _, seconds in self.phases)
+        logger.info('Startup profile: ' + ', '.join(
+            f"{phase} {seconds * 1000:.1f} ms" for phase, seconds in self.phases
+        ) + f"; {total * 1000:.1f} ms until connecting to Discord")
+
 
-def _run(config_path: str) -> None:
+_PROFILE = _StartupProfile()
+
+
+def _run(config_path: str, daemon: bool = False, predecessor: int = None) -> None:
     config.load_config(config_path)
+    _PROFILE.mark('config')
     logger.info('mcadminbot config has been loaded')
-    run_bot()
+    if config.CONFIG['shard_processes'] > 1:
+        _run_shard_processes(daemon)
+    else:
+        from mcadminbot.bot.bot import run_bot
+        _PROFILE.mark('import bot')
+        run_bot(before_run=_PROFILE.report, predecessor=predecessor,
+                on_takeover=_take_over_pidfile if predecessor else None)
+
+
+def _run_shard_processes(daemon: bool) -> None:
+    """
+    Runs the shards in 'shard_processes' child processes and supervises them.
+
+    This process serves its RCON pools to the children over a Unix socket,
+    forwards SIGTERM, SIGINT and SIGHUP to them, and exits once they all have.
+    """
+    from mcadminbot.bot import servers
+    processes = config.CONFIG['shard_processes']
+    shard_count = config.CONFIG['shard_count']
+    servers.load_servers()
+    # Only this user can reach the socket through a directory that mkdtemp makes 0700
+    socket_path = os.path.join(tempfile.mkdtemp(prefix='mcadminbot-rcon-'), 'gateway.sock')
+
+    children = {}
+    for index in range(processes):
+        shard_ids = list(range(index, shard_count, processes))
+        pid = os.fork()
+        if pid == 0:
+            _run_shard(socket_path, shard_ids, daemon, index)
+        children[pid] = shard_ids
+        logger.info(f"Started shard process [{pid}] for shards {shard_ids}")
+    if daemon:
+        _write_pidfile(os.getpid(), *children)
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(_supervise(loop, children, socket_path))
+
+
+def _run_shard(socket_path: str, shard_ids: List[int], daemon: bool, index: int) -> None:
+    """Runs one shard process; never returns."""
+    from mcadminbot.bot import gateway
+    from mcadminbot.bot.bot import run_bot
+    os.environ[gateway.GATEWAY_ENVIRONMENT] = socket_path
+    # Each shard process serves its own metrics, on consecutive ports
+    if config.CONFIG['metrics_port']:
+        config.CONFIG['metrics_port'] += index
+    # The log writer threads do not survive the fork
+    logsinks.configure(config.CONFIG, daemon)
+    code = 0
+    try:
+        run_bot(shard_ids)
+    except BaseException:
+        logger.exception(f"Shard process for shards {shard_ids} failed")
+        code = 1
+    finally:
+        logger.remove()
+        # Skip the supervisor's atexit handlers, which would remove its pidfile
+        os._exit(code)
+
+
+async def _supervise(loop, children: dict, socket_path: str) -> None:
+    from mcadminbot.bot import gateway
+    from mcadminbot.bot import servers
+    gateway_server = await gateway.serve(socket_path, lambda name: servers.get_server(name).pool)
+    all_exited = asyncio.Event()
+
+    def forward(signo):
+        for pid in children:
+            try:
+                os.kill(pid, signo)
+            except ProcessLookupError:
+                pass
+
+    def reap():
+        while children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                children.clear()
+                break
+            if pid == 0:
+                break
+            shard_ids = children.pop(pid, None)
+            logger.info(f"Shard process [{pid}] for shards {shard_ids} exited with [{status}]")
+        if not children:
+            all_exited.set()
+
+    def reload():
+        try:
+            new_config = config.parse_config(config.CONFIG_PATH)
+            retired = servers.load_servers(new_config)
+        except Exception as error:
+            logger.error(f"Config reload failed, keeping the current config: {error}")
+        else:
+            config.apply_config(new_config)
+            for server in retired:
+                asyncio.ensure_future(server.close())
+        forward(signal.SIGHUP)
+
+    loop.add_signal_handler(signal.SIGCHLD, reap)
+    loop.add_signal_handler(signal.SIGHUP, reload)
+    for signo in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signo, forward, signo)
+    # A child may have exited before the SIGCHLD handler was installed
+    reap()
+
+    await all_exited.wait()
+    gateway_server.close()
+    await servers.close_servers()
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    os.rmdir(os.path.dirname(socket_path))
+    logger.info('Every shard process has exited')
+
+
+def _write_pidfile(*pids: int) -> None:
+    # The first PID is the process to signal; the rest are its shard processes
+    with PIDFILE.open('w') as pidfile:
+        pidfile.write('\n'.join(str(pid) for pid in pids))
+
+
+def _running_pids() -> List[int]:
+    """
+    Returns:
+        The daemon's processes that are still running, supervisor first. A pidfile
+        left behind by a daemon that was killed is removed.
+    """
+    try:
+        with PIDFILE.open('r') as pidfile:
+            pids = [int(pid) for pid in pidfile.read().split()]
+    except FileNotFoundError:
+        return []
+    running = [pid for pid in pids if handoff.is_mcadminbot(pid)]
+    if not running:
+        logger.warning(f"Removing the stale pidfile [{PIDFILE}] of PIDs {pids}")
+        _remove_pidfile()
+    return running
+
+
+def _take_over_pidfile() -> None:
+    # Called once the predecessor of a graceful restart has exited
+    _write_pidfile(os.getpid())
+    atexit.register(_remove_pidfile)
+
+
+def _remove_pidfile() -> None:
+    try:
+        PIDFILE.unlink()
+    except FileNotFoundError:
+        pass
 
 
 def _daemonize(stdin_path: str = '/dev/null', stdout_path: str = '/dev/null',
-               stderr_path: str = '/dev/null') -> None:
-    if PIDFILE.exists():
+               stderr_path: str = '/dev/null', predecessor: int = None) -> None:
+    # A daemon taking over from a predecessor writes the PID file once it has exited
+    if predecessor is None and _running_pids():
         raise RuntimeError('Already running')
 
     # First fork (detaches from parent)
@@ -60,12 +253,12 @@ def _daemonize(stdin_path: str = '/dev/null', stdout_path: str = '/dev/null',
     with open(stderr_path, 'ab', 0) as daemon_stderr:
         os.dup2(daemon_stderr.fileno(), sys.stderr.fileno())
 
-    # Write the PID file
-    with PIDFILE.open('w') as pidfile:
-        pidfile.write(f"{os.getpid()}")
+    if predecessor is None:
+        # Write the PID file
+        _write_pidfile(os.getpid())
 
-    # Arrange to have the PID file removed on exit/signal
-    atexit.register(lambda: os.remove(PIDFILE))
+        # Arrange to have the PID file removed on exit/signal
+        atexit.register(_remove_pidfile)
 
     # Signal handler for termination (required)
     def sigterm_handler(signo, frame):
@@ -74,78 +267,119 @@ def _daemonize(stdin_path: str = '/dev/null', stdout_path: str = '/dev/null',
     signal.signal(signal.SIGTERM, sigterm_handler)
 
 
-def _start_daemon(config_path: str) -> None:
+def _startup_settings(config_path: str) -> dict:
+    # Logging and stopping the daemon happen before the bot loads its config, so
+    # fall back to the defaults and let _run report what is wrong with the config
+    try:
+        return config.parse_config(config_path)
+    except (config.McadminbotConfigPermissionsError, config.McadminbotConfigValidationError,
+            OSError):
+        return config.load_defaults()
+
+
+def _start_daemon(config_path: str, settings: dict, predecessor: int = None) -> None:
     try:
-        _daemonize(stdin_path='/dev/null', stdout_path='/dev/null', stderr_path='/dev/null')
+        _daemonize(stdin_path='/dev/null', stdout_path='/dev/null', stderr_path='/dev/null',
+                   predecessor=predecessor)
     except RuntimeError as error:
         logger.error(error)
         raise SystemExit(1)
+    # The log writer threads do not survive the forks
+    logsinks.configure(settings, daemon=True)
     logger.info('mcadminbot daemon is started')
-    _run(config_path)
-
-
-def _stop_daemon():
-    if PIDFILE.exists():
-        with PIDFILE.open('r') as pidfile:
-            os.kill(int(pidfile.read()), signal.SIGTERM)
-        while PIDFILE.exists():
+    _run(config_path, daemon=True, predecessor=predecessor)
+
+
+def _stop_daemon(timeout: float) -> bool:
+    """
+    Stops the daemon gracefully, killing it if it has not exited after timeout seconds.
+
+    Returns:
+        True if the daemon was running.
+    """
+    pids = _running_pids()
+    if not pids:
+        return False
+    # The supervisor forwards SIGTERM to its shard processes, but signal them
+    # directly too in case the supervisor is already gone
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
             pass
-        logger.info('mcadminbot daemon is stopped')
-    else:
-        logger.error('mcadminbot is not running - it cannot be stopped')
-        raise SystemExit(1)
+
+    deadline = time.monotonic() + timeout
+    stuck = [pid for pid in pids
+             if not handoff.wait_for_exit_blocking(pid, deadline - time.monotonic())]
+    if stuck:
+        logger.warning(f"mcadminbot did not stop within {timeout} seconds, killing PIDs {stuck}")
+        for pid in stuck:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        for pid in stuck:
+            handoff.wait_for_exit_blocking(pid, _KILL_TIMEOUT)
+    # A killed daemon cannot remove its own pidfile
+    _remove_pidfile()
+    logger.info('mcadminbot daemon is stopped')
+    return True
 
 
 def _generate_arg_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('-d', '--daemon', help='manage %(prog)s as a daemon',
-                        dest='daemon', action='store', choices=['start', 'stop', 'restart'])
+                        dest='daemon', action='store',
+                        choices=['start', 'stop', 'restart', 'graceful-restart'])
     parser.add_argument('-c', '--config', help='path to mcadminbot.yaml',
                         dest='config_path', action='store')
+    parser.add_argument('--profile-startup', help='log how long each phase of startup takes',
+                        dest='profile_startup', action='store_true')
     return parser
 
 
 def _main():
     parser = _generate_arg_parser()
     args = parser.parse_args()
+    _PROFILE.enabled = args.profile_startup
+    _PROFILE.mark('start')
 
-    # Remove the default log handler for stderr before starting
-    logger.remove()
-
-    logger.add(
-        sink='/tmp/mcadminbot.log',
-        level='DEBUG',
-        format='{level} - {time} - {module} - {message}',
-        rotation='100 MB',
-        compression='tar.gz'
-        )
-
-    if args.daemon:
-        logger.add(
-            sink=JournaldLogHandler(),
-            level='DEBUG',
-            format='{level} - {module} - {message}'
-        )
+    # Replace the default stderr handler with the configured, queued sinks
+    settings = _startup_settings(args.config_path)
+    logsinks.configure(settings, daemon=bool(args.daemon))
+    _PROFILE.mark('logging')
 
     if args.daemon == 'start':
         logger.info('mcadminbot daemon is starting')
-        _start_daemon(args.config_path)
+        _start_daemon(args.config_path, settings)
 
     elif args.daemon == 'stop':
         logger.info('mcadminbot daemon is stopping')
-        _stop_daemon()
+        if not _stop_daemon(settings['stop_timeout']):
+            logger.error('mcadminbot is not running - it cannot be stopped')
+            raise SystemExit(1)
 
     elif args.daemon == 'restart':
         logger.info('mcadminbot daemon restart requested')
-        _stop_daemon()
-        _start_daemon(args.config_path)
+        if not _stop_daemon(settings['stop_timeout']):
+            logger.info('mcadminbot was not running')
+        _start_daemon(args.config_path, settings)
+
+    elif args.daemon == 'graceful-restart':
+        logger.info('mcadminbot daemon graceful restart requested')
+        pids = _running_pids()
+        if len(pids) == 1 and settings['shard_processes'] == 1:
+            # The new daemon connects first, then has the running one hand off to it
+            _start_daemon(args.config_path, settings, predecessor=pids[0])
+        else:
+            if pids:
+                logger.warning('A daemon with shard processes cannot hand off; restarting it')
+            else:
+                logger.info('mcadminbot was not running')
+            _stop_daemon(settings['stop_timeout'])
+            _start_daemon(args.config_path, settings)
 
     else:
-        logger.add(
-            sink=sys.stdout,
-            level='DEBUG',
-            format='{level} - {time} - {module} - {message}'
-        )
         logger.info('mcadminbot is starting without daemonization')
         _run(args.config_path)
 
@@ -0,0 +1,190 @@
+"""
+logsinks.py - Asynchronous, batched loguru sinks for mcadminbot.
+
+Every configured sink is wrapped in a QueuedSink: logging a message only puts it on a
+bounded queue, and a background thread writes queued messages in batches. When the
+queue is full, DEBUG and INFO messages are dropped (and counted) rather than
+stalling the Discord event loop; WARNING and above wait briefly for room.
+
+The log file is rotated by size, and rotated files are compressed by a separate
+thread so that compression never holds up writing.
+"""
+
+import logging
+import os
+import queue
+import sys
+import tarfile
+import threading
+import time
+from typing import Callable, List
+
+from loguru import logger
+
+FORMAT = '{level} - {time} - {module} - {message}'
+JOURNALD_FORMAT = '{level} - {module} - {message}'
+
+# Messages at or above this level wait for room in a full queue instead of being dropped
+_BLOCKING_LEVEL = logging.WARNING
+
+_STOP = object()
+
+
+class QueuedSink:
+    """A loguru sink that hands messages to a writer function from a background thread."""
+
+    def __init__(self, writer: Callable[[List[str]], None], maxsize: int = 10000,
+                 batch_size: int = 500):
+        """
+        Starts the writer thread.
+
+        Args:
+            writer: Called from the writer thread with each batch of formatted messages.
+            maxsize: The most messages that may wait to be written.
+            batch_size: The most messages passed to writer at once.
+        """
+        self.writer = writer
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._pid = os.getpid()
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, name='mcadminbot-log', daemon=True)
+        self._thread.start()
+
+    def write(self, message) -> None:
+        """Called by loguru with each formatted message."""
+        try:
+            if message.record['level'].no >= _BLOCKING_LEVEL:
+                self._queue.put(message, timeout=1)
+            else:
+                self._queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self) -> None:
+        """Called by loguru when the sink is removed; writes everything still queued."""
+        if os.getpid() != self._pid:
+            # The writer thread did not survive a fork into this process
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is _STOP
+            if stopping:
+                batch.pop()
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                batch.append(f"WARNING - {time.strftime('%Y-%m-%dT%H:%M:%S')} - logsinks - "
+                             f"{dropped} log messages were dropped because the queue was full\n")
+            if batch:
+                try:
+                    self.writer(batch)
+                except Exception as error:
+                    sys.stderr.write(
+                        f"mcadminbot could not write {len(batch)} log messages: {error}\n")
+            if stopping:
+                return
+
+
+class RotatingFileWriter:
+    """Appends batches to a file, rotating it by size and compressing old files in a thread."""
+
+    def __init__(self, path: str, rotation_bytes: int, compression: str = None):
+        """
+        Args:
+            path: The log file path.
+            rotation_bytes: The size at which the file is rotated, or 0 to never rotate.
+            compression: 'tar.gz' to compress rotated files, or None to keep them as they are.
+        """
+        self.path = path
+        self.rotation_bytes = rotation_bytes
+        self.compression = compression
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __call__(self, batch: List[str]) -> None:
+        """Writes a batch with a single flush, rotating first if the file is full."""
+        if self.rotation_bytes and self._file.tell() >= self.rotation_bytes:
+            self._rotate()
+        self._file.write(''.join(batch))
+        self._file.flush()
+
+    def _rotate(self) -> None:
+        self._file.close()
+        rotated = f"{self.path}.{time.strftime('%Y-%m-%d_%H-%M-%S')}"
+        os.replace(self.path, rotated)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if self.compression == 'tar.gz':
+            threading.Thread(
+                target=_compress, args=(rotated,), name='mcadminbot-log-compression').start()
+
+
+def _compress(path: str) -> None:
+    try:
+        with tarfile.open(f"{path}.tar.gz", 'w:gz') as archive:
+            archive.add(path, arcname=os.path.basename(path))
+        os.remove(path)
+    except OSError as error:
+        sys.stderr.write(f"mcadminbot could not compress [{path}]: {error}\n")
+
+
+def _write_stream(stream) -> Callable[[List[str]], None]:
+    def write(batch: List[str]) -> None:
+        stream.write(''.join(batch))
+        stream.flush()
+    return write
+
+
+def _write_journald(handler: logging.Handler) -> Callable[[List[str]], None]:
+    def write(batch: List[str]) -> None:
+        for message in batch:
+            record = getattr(message, 'record', None)
+            if record is None:
+                # The dropped-messages notice is a plain string
+                handler.handle(logging.makeLogRecord(
+                    {'msg': message.rstrip('\n'), 'levelno': logging.WARNING,
+                     'levelname': 'WARNING'}))
+                continue
+            handler.handle(logging.LogRecord(
+                record['name'], record['level'].no, record['file'].path, record['line'],
+                message.rstrip('\n'), (), None, record['function']))
+    return write
+
+
+def configure(settings: dict, daemon: bool) -> None:
+    """
+    Replaces loguru's handlers with queued sinks built from the config.
+
+    Call it again after forking, since the writer threads do not survive a fork.
+
+    Args:
+        settings: The config that the 'log_*' settings are read from.
+        daemon: Whether the bot is being run as a daemon. stdout is only used in
+            the foreground and journald only as a daemon.
+    """
+    logger.remove()
+    level = settings['log_level']
+    sinks = settings['log_sinks']
+    queue_size = settings['log_queue_size']
+
+    if 'file' in sinks and settings['log_path']:
+        writer = RotatingFileWriter(
+            settings['log_path'], settings['log_rotation_mb'] * 1024 * 1024,
+            settings['log_compression'])
+        logger.add(QueuedSink(writer, queue_size), level=level, format=FORMAT)
+
+    if 'journald' in sinks and daemon:
+        from cysystemd.journal import JournaldLogHandler
+        logger.add(QueuedSink(_write_journald(JournaldLogHandler()), queue_size),
+                   level=level, format=JOURNALD_FORMAT)
+
+    if 'stdout' in sinks and not daemon:
+        logger.add(QueuedSink(_write_stream(sys.stdout), queue_size),
+                   level=level, format=FORMAT)
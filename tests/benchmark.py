@@ -0,0 +1,188 @@
+"""
+tests/benchmark.py - Measures command latency, throughput and memory against FakeRCONServer.
+
+Run from the repository root:
+
+    python -m tests.benchmark --latency 0.005 --requests 500
+
+Each scenario is run at every concurrency level. 'rcon' calls utils.rcon_command
+directly; 'cog' runs the permission check and the 'say' command of MinecraftCommands
+through a stubbed Discord context.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import tracemalloc
+from typing import List
+from loguru import logger
+
+import mcadminbot.config as config
+from mcadminbot.bot import minecraftcommands
+from mcadminbot.bot import servers
+from mcadminbot.bot import utils
+from tests.fakercon import FakeRCONServer, run
+
+SCENARIOS = ('rcon', 'cog')
+CONCURRENCY = (1, 10, 100)
+
+
+class StubAuthor:
+    """The parts of a discord.Member used by the bot."""
+
+    def __init__(self, name: str = 'benchmark', user_id: int = 1):
+        self.name = name
+        self.id = user_id
+        self.roles = []
+
+
+class StubCommand:
+    """The parts of a discord.ext.commands.Command used by permission checks."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.qualified_name = name
+        self.root_parent = None
+
+    def __str__(self):
+        return self.name
+
+
+class StubContext:
+    """A discord.ext.commands.Context that records replies instead of sending them."""
+
+    def __init__(self, command_name: str):
+        self.author = StubAuthor()
+        self.command = StubCommand(command_name)
+        self.invoked_subcommand = None
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Returns the nearest-rank percentile of an already sorted list."""
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+async def run_scenario(scenario: str, concurrency: int, requests: int) -> dict:
+    """
+    Runs one scenario and measures it.
+
+    Args:
+        scenario: One of SCENARIOS.
+        concurrency: The number of invocations in flight at once.
+        requests: The total number of invocations.
+
+    Returns:
+        A dict of p50/p99 latency in ms, invocations per second and peak traced memory in KiB.
+    """
+    cog = minecraftcommands.MinecraftCommands(None)
+    say = minecraftcommands.MinecraftCommands.say.callback
+    remaining = iter(range(requests))
+    latencies = []
+
+    async def invoke(index: int) -> None:
+        if scenario == 'rcon':
+            await utils.rcon_command(f"say benchmark {index}")
+        else:
+            ctx = StubContext('say')
+            cog.cog_check(ctx)
+            await say(cog, ctx, None, f"benchmark {index}")
+
+    async def worker() -> None:
+        for index in remaining:
+            start = time.perf_counter()
+            await invoke(index)
+            latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'per_second': requests / elapsed,
+        'peak_kib': peak / 1024,
+    }
+
+
+async def benchmark(server: FakeRCONServer, scenarios=SCENARIOS, concurrency=CONCURRENCY,
+                    requests: int = 200, pool_size: int = 4) -> List[dict]:
+    """
+    Points the bot at a started FakeRCONServer and runs every scenario at every
+    concurrency level.
+
+    Returns:
+        One result dict per run, each including its scenario and concurrency.
+    """
+    config.load_config()
+    config.CONFIG.update(
+        server_address='127.0.0.1', rcon_port=server.port, rcon_password=server.password,
+        rcon_pool_size=pool_size, servers={}, default_server=None,
+        rcon_queue_size=max(concurrency), user_rate_limit=0, command_rate_limits={},
+        admin_users=['NONE'], admin_roles=['NONE'],
+        say_allowed_users=['ALL'], say_allowed_roles=['NONE'])
+    config.apply_config(config.CONFIG)
+
+    results = []
+    for scenario in scenarios:
+        for level in concurrency:
+            servers.load_servers()
+            result = await run_scenario(scenario, level, requests)
+            result.update(scenario=scenario, concurrency=level)
+            results.append(result)
+            await servers.close_servers()
+    return results
+
+
+def _generate_arg_parser():
+    parser = argparse.ArgumentParser(description='Benchmark mcadminbot against a fake RCON server')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the fake server waits before answering each command')
+    parser.add_argument('--response-size', type=int, default=None,
+                        help='characters in every response')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='chance that a command resets its connection')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='invocations per scenario and concurrency level')
+    parser.add_argument('--pool-size', type=int, default=4, help='rcon_pool_size to use')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=list(CONCURRENCY))
+    parser.add_argument('--scenario', choices=SCENARIOS, nargs='+', default=list(SCENARIOS))
+    return parser
+
+
+def _main():
+    args = _generate_arg_parser().parse_args()
+
+    # Per-command log lines would dominate both the output and the timings
+    logger.remove()
+
+    async def main():
+        server = FakeRCONServer(
+            latency=args.latency, response_size=args.response_size,
+            failure_rate=args.failure_rate)
+        await server.start()
+        try:
+            return await benchmark(
+                server, args.scenario, args.concurrency, args.requests, args.pool_size)
+        finally:
+            await server.stop()
+
+    print(f"{'scenario':<8} {'conc':>5} {'p50 ms':>9} {'p99 ms':>9} {'cmd/s':>10} {'peak KiB':>10}")
+    for result in run(main()):
+        print(f"{result['scenario']:<8} {result['concurrency']:>5} {result['p50_ms']:>9.2f} "
+              f"{result['p99_ms']:>9.2f} {result['per_second']:>10.1f} {result['peak_kib']:>10.1f}")
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,20 @@
+import pytest
+
+import mcadminbot.config as config
+
+
+@pytest.fixture
+def loaded_config(monkeypatch):
+    """The default config, loaded into a copy that is discarded after the test."""
+    config.load_config()
+    monkeypatch.setattr(config, 'CONFIG', dict(config.CONFIG))
+    monkeypatch.setattr(config, 'PERMISSIONS', config.PERMISSIONS)
+    return config.CONFIG
+
+
+@pytest.fixture(autouse=True)
+def config_snapshot(tmp_path, monkeypatch):
+    """Keeps config snapshots written by tests out of the user's cache directory."""
+    path = tmp_path / 'config.pickle'
+    monkeypatch.setattr(config, 'SNAPSHOT_PATH', path)
+    return path
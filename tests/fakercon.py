@@ -0,0 +1,114 @@
+"""
+tests/fakercon.py - An in-process fake Source RCON server for tests and benchmarks.
+"""
+
+import asyncio
+import random
+import struct
+
+from mcadminbot.bot import rcon
+
+
+def run(coroutine):
+    """Runs a coroutine to completion on a fresh event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class FakeRCONServer:
+    """
+    A minimal RCON server that answers every command with 'ran <command>'.
+
+    Like Minecraft, it splits long responses into MAX_RESPONSE_BODY byte packets
+    and answers packets of any other type with 'Unknown request <type>'.
+    """
+
+    def __init__(self, password: str = 'secret', latency: float = 0.0,
+                 response_size: int = None, failure_rate: float = 0.0,
+                 commands_per_connection: int = None, seed: int = 0):
+        """
+        Args:
+            password: The password that logins must use.
+            latency: Seconds to wait before answering each command.
+            response_size: Pad or truncate every response to this many characters.
+            failure_rate: The chance, from 0 to 1, that a command resets the connection
+                instead of being answered.
+            commands_per_connection: Close each connection after answering this many
+                commands.
+            seed: The seed of the failure injection RNG, for reproducible runs.
+        """
+        self.password = password
+        self.latency = latency
+        self.response_size = response_size
+        self.failure_rate = failure_rate
+        self.commands_per_connection = commands_per_connection
+        self.commands = []
+        self.logins = 0
+        self.port = None
+        self._random = random.Random(seed)
+        self._server = None
+
+    async def start(self) -> int:
+        """
+        Starts listening on a free local port.
+
+        Returns:
+            The port that the server listens on.
+        """
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self) -> None:
+        """Stops listening, letting connection handlers observe EOF first."""
+        await asyncio.sleep(0.01)
+        self._server.close()
+
+    def respond(self, command: str) -> str:
+        """Returns the response body for a command."""
+        response = f"ran {command}"
+        if self.response_size is not None:
+            response = (response + ' ' * self.response_size)[:self.response_size]
+        return response
+
+    async def _handle(self, reader, writer):
+        served = 0
+        while True:
+            try:
+                length = struct.unpack('<i', await reader.readexactly(4))[0]
+                payload = await reader.readexactly(length)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            request_id, packet_type = struct.unpack_from('<ii', payload)
+            body = payload[8:-2].decode()
+
+            if packet_type == rcon.PACKET_TYPE_LOGIN:
+                self.logins += 1
+                if body != self.password:
+                    request_id = rcon.AUTH_FAILURE_ID
+                writer.write(rcon.encode_packet(request_id, rcon.PACKET_TYPE_COMMAND, ''))
+                continue
+
+            if packet_type != rcon.PACKET_TYPE_COMMAND:
+                writer.write(rcon.encode_packet(
+                    request_id, rcon.PACKET_TYPE_RESPONSE, f"Unknown request {packet_type:x}"))
+                # The client's sentinel closes each command's response
+                if served == self.commands_per_connection:
+                    break
+                continue
+
+            served += 1
+            self.commands.append(body)
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self.failure_rate and self._random.random() < self.failure_rate:
+                break
+            response = self.respond(body).encode('utf-8')
+            for start in range(0, max(len(response), 1), rcon.MAX_RESPONSE_BODY):
+                writer.write(rcon.encode_packet(
+                    request_id, rcon.PACKET_TYPE_RESPONSE,
+                    response[start:start + rcon.MAX_RESPONSE_BODY]))
+        writer.close()
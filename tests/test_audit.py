@@ -0,0 +1,36 @@
+import os
+import sqlite3
+import time
+
+from mcadminbot.bot import audit
+from tests.fakercon import run
+
+
+def entry(command, target, seconds_ago=0):
+    return audit.AuditEntry(
+        time.time() - seconds_ago, 1, 'admin#0001', 'survival', command, target, None, 'sent')
+
+
+def test_query_includes_pending_entries_newest_first(tmp_path):
+    path = str(tmp_path / 'audit.sqlite3')
+
+    async def scenario():
+        audit_log = audit.AuditLog(path, batch_interval=60)
+        audit_log.record(entry('ban', 'Griefer', seconds_ago=10))
+        await audit_log.flush()
+        audit_log.record(entry('pardon', 'griefer'))
+        audit_log.record(entry('op', 'Steve'))
+        entries = await audit_log.query('GRIEFER')
+        await audit_log.close()
+        return entries
+
+    assert [found.command for found in run(scenario())] == ['pardon', 'ban']
+
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    connection = sqlite3.connect(path)
+    assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    plan = ' '.join(str(row) for row in connection.execute(
+        'EXPLAIN QUERY PLAN SELECT * FROM audit WHERE target = ? COLLATE NOCASE '
+        'ORDER BY time DESC LIMIT 20', ('Steve',)))
+    assert 'audit_target' in plan
+    connection.close()
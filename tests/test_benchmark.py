@@ -0,0 +1,18 @@
+from tests import benchmark
+from tests.fakercon import FakeRCONServer, run
+
+
+def test_benchmark_smoke(loaded_config):
+    async def scenario():
+        server = FakeRCONServer()
+        await server.start()
+        try:
+            return server, await benchmark.benchmark(server, concurrency=(1, 10), requests=20)
+        finally:
+            await server.stop()
+
+    server, results = run(scenario())
+    assert [(result['scenario'], result['concurrency']) for result in results] == [
+        ('rcon', 1), ('rcon', 10), ('cog', 1), ('cog', 10)]
+    assert len(server.commands) == 80
+    assert all(result['p99_ms'] >= result['p50_ms'] > 0 for result in results)
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from mcadminbot.bot import breaker
+from mcadminbot.bot import exceptions
+from tests.fakercon import run
+
+SETTINGS = {
+    'breaker_failure_threshold': 2,
+    'breaker_backoff': 0.01,
+    'breaker_max_backoff': 0.04,
+}
+
+
+def test_breaker_fails_fast_and_recovers():
+    probes = []
+    announcements = []
+
+    async def probe():
+        probes.append(1)
+        if len(probes) < 2:
+            raise exceptions.McadminbotRCONError('Failed to connect to RCON server')
+
+    async def unreachable():
+        raise exceptions.McadminbotRCONError('Failed to connect to RCON server')
+
+    async def listener(name, state, message):
+        announcements.append((name, state))
+
+    async def scenario():
+        server_breaker = breaker.CircuitBreaker('survival', SETTINGS, probe)
+        for _ in range(2):
+            with pytest.raises(exceptions.McadminbotRCONError):
+                await server_breaker.call(unreachable)
+        assert server_breaker.state == breaker.OPEN
+
+        calls = []
+        with pytest.raises(exceptions.McadminbotCircuitOpenError):
+            await server_breaker.call(lambda: calls.append(1))
+        assert not calls
+
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+            if server_breaker.state == breaker.CLOSED:
+                break
+        await asyncio.sleep(0)
+        return server_breaker
+
+    breaker.add_listener(listener)
+    try:
+        server_breaker = run(scenario())
+    finally:
+        breaker.remove_listener(listener)
+    assert server_breaker.state == breaker.CLOSED
+    assert len(probes) == 2
+    assert server_breaker.stats()['failed_fast'] == 1
+    assert announcements == [('survival', breaker.OPEN), ('survival', breaker.CLOSED)]
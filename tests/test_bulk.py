@@ -0,0 +1,99 @@
+import io
+
+from mcadminbot.bot import bulk
+from mcadminbot.bot import servers
+from tests.fakercon import FakeRCONServer, run
+
+
+class WhitelistServer(FakeRCONServer):
+    def respond(self, command):
+        if command == 'whitelist list':
+            return 'There are 1 whitelisted player(s): Steve'
+        if command.startswith('whitelist add '):
+            return f"Added {command.split()[-1]} to the whitelist"
+        return super().respond(command)
+
+
+def test_read_entries():
+    source = io.StringIO('name,reason\nSteve,"Griefing, twice"\n\nAlex\n')
+    assert list(bulk.read_entries(source)) == [('Steve', 'Griefing, twice'), ('Alex', None)]
+
+
+# Real 'banlist' output: entries are joined with nothing between them
+BANLIST = ('There are 4 ban(s):Steve was banned by Server: GriefingAlex was banned by Admin: '
+           'Spam bots!Notch was banned by Server: Banned by an operator.'
+           '203.0.113.7 was banned by Server: Alt accounts')
+
+
+class BanServer(FakeRCONServer):
+    def respond(self, command):
+        if command == 'banlist':
+            return BANLIST
+        if command.startswith('ban '):
+            return f"Banned {command.split()[1]}: {command.split(' ', 2)[2]}"
+        return super().respond(command)
+
+
+def test_parse_banlist():
+    banned = bulk.parse_banlist(BANLIST)
+    assert {'steve', 'alex', 'notch'} <= banned
+    assert 'herobrine' not in banned
+
+
+def test_ban_import_skips_every_banned_player(loaded_config):
+    async def progress(summary):
+        pass
+
+    async def scenario():
+        server = BanServer('secret')
+        loaded_config.update(
+            server_address='127.0.0.1', rcon_port=await server.start(),
+            rcon_password='secret', rcon_timeout=1, servers={})
+        servers.load_servers()
+        entries = bulk.read_entries(io.StringIO('Steve\nalex\nNotch\nHerobrine,Myths\n'))
+        try:
+            summary = await bulk.run_import(
+                servers.get_server(), entries, 'ban', window=4, progress=progress)
+        finally:
+            await servers.close_servers()
+            await server.stop()
+        return server, summary
+
+    server, summary = run(scenario())
+    assert server.commands == ['banlist', 'ban Herobrine Myths']
+    assert summary.already_present == 3
+    assert summary.succeeded == 1
+
+
+def test_run_import_dedupes_and_pipelines(loaded_config):
+    reports = []
+
+    async def progress(summary):
+        reports.append(summary.processed)
+
+    async def scenario():
+        server = WhitelistServer('secret')
+        loaded_config.update(
+            server_address='127.0.0.1', rcon_port=await server.start(),
+            rcon_password='secret', rcon_timeout=1, servers={})
+        servers.load_servers()
+        entries = bulk.read_entries(io.StringIO(
+            'steve\nAlex\nalex\nnot a name\n' + '\n'.join(f"player{i}" for i in range(50))))
+        try:
+            summary = await bulk.run_import(
+                servers.get_server(), entries, 'whitelist', window=4,
+                progress=progress, progress_interval=0)
+        finally:
+            await servers.close_servers()
+            await server.stop()
+        return server, summary
+
+    server, summary = run(scenario())
+    assert summary.succeeded == 51
+    assert summary.already_present == 2
+    assert summary.invalid == 1
+    assert summary.failed == []
+    assert server.logins == 1
+    assert server.commands[0] == 'whitelist list'
+    assert server.commands[1:3] == ['whitelist add Alex', 'whitelist add player0']
+    assert reports[-1] == summary.processed
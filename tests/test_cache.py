@@ -0,0 +1,61 @@
+import asyncio
+
+from mcadminbot.bot import cache
+from tests.fakercon import run
+
+
+def test_concurrent_lookups_share_one_fetch():
+    fetches = []
+
+    async def fetch():
+        fetches.append(1)
+        await asyncio.sleep(0.01)
+        return 'There are 0 of a max of 20 players online'
+
+    async def scenario():
+        response_cache = cache.ResponseCache(ttl=60)
+        responses = await asyncio.gather(*(response_cache.get('list', fetch) for _ in range(10)))
+        responses.append(await response_cache.get('list', fetch))
+        return responses, response_cache.stats()
+
+    responses, stats = run(scenario())
+    assert len(set(responses)) == 1
+    assert len(fetches) == 1
+    assert stats['misses'] == 1
+    assert stats['coalesced'] == 9
+    assert stats['hits'] == 1
+
+
+def test_invalidate_forces_refetch():
+    values = iter(['first', 'second'])
+
+    async def fetch():
+        return next(values)
+
+    async def scenario():
+        response_cache = cache.ResponseCache(ttl=60)
+        first = await response_cache.get('banlist', fetch)
+        response_cache.invalidate('banlist')
+        return first, await response_cache.get('banlist', fetch)
+
+    assert run(scenario()) == ('first', 'second')
+
+
+def test_failed_fetch_is_not_cached():
+    attempts = []
+
+    async def fetch():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionResetError()
+        return 'ok'
+
+    async def scenario():
+        response_cache = cache.ResponseCache(ttl=60)
+        try:
+            await response_cache.get('list', fetch)
+        except ConnectionResetError:
+            pass
+        return await response_cache.get('list', fetch)
+
+    assert run(scenario()) == 'ok'
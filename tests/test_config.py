@@ -0,0 +1,62 @@
+from collections import namedtuple
+
+import pytest
+
+import mcadminbot.config as config
+
+Role = namedtuple('Role', ['name', 'id'])
+
+
+def test_compiled_grants(loaded_config):
+    loaded_config.update(
+        admin_users=['NONE'],
+        admin_roles=['NONE'],
+        ban_allowed_users=['Alex', 1234],
+        ban_allowed_roles=['Moderators', 5678],
+        kick_allowed_users=['NONE'],
+        kick_allowed_roles=['ALL'],
+    )
+    config.apply_config(loaded_config)
+
+    assert not config.PERMISSIONS.admin.allows('Alex', 1, [])
+    ban = config.get_grant('ban')
+    assert ban.allows('Alex', 1, [])
+    assert ban.allows('Steve', 1234, [])
+    assert ban.allows('Steve', 1, [Role('Moderators', 9)])
+    assert ban.allows('Steve', 1, [Role('Everyone', 5678)])
+    assert not ban.allows('Steve', 1, [Role('Everyone', 9)])
+    assert config.get_grant('kick').allows('Steve', 1, [])
+    assert not config.get_grant('list').allows('Steve', 1, [])
+    assert not config.get_grant('not-a-command').allows('Steve', 1, [])
+
+
+def test_invalid_config_is_rejected_before_apply(tmp_path, loaded_config):
+    config_file = tmp_path / 'mcadminbot.yaml'
+    config_file.write_text('rcon_port: not-a-port\n')
+    current = config.CONFIG
+
+    with pytest.raises(config.McadminbotConfigValidationError):
+        config.parse_config(str(config_file))
+    assert config.CONFIG is current
+
+
+def test_snapshot_is_reused_until_a_source_changes(tmp_path, config_snapshot):
+    config_file = tmp_path / 'mcadminbot.yaml'
+    config_file.write_text('rcon_port: 25576\n')
+
+    assert config.parse_config(str(config_file))['rcon_port'] == 25576
+    assert config_snapshot.stat().st_mode & 0o777 == 0o600
+    key = config._snapshot_key([config_file])
+    assert config._read_snapshot(key)['rcon_port'] == 25576
+
+    config_file.write_text('rcon_port: 25577\n')
+    assert config._read_snapshot(config._snapshot_key([config_file])) is None
+    assert config.parse_config(str(config_file))['rcon_port'] == 25577
+
+
+def test_invalid_job_is_rejected(tmp_path, loaded_config):
+    config_file = tmp_path / 'mcadminbot.yaml'
+    config_file.write_text('jobs:\n  autosave:\n    command: save-all\n    every: soon\n')
+
+    with pytest.raises(config.McadminbotConfigValidationError, match='autosave'):
+        config.parse_config(str(config_file))
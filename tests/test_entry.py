@@ -0,0 +1,49 @@
+import subprocess
+import sys
+import time
+
+from mcadminbot import entry
+
+# Each child names itself mcadminbot so that it is recognised as the daemon
+IGNORES_SIGTERM = '''
+import signal, time
+signal.signal(signal.SIGTERM, signal.SIG_IGN)
+time.sleep(60)
+'''
+
+
+def start(code, pidfile):
+    process = subprocess.Popen([sys.executable, '-c', code, 'mcadminbot'])
+    pidfile.write_text(str(process.pid))
+    time.sleep(0.2)
+    return process
+
+
+def test_stop_waits_for_the_daemon_to_exit(tmp_path, monkeypatch):
+    monkeypatch.setattr(entry, 'PIDFILE', tmp_path / 'mcadminbot.pid')
+    process = start('import time; time.sleep(60)', entry.PIDFILE)
+
+    began = time.monotonic()
+    assert entry._stop_daemon(timeout=5)
+    assert time.monotonic() - began < 1
+    assert process.wait(1) is not None
+    assert not entry.PIDFILE.exists()
+
+
+def test_stop_kills_a_daemon_that_ignores_sigterm(tmp_path, monkeypatch):
+    monkeypatch.setattr(entry, 'PIDFILE', tmp_path / 'mcadminbot.pid')
+    process = start(IGNORES_SIGTERM, entry.PIDFILE)
+
+    assert entry._stop_daemon(timeout=0.2)
+    assert process.wait(1) == -9
+    assert not entry.PIDFILE.exists()
+
+
+def test_stale_pidfile_is_removed(tmp_path, monkeypatch):
+    monkeypatch.setattr(entry, 'PIDFILE', tmp_path / 'mcadminbot.pid')
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    entry.PIDFILE.write_text(str(process.pid))
+
+    assert not entry._stop_daemon(timeout=1)
+    assert not entry.PIDFILE.exists()
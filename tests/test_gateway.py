@@ -0,0 +1,47 @@
+import asyncio
+import os
+
+import pytest
+
+from mcadminbot.bot import exceptions
+from mcadminbot.bot import gateway
+from mcadminbot.bot import rcon
+from tests.fakercon import FakeRCONServer, run
+
+
+def test_gateway_pool_shares_the_supervisor_pools(tmp_path):
+    path = str(tmp_path / 'gateway.sock')
+
+    async def scenario():
+        server = FakeRCONServer('secret')
+        port = await server.start()
+        pools = {'survival': rcon.RCONPool('127.0.0.1', port, 'secret', size=1, timeout=1)}
+
+        def get_pool(name):
+            if name not in pools:
+                raise exceptions.McadminbotUnknownServerError(f"No server named [{name}]")
+            return pools[name]
+
+        gateway_server = await gateway.serve(path, get_pool)
+        mode = os.stat(path).st_mode & 0o777
+        local = rcon.RCONPool('127.0.0.1', port, 'secret', size=1, timeout=1)
+        shard_pool = gateway.GatewayPool(path, 'survival', local)
+        responses = await asyncio.gather(*(shard_pool.command(f"say {i}") for i in range(5)))
+
+        unknown = gateway.GatewayPool(path, 'creative', local)
+        with pytest.raises(exceptions.McadminbotRCONError):
+            await unknown.command('list')
+
+        stats = shard_pool.stats()
+        await unknown.close()
+        await shard_pool.close()
+        gateway_server.close()
+        await pools['survival'].close()
+        await server.stop()
+        return responses, stats, pools['survival'].stats(), mode
+
+    responses, stats, pool_stats, mode = run(scenario())
+    assert mode == 0o600
+    assert responses == [f"ran say {i}" for i in range(5)]
+    assert stats['gateway_commands'] == 5
+    assert pool_stats['created'] == 1
@@ -0,0 +1,33 @@
+import asyncio
+import subprocess
+import sys
+
+from mcadminbot.bot import handoff
+
+
+def test_successor_runs_only_what_the_predecessor_did_not(tmp_path, monkeypatch):
+    monkeypatch.setattr(handoff, 'HANDOFF_PATH', tmp_path / 'mcadminbot.handoff')
+    standby = handoff.Standby(predecessor=1)
+    for item_id in (10, 11, 12):
+        standby.buffer(item_id, print, f"command {item_id}")
+
+    handoff.write_handled([9, 11])
+    pending = standby.pending(handoff.read_handled())
+
+    assert pending == [(print, ('command 10',)), (print, ('command 12',))]
+    assert not handoff.HANDOFF_PATH.exists()
+    assert handoff.read_handled() == set()
+
+
+def test_wait_for_exit():
+    # The child names itself mcadminbot so that it is recognised without a pidfd
+    process = subprocess.Popen(
+        [sys.executable, '-c', 'import time; time.sleep(0.2)', 'mcadminbot'])
+    loop = asyncio.new_event_loop()
+    try:
+        assert not loop.run_until_complete(handoff.wait_for_exit(process.pid, 0.01))
+        # The process is a child here, so it lingers as a zombie until it is reaped
+        loop.run_until_complete(loop.run_in_executor(None, process.wait))
+        assert loop.run_until_complete(handoff.wait_for_exit(process.pid, 1))
+    finally:
+        loop.close()
@@ -0,0 +1,110 @@
+import asyncio
+import json
+import types
+
+import pytest
+
+import mcadminbot.config as config
+
+from mcadminbot.bot import exceptions
+from mcadminbot.bot import jobs
+from mcadminbot.bot import servers
+from tests.fakercon import FakeRCONServer, run
+
+
+def job(name, due, interval=60, **fields):
+    return jobs.Job(**dict(dict(
+        name=name, command='save-all', server=None, interval=interval, due=due, jitter=0,
+        misfire='run_once', owner=None), **fields))
+
+
+def test_queue_pops_due_jobs_in_order():
+    queue = jobs.JobQueue()
+    queue.push(job('late', 30))
+    queue.push(job('early', 10))
+    queue.push(job('removed', 5))
+    queue.push(job('replaced', 1))
+    queue.push(job('replaced', 40))
+    queue.remove('removed')
+
+    assert queue.next_time() == 10
+    assert [(due.name, run_at) for due, run_at in queue.pop_due(30)] == [
+        ('early', 10), ('late', 30)]
+    assert [queued.name for queued in queue] == ['replaced']
+
+
+def test_misfired_jobs_resume_their_schedule(loaded_config):
+    loop = asyncio.new_event_loop()
+    server = FakeRCONServer('secret')
+    loaded_config.update(
+        rcon_port=loop.run_until_complete(server.start()), rcon_password='secret',
+        server_address='127.0.0.1', job_misfire_grace=60)
+    servers.load_servers()
+    cog = jobs.Jobs(types.SimpleNamespace(primary=False))
+
+    async def scenario():
+        # Down for an hour: one job runs once, the other waits for its next time
+        ran = await cog.fire(job('save', 1000), 1000, 4600)
+        skipped = await cog.fire(job('warn', 1000, misfire='skip'), 1000, 4600)
+        await servers.close_servers()
+        await server.stop()
+        return ran, skipped
+
+    try:
+        ran, skipped = loop.run_until_complete(scenario())
+    finally:
+        loop.close()
+
+    assert ran is not None and skipped is None
+    assert server.commands == ['save-all']
+    cog.reschedule(job('save', 1000), 4600)
+    assert cog.queue.get('save').due == 4660
+
+
+def test_jobs_survive_a_restart(tmp_path, loaded_config):
+    loaded_config.update(job_file=str(tmp_path / 'jobs.json'), jobs={
+        'backup': {'command': 'save-all', 'every': '1h'},
+        'restart-warning': {'command': 'say "Restarting at 04:00"', 'at': '03:55'},
+    })
+    saved = [
+        job('backup', 5000, interval=3600)._asdict(),
+        job('old-config-job', 5000)._asdict(),
+        job('event', 6000, interval=0, owner='admin#0001')._asdict(),
+    ]
+    (tmp_path / 'jobs.json').write_text(json.dumps(saved))
+    (tmp_path / 'jobs.json').chmod(0o600)
+    cog = jobs.Jobs(types.SimpleNamespace(primary=False))
+
+    cog.load(now=4000)
+    cog.save()
+
+    names = {saved_job['name']: saved_job for saved_job in
+             json.loads((tmp_path / 'jobs.json').read_text())}
+    assert set(names) == {'backup', 'restart-warning', 'event'}
+    assert names['backup']['due'] == 5000
+    assert names['restart-warning']['interval'] == 86400
+    assert names['event']['owner'] == 'admin#0001'
+    assert (tmp_path / 'jobs.json').stat().st_mode & 0o777 == 0o600
+
+
+def test_a_job_file_others_could_write_is_ignored(tmp_path, loaded_config):
+    loaded_config.update(job_file=str(tmp_path / 'jobs.json'))
+    planted = job('op', 5000, command='op Griefer', owner='admin#0001')
+    (tmp_path / 'jobs.json').write_text(json.dumps([planted._asdict()]))
+    (tmp_path / 'jobs.json').chmod(0o666)
+    cog = jobs.Jobs(types.SimpleNamespace(primary=False))
+
+    cog.load(now=4000)
+
+    assert cog.queue.get('op') is None
+
+
+def test_only_admins_schedule_commands(loaded_config):
+    loaded_config.update(admin_users=['admin'], admin_roles=[], schedule_allowed_users=['ALL'])
+    config.apply_config(loaded_config)
+    cog = jobs.Jobs(types.SimpleNamespace(primary=False))
+    ctx = types.SimpleNamespace(author=types.SimpleNamespace(name='player', id=2, roles=[]))
+
+    with pytest.raises(exceptions.McadminbotCommandPermissionsError):
+        run(cog._schedule(ctx, None, 'op', '1m', 'op player', recurring=False))
+    assert cog.queue.get('op') is None
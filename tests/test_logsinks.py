@@ -0,0 +1,34 @@
+import tarfile
+import time
+
+from loguru import logger
+
+from mcadminbot import logsinks
+
+
+def test_queued_sink_batches_and_flushes_on_remove():
+    batches = []
+    sink = logsinks.QueuedSink(batches.append)
+    handler = logger.add(sink, format='{message}')
+    for index in range(100):
+        logger.info(f"message {index}")
+    logger.remove(handler)
+
+    messages = [message for batch in batches for message in batch]
+    assert messages == [f"message {index}\n" for index in range(100)]
+
+
+def test_rotated_files_are_compressed(tmp_path):
+    path = tmp_path / 'mcadminbot.log'
+    writer = logsinks.RotatingFileWriter(str(path), rotation_bytes=10, compression='tar.gz')
+    writer(['first batch\n'])
+    writer(['second batch\n'])
+
+    for _ in range(100):
+        archives = list(tmp_path.glob('mcadminbot.log.*.tar.gz'))
+        if archives and not list(tmp_path.glob('mcadminbot.log.*[0-9]')):
+            break
+        time.sleep(0.01)
+    assert path.read_text() == 'second batch\n'
+    with tarfile.open(str(archives[0])) as archive:
+        assert archive.extractfile(archive.getmembers()[0]).read() == b'first batch\n'
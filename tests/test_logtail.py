@@ -0,0 +1,72 @@
+import os
+import types
+
+import discord
+
+from mcadminbot.bot import logstream
+from mcadminbot.bot import logtail
+from tests.fakercon import run
+
+
+def test_parse_line_recognizes_player_events():
+    prefix = '[12:34:56] [Server thread/INFO]: '
+    assert logtail.parse_line(prefix + 'Steve joined the game') == \
+        logtail.LogEvent(logtail.JOIN, 'Steve', '')
+    assert logtail.parse_line(prefix + 'Alex left the game').kind == logtail.LEAVE
+    assert logtail.parse_line(prefix + '<Steve> hello there') == \
+        logtail.LogEvent(logtail.CHAT, 'Steve', 'hello there')
+    assert logtail.parse_line(prefix + 'Steve was slain by Zombie') == \
+        logtail.LogEvent(logtail.DEATH, 'Steve', 'was slain by Zombie')
+    assert logtail.parse_line(prefix + 'Steve fell from a high place').kind == logtail.DEATH
+    assert logtail.parse_line(prefix + 'Preparing spawn area: 83%') is None
+    assert logtail.parse_line('[12:34:56] [Server thread/WARN]: Steve joined the game') is None
+
+
+def test_tailer_resumes_and_survives_rotation(tmp_path):
+    log_path = tmp_path / 'latest.log'
+    offset_path = str(tmp_path / 'offsets.json')
+    line = '[12:34:56] [Server thread/INFO]: {} joined the game\n'
+    log_path.write_text(line.format('Before'))
+
+    # A tailer that has never read the file starts at its end
+    tailer = logtail.LogTailer(str(log_path), logtail.OffsetStore(offset_path))
+    with log_path.open('a') as log_file:
+        log_file.write(line.format('Steve') + '[12:34:57] [Server thread/INFO]: <Ste')
+    assert [event.player for event in tailer.read_events()] == ['Steve']
+    tailer.offsets.save()
+
+    # A restarted tailer resumes at the saved offset, including the partial line
+    with log_path.open('a') as log_file:
+        log_file.write('ve> hi\n')
+    resumed = logtail.LogTailer(str(log_path), logtail.OffsetStore(offset_path))
+    assert resumed.read_events() == [logtail.LogEvent(logtail.CHAT, 'Steve', 'hi')]
+
+    # Rotation replaces the file, which is then read from the start
+    os.replace(str(log_path), str(tmp_path / 'old.log'))
+    log_path.write_text(line.format('Alex'))
+    assert [event.player for event in resumed.read_events()] == ['Alex']
+
+
+def test_log_events_mention_no_one_and_are_kept_when_sending_fails(loaded_config):
+    class Channel:
+        def __init__(self):
+            self.sent = []
+            self.fail = True
+
+        async def send(self, message, allowed_mentions=None):
+            if self.fail:
+                raise discord.HTTPException(types.SimpleNamespace(status=503, reason=''), '')
+            self.sent.append((message, allowed_mentions))
+
+    loaded_config['log_channel'] = 1
+    channel = Channel()
+    cog = types.SimpleNamespace(bot=types.SimpleNamespace(get_channel=lambda _: channel))
+    lines = ['<Steve> @everyone look']
+
+    unsent = run(logstream.LogStream._send(cog, lines))
+    channel.fail = False
+    assert run(logstream.LogStream._send(cog, unsent)) == []
+
+    (message, mentions), = channel.sent
+    assert message == '<Steve> @everyone look'
+    assert not mentions.everyone and not mentions.roles and not mentions.users
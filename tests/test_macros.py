@@ -0,0 +1,86 @@
+import asyncio
+import json
+import types
+
+import pytest
+
+from mcadminbot.bot import exceptions
+from mcadminbot.bot import macros
+from mcadminbot.bot import servers
+from tests.fakercon import FakeRCONServer
+
+PUNISH = macros.Macro('punish', [
+    'kick {player} {reason}', 'ban-ip {player} {reason}', 'whitelist remove {player}',
+    'say {player} was removed',
+], None)
+
+
+def test_arguments_fill_placeholders_in_order():
+    assert PUNISH.usage() == 'punish <player> <reason>'
+    assert PUNISH.render(['Griefer', 'burned', 'the\nspawn']) == [
+        'kick Griefer burned the spawn', 'ban-ip Griefer burned the spawn',
+        'whitelist remove Griefer', 'say Griefer was removed',
+    ]
+    with pytest.raises(exceptions.McadminbotMacroError):
+        PUNISH.render(['Griefer'])
+
+
+def test_macro_runs_over_one_connection_and_stops_at_the_first_rejection(loaded_config):
+    loop = asyncio.new_event_loop()
+    server = FakeRCONServer('secret')
+    loaded_config.update(
+        rcon_port=loop.run_until_complete(server.start()), rcon_password='secret',
+        server_address='127.0.0.1')
+    servers.load_servers()
+    target = servers.get_server()
+
+    # Failures from earlier, unrelated commands
+    target.breaker.failures = 2
+
+    async def scenario():
+        done = await macros.run_macro(target, PUNISH.render(['Steve', 'griefing']))
+        server.respond = lambda command: (
+            'That player does not exist' if command.startswith('ban-ip') else f"ran {command}")
+        stopped = await macros.run_macro(target, PUNISH.render(['Alex', 'griefing']))
+        stats = target.stats()
+        await servers.close_servers()
+        await server.stop()
+        return done, stopped, stats
+
+    try:
+        done, stopped, stats = loop.run_until_complete(scenario())
+    finally:
+        loop.close()
+
+    assert done.succeeded
+    assert target.breaker.failures == 0
+    assert not stopped.succeeded
+    assert server.commands[4:] == ['kick Alex griefing', 'ban-ip Alex griefing']
+    assert server.logins == 1
+    assert stats['created'] == 1
+    assert stopped.format().splitlines() == [
+        f"[{target.name}] FAILED: 1/4 commands succeeded",
+        '> kick Alex griefing: ran kick Alex griefing',
+        '> ban-ip Alex griefing: That player does not exist',
+        '> whitelist remove Alex: not run',
+        '> say Alex was removed: not run',
+    ]
+
+
+def test_saved_macros_are_private(tmp_path, loaded_config):
+    path = tmp_path / 'state' / 'macros.json'
+    loaded_config['macro_file'] = str(path)
+    cog = macros.Macros(types.SimpleNamespace())
+    cog.defined['punish'] = PUNISH
+    cog.save()
+
+    assert path.stat().st_mode & 0o777 == 0o600
+    assert path.parent.stat().st_mode & 0o777 == 0o700
+    shard = macros.Macros(types.SimpleNamespace())
+    shard.refresh()
+    assert shard.defined == {'punish': PUNISH}
+
+    path.write_text(json.dumps([macros.Macro('punish', ['op {player}'], None)._asdict()]))
+    path.chmod(0o666)
+    shard.refresh()
+    assert shard.defined == {'punish': PUNISH}
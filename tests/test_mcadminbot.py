@@ -1,2 +1,30 @@
+import pytest
+
+from mcadminbot.bot import bot
+from mcadminbot.bot import exceptions
+
+
 def test_placeholder():
-    assert True
\ No newline at end of file
+    assert True
+
+def test_gateway_options_request_only_what_commands_need(loaded_config):
+    options = bot.gateway_options()
+    assert options['intents'].guild_messages
+    assert not options['intents'].members and not options['intents'].presences
+    assert options['member_cache_flags'].value == 0
+    assert options['max_messages'] is None
+    assert options['chunk_guilds_at_startup'] is False
+
+
+def test_gateway_options_reject_unknown_flags(loaded_config):
+    loaded_config['discord_intents'] = ['guilds', 'everything']
+    with pytest.raises(exceptions.McadminbotConfigError):
+        bot.gateway_options()
+
+
+def test_gateway_options_reject_voice_cache_without_voice_states(loaded_config):
+    loaded_config['member_cache'] = ['voice']
+    with pytest.raises(exceptions.McadminbotConfigError):
+        bot.gateway_options()
+    loaded_config['discord_intents'] = ['guilds', 'guild_messages', 'voice_states']
+    assert bot.gateway_options()['member_cache_flags'].voice
@@ -0,0 +1,39 @@
+import asyncio
+
+from mcadminbot.bot import metrics
+from tests.fakercon import run
+
+
+def test_histogram_buckets_and_quantiles():
+    histogram = metrics.Histogram('test_seconds', 'Test histogram', ['stage'], buckets=(0.1, 1.0))
+    for value in (0.05, 0.05, 0.5, 5.0):
+        histogram.observe(value, stage='a')
+
+    assert histogram.count(stage='a') == 4
+    assert histogram.quantile(0.5, stage='a') == 0.1
+    assert histogram.quantile(0.99, stage='a') == 1.0
+    assert histogram.quantile(0.5, stage='b') == 0.0
+    samples = {(name, labels.get('le')): value for name, labels, value in histogram.samples()}
+    assert samples[('test_seconds_bucket', '0.1')] == 2
+    assert samples[('test_seconds_bucket', '1.0')] == 3
+    assert samples[('test_seconds_bucket', '+Inf')] == 4
+    assert samples[('test_seconds_count', None)] == 4
+
+
+def test_render_and_serve():
+    metrics.COMMANDS_TOTAL.inc(command='list', outcome='success')
+
+    async def scenario():
+        server = await metrics.start_server('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        response = await reader.read()
+        writer.close()
+        server.close()
+        return response.decode()
+
+    response = run(scenario())
+    assert response.startswith('HTTP/1.1 200 OK')
+    assert '# TYPE mcadminbot_commands_total counter' in response
+    assert 'mcadminbot_commands_total{command="list",outcome="success"}' in response
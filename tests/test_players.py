@@ -0,0 +1,31 @@
+from mcadminbot.bot import logtail
+from mcadminbot.bot import players
+
+
+def test_parse_list_formats():
+    assert players.parse_list('There are 2 of a max of 20 players online: Steve, Alex') == \
+        (frozenset(['Steve', 'Alex']), 20)
+    assert players.parse_list('There are 0/10 players online:') == (frozenset(), 10)
+    assert players.parse_list('Unknown command') is None
+
+
+def test_tracker_diffs_snapshots_and_log_events():
+    changes = []
+
+    def listener(server_name, change, player):
+        changes.append((change, player))
+
+    tracker = players.PlayerTracker('survival')
+    players.add_listener(listener)
+    try:
+        # Log events before the first snapshot and the first snapshot itself are not changes
+        tracker.observe_event(logtail.LogEvent(logtail.JOIN, 'Early', ''))
+        tracker.observe_list('There are 1 of a max of 20 players online: Steve')
+        tracker.observe_event(logtail.LogEvent(logtail.JOIN, 'Alex', ''))
+        tracker.observe_event(logtail.LogEvent(logtail.CHAT, 'Alex', 'hi'))
+        tracker.observe_list('There are 2 of a max of 20 players online: Alex, Notch')
+    finally:
+        players.remove_listener(listener)
+
+    assert changes == [('joined', 'Alex'), ('joined', 'Notch'), ('left', 'Steve')]
+    assert tracker.format() == 'There are 2 of a max of 20 players online: Alex, Notch'
@@ -0,0 +1,158 @@
+import asyncio
+import struct
+
+import pytest
+
+from mcadminbot.bot import exceptions
+from mcadminbot.bot import rcon
+from tests.fakercon import FakeRCONServer, run
+
+
+def test_encode_packet():
+    packet = rcon.encode_packet(7, rcon.PACKET_TYPE_COMMAND, 'list')
+    assert packet == struct.pack('<iii', 14, 7, 2) + b'list\x00\x00'
+
+
+def test_client_command():
+    async def scenario():
+        server = FakeRCONServer('secret')
+        port = await server.start()
+        client = rcon.RCONClient('127.0.0.1', port, timeout=1)
+        await client.connect()
+        assert await client.login('secret')
+        response = await client.command('list')
+        await client.close()
+        await server.stop()
+        return response
+
+    assert run(scenario()) == 'ran list'
+
+
+def test_client_bad_password():
+    async def scenario():
+        server = FakeRCONServer('secret')
+        port = await server.start()
+        client = rcon.RCONClient('127.0.0.1', port, timeout=1)
+        await client.connect()
+        success = await client.login('wrong')
+        await client.close()
+        await server.stop()
+        return success
+
+    assert not run(scenario())
+
+
+def test_pool_reuses_connections():
+    async def scenario():
+        server = FakeRCONServer('secret')
+        port = await server.start()
+        pool = rcon.RCONPool('127.0.0.1', port, 'secret', size=2, timeout=1)
+        responses = [await pool.command('list'), await pool.command('banlist')]
+        stats = pool.stats()
+        await pool.close()
+        await server.stop()
+        return responses, stats
+
+    responses, stats = run(scenario())
+    assert responses == ['ran list', 'ran banlist']
+    assert stats['created'] == 1
+    assert stats['reused'] == 1
+    assert stats['idle'] == 1
+
+
+def test_pool_reconnects_after_reset():
+    async def scenario():
+        server = FakeRCONServer('secret', commands_per_connection=1)
+        port = await server.start()
+        pool = rcon.RCONPool('127.0.0.1', port, 'secret', size=1, timeout=1)
+        responses = [await pool.command('list')]
+        # The server closes the idle connection
+        await asyncio.sleep(0.05)
+        responses.append(await pool.command('list'))
+        stats = pool.stats()
+        await pool.close()
+        await server.stop()
+        return responses, stats
+
+    responses, stats = run(scenario())
+    assert responses == ['ran list', 'ran list']
+    assert stats['created'] == 2
+
+
+def test_pool_does_not_resend_a_command_that_timed_out():
+    async def scenario():
+        server = FakeRCONServer('secret')
+        port = await server.start()
+        pool = rcon.RCONPool('127.0.0.1', port, 'secret', size=1, timeout=0.1)
+        await pool.command('list')
+        server.latency = 0.3
+        try:
+            await pool.command('give Steve diamond 64')
+        except exceptions.McadminbotRCONError:
+            pass
+        await asyncio.sleep(0.3)
+        await pool.close()
+        await server.stop()
+        return server.commands
+
+    assert run(scenario()) == ['list', 'give Steve diamond 64']
+
+
+
+def test_pool_does_not_resend_a_command_whose_write_timed_out():
+    async def scenario():
+        server = FakeRCONServer('secret')
+        port = await server.start()
+        pool = rcon.RCONPool('127.0.0.1', port, 'secret', size=1, timeout=0.1)
+        await pool.command('list')
+        client, _ = pool._idle[-1]
+
+        async def stalled_drain():
+            await asyncio.sleep(1)
+
+        client._writer.drain = stalled_drain
+        with pytest.raises(exceptions.McadminbotRCONError) as raised:
+            await pool.command('op Steve')
+        await asyncio.sleep(0.1)
+        stats = pool.stats()
+        await pool.close()
+        await server.stop()
+        return raised.value, stats, server.commands
+
+    error, stats, commands = run(scenario())
+    assert not isinstance(error, exceptions.McadminbotRCONNotSentError)
+    assert stats['relogins'] == 0
+    assert commands.count('op Steve') <= 1
+
+def test_pool_rejected_password():
+    async def scenario():
+        server = FakeRCONServer('secret')
+        port = await server.start()
+        pool = rcon.RCONPool('127.0.0.1', port, 'wrong', timeout=1)
+        try:
+            await pool.command('list')
+        finally:
+            await server.stop()
+
+    with pytest.raises(exceptions.McadminbotRCONAuthError):
+        run(scenario())
+
+
+def test_client_reassembles_fragmented_response():
+    class LongResponseServer(FakeRCONServer):
+        def respond(self, command):
+            # An odd prefix makes fragment boundaries split two-byte characters
+            return 'x' + 'é' * 5000
+
+    async def scenario():
+        server = LongResponseServer('secret')
+        port = await server.start()
+        client = rcon.RCONClient('127.0.0.1', port, timeout=1)
+        await client.connect()
+        await client.login('secret')
+        responses = [await client.command('banlist'), await client.command('list')]
+        await client.close()
+        await server.stop()
+        return responses
+
+    assert run(scenario()) == ['x' + 'é' * 5000] * 2
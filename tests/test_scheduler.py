@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from mcadminbot.bot import exceptions
+from mcadminbot.bot import scheduler
+from tests.fakercon import run
+
+SETTINGS = {
+    'rcon_pool_size': 1,
+    'rcon_queue_size': 3,
+    'user_rate_limit': 0,
+    'user_rate_burst': 5,
+    'command_rate_limits': {},
+}
+
+
+def test_moderation_commands_leave_the_queue_first():
+    order = []
+
+    async def scenario():
+        commands = scheduler.CommandScheduler('test', SETTINGS)
+        release = asyncio.Event()
+
+        async def hold():
+            await release.wait()
+
+        async def record(command):
+            order.append(command)
+
+        holder = asyncio.ensure_future(commands.run('say hi', None, hold))
+        await asyncio.sleep(0)
+        waiting = [
+            asyncio.ensure_future(commands.run(command, None, lambda c=command: record(c)))
+            for command in ('list', 'whitelist add Steve', 'kick Griefer')
+        ]
+        await asyncio.sleep(0)
+        assert commands.stats()['queued'] == 3
+        release.set()
+        await asyncio.gather(holder, *waiting)
+        return commands.stats()
+
+    stats = run(scenario())
+    assert order == ['kick Griefer', 'whitelist add Steve', 'list']
+    assert stats['active'] == 0
+    assert stats['max_depth'] == 3
+
+
+def test_full_queue_rejects_commands():
+    async def scenario():
+        commands = scheduler.CommandScheduler('test', SETTINGS)
+        release = asyncio.Event()
+        held = [
+            asyncio.ensure_future(commands.run('say hi', None, release.wait))
+            for _ in range(4)
+        ]
+        await asyncio.sleep(0)
+        with pytest.raises(exceptions.McadminbotRateLimitError):
+            await commands.run('say hi', None, release.wait)
+        release.set()
+        await asyncio.gather(*held)
+        return commands.stats()
+
+    assert run(scenario())['queue_full'] == 1
+
+
+def test_user_and_command_rate_limits():
+    settings = dict(SETTINGS, user_rate_limit=0.001, user_rate_burst=2,
+                    command_rate_limits={'say': {'rate': 0.001, 'burst': 1}})
+
+    async def respond():
+        return 'ok'
+
+    async def scenario():
+        commands = scheduler.CommandScheduler('test', settings)
+        await commands.run('list', 1, respond)
+        await commands.run('list', 1, respond)
+        with pytest.raises(exceptions.McadminbotRateLimitError):
+            await commands.run('list', 1, respond)
+        await commands.run('say hi', 2, respond)
+        with pytest.raises(exceptions.McadminbotRateLimitError):
+            await commands.run('say hi', 3, respond)
+        return commands.stats()
+
+    assert run(scenario())['rate_limited'] == 2
+
+
+def test_follow_up_commands_are_rate_limited():
+    settings = dict(SETTINGS, command_rate_limits={'say': {'rate': 0.001, 'burst': 1}})
+
+    async def scenario():
+        commands = scheduler.CommandScheduler('test', settings)
+        async with commands.slot('kick Griefer', 1, follow_up=['say Griefer was kicked']):
+            pass
+        with pytest.raises(exceptions.McadminbotRateLimitError):
+            async with commands.slot('kick Alex', 1, follow_up=['say Alex was kicked']):
+                pass
+        return commands.stats()
+
+    assert run(scenario())['rate_limited'] == 1
+
+
+def test_cancelled_waiters_leave_the_queue():
+    async def scenario():
+        commands = scheduler.CommandScheduler('test', SETTINGS)
+        release = asyncio.Event()
+        holder = asyncio.ensure_future(commands.run('say hi', None, release.wait))
+        await asyncio.sleep(0)
+        for _ in range(SETTINGS['rcon_queue_size']):
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(commands.run('list', None, release.wait), 0.01)
+        queued = commands.stats()['queued']
+        # The queue has room again for a command that is not cancelled
+        waiting = asyncio.ensure_future(commands.run('list', None, release.wait))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, waiting)
+        return queued, commands.stats()
+
+    queued, stats = run(scenario())
+    assert queued == 0
+    assert stats['queue_full'] == 0
+    assert stats['active'] == 0
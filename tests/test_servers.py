@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+from discord.ext import commands
+
+from mcadminbot.bot import exceptions
+from mcadminbot.bot import servers
+
+
+def test_single_server_from_top_level_keys(loaded_config):
+    servers.load_servers()
+    server = servers.get_server()
+    assert server.name == servers.DEFAULT_SERVER_NAME
+    assert server.address == loaded_config['server_address']
+    assert server.port == loaded_config['rcon_port']
+
+
+def test_servers_map_inherits_top_level_keys(loaded_config):
+    loaded_config['rcon_password'] = 'shared'
+    loaded_config['default_server'] = 'creative'
+    loaded_config['servers'] = {
+        'survival': {'server_address': 'survival.example.com'},
+        'creative': {'server_address': 'creative.example.com', 'rcon_port': 25576},
+    }
+    servers.load_servers()
+    assert [server.name for server in servers.all_servers()] == ['survival', 'creative']
+    assert servers.get_server().name == 'creative'
+    assert servers.get_server('survival').password == 'shared'
+    assert servers.get_server('creative').port == 25576
+
+
+def test_unknown_server(loaded_config):
+    servers.load_servers()
+    with pytest.raises(exceptions.McadminbotUnknownServerError):
+        servers.get_server('nether')
+
+
+def test_unknown_default_server(loaded_config):
+    loaded_config['default_server'] = 'nether'
+    with pytest.raises(exceptions.McadminbotConfigError):
+        servers.load_servers()
+
+
+def test_server_target(loaded_config):
+    loaded_config['servers'] = {'survival': {'server_address': 'survival.example.com'}}
+    servers.load_servers()
+    convert = servers.ServerTarget().convert
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(convert(None, '@survival')) == 'survival'
+        assert loop.run_until_complete(convert(None, '@all')) == servers.ALL_SERVERS
+        # Mentions and player names fall through to the command's other arguments
+        for argument in ('Steve', '@here', '@Steve', '@'):
+            with pytest.raises(commands.BadArgument):
+                loop.run_until_complete(convert(None, argument))
+    finally:
+        loop.close()
+
+
+def test_reload_keeps_unchanged_servers(loaded_config):
+    loaded_config['servers'] = {
+        'survival': {'server_address': 'survival.example.com'},
+        'creative': {'server_address': 'creative.example.com'},
+    }
+    servers.load_servers()
+    survival = servers.get_server('survival')
+    creative = servers.get_server('creative')
+
+    new_config = dict(loaded_config, servers={
+        'survival': {'server_address': 'survival.example.com'},
+        'creative': {'server_address': 'creative.example.com', 'rcon_port': 25576},
+    })
+    retired = servers.load_servers(new_config)
+
+    assert servers.get_server('survival') is survival
+    assert servers.get_server('creative') is not creative
+    assert retired == [creative]
+
+
+def test_invalid_reload_changes_nothing(loaded_config):
+    loaded_config['servers'] = {'survival': {'log_file': '/srv/survival/logs/latest.log'}}
+    servers.load_servers()
+    survival = servers.get_server('survival')
+
+    new_config = dict(loaded_config, rcon_cache_ttl=30, servers={
+        'survival': {'log_file': '/srv/new/latest.log'},
+        'creative': {'rcon_port': 'not-a-port'},
+    })
+    with pytest.raises(exceptions.McadminbotConfigError):
+        servers.load_servers(new_config)
+
+    assert servers.get_server('survival') is survival
+    assert survival.log_file == '/srv/survival/logs/latest.log'
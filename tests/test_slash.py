@@ -0,0 +1,128 @@
+import asyncio
+import types
+
+import discord
+import pytest
+
+from mcadminbot.bot import bot
+from mcadminbot.bot import handoff
+from mcadminbot.bot import servers
+from mcadminbot.bot import slash
+from tests.fakercon import FakeRCONServer, run
+
+
+class FakeHTTP:
+    """Records the requests a bot sends to Discord."""
+
+    def __init__(self):
+        self.requests = []
+
+    async def request(self, route, **kwargs):
+        self.requests.append((route.method, route.path, kwargs.get('json')))
+        return {'id': str(len(self.requests))}
+
+
+def interaction(name, options, interaction_type=slash.APPLICATION_COMMAND):
+    return {'t': 'INTERACTION_CREATE', 'd': {
+        'id': '900000000000000000', 'token': 'token', 'application_id': '1',
+        'type': interaction_type, 'channel_id': '2',
+        'user': {'id': '3', 'username': 'admin', 'discriminator': '0001', 'avatar': None},
+        'data': {'name': name, 'options': options},
+    }}
+
+
+def test_slash_command_runs_the_prefix_command(loaded_config):
+    loop = asyncio.new_event_loop()
+    server = FakeRCONServer('secret')
+    loaded_config.update(
+        rcon_port=loop.run_until_complete(server.start()), rcon_password='secret',
+        server_address='127.0.0.1', audit_database=None, config_watch_interval=0,
+        player_poll_interval=0)
+    mcadminbot = bot.Mcadminbot(loop=loop)
+    http = mcadminbot.http = FakeHTTP()
+    cog = mcadminbot.get_cog('SlashCommands')
+    servers.get_server().players.online.update(Steve=0, Alex=0, stephanie=0)
+
+    async def scenario():
+        await cog.on_socket_response(interaction(
+            'say', [{'name': 'message', 'type': slash.STRING, 'value': '"hi"'}]))
+        await cog.on_socket_response(interaction(
+            'whitelist', [{'name': 'add', 'type': slash.SUB_COMMAND, 'options': [
+                {'name': 'username', 'type': slash.STRING, 'value': 'Ste', 'focused': True},
+            ]}], slash.AUTOCOMPLETE))
+        await servers.close_servers()
+        await server.stop()
+
+    try:
+        loop.run_until_complete(scenario())
+    finally:
+        loop.close()
+
+    by_name = {definition['name']: definition for definition in cog.definitions}
+    assert [option['name'] for option in by_name['ban']['options']] == [
+        'username', 'reason', 'target']
+    assert {option['type'] for option in by_name['whitelist']['options']} == {slash.SUB_COMMAND}
+    assert cog.routes[('ban-import',)].qualified_name == 'ban import'
+
+    assert server.commands == ['say "hi"']
+    assert [request[:2] for request in http.requests] == [
+        ('POST', '/interactions/{interaction_id}/{token}/callback'),
+        ('PATCH', '/webhooks/{application_id}/{token}/messages/@original'),
+        ('POST', '/interactions/{interaction_id}/{token}/callback'),
+    ]
+    assert http.requests[0][2] == {'type': slash.DEFERRED_CHANNEL_MESSAGE}
+    assert http.requests[1][2] == {'content': 'Message ["hi"] sent'}
+    assert http.requests[2][2]['data']['choices'] == [
+        {'name': 'stephanie', 'value': 'stephanie'}, {'name': 'Steve', 'value': 'Steve'}]
+
+
+def test_slash_commands_are_not_dropped_during_a_handoff(loaded_config):
+    loop = asyncio.new_event_loop()
+    loaded_config.update(
+        audit_database=None, config_watch_interval=0, player_poll_interval=0, metrics_port=0)
+    successor = bot.Mcadminbot(predecessor=1, loop=loop)
+    successor_http = successor.http = FakeHTTP()
+    predecessor = bot.Mcadminbot(loop=loop)
+    predecessor_http = predecessor.http = FakeHTTP()
+    say = interaction('say', [{'name': 'message', 'type': slash.STRING, 'value': '"hi"'}])
+
+    async def scenario():
+        # Until the handoff starts, the running bot answers and the successor stays quiet
+        await successor.get_cog('SlashCommands').on_socket_response(say)
+        successor.standby.signalled = True
+        await successor.get_cog('SlashCommands').on_socket_response(say)
+        # A command the predecessor deferred just before it was told to hand off
+        predecessor.stopping = predecessor.handing_off = True
+        await predecessor.get_cog('SlashCommands')._run(say['d'])
+        await servers.close_servers()
+
+    try:
+        loop.run_until_complete(scenario())
+    finally:
+        loop.close()
+
+    assert successor.standby.buffered == []
+    assert [request[2] for request in successor_http.requests] == [
+        {'type': slash.CHANNEL_MESSAGE, 'data': {'content': handoff.RESTARTING_MESSAGE}}]
+    assert [request[2] for request in predecessor_http.requests] == [
+        {'type': slash.DEFERRED_CHANNEL_MESSAGE}, {'content': handoff.RESTARTING_MESSAGE}]
+
+
+def test_slash_replies_keep_embeds_and_allowed_mentions():
+    http = FakeHTTP()
+    payload = interaction('say', [])['d']
+    ctx = slash.SlashContext(
+        types.SimpleNamespace(allowed_mentions=None), slash.Interaction(http, payload),
+        message=types.SimpleNamespace(_state=None))
+
+    async def scenario():
+        await ctx.send('@everyone', embed=discord.Embed(title='Players'),
+                       allowed_mentions=discord.AllowedMentions.none())
+        with pytest.raises(TypeError):
+            await ctx.send('hi', delete_after=5)
+
+    run(scenario())
+
+    assert http.requests == [('PATCH', '/webhooks/{application_id}/{token}/messages/@original', {
+        'content': '@everyone', 'embeds': [{'type': 'rich', 'title': 'Players'}],
+        'allowed_mentions': {'parse': []}})]
@@ -0,0 +1,77 @@
+import socket
+import types
+
+import pytest
+
+from mcadminbot.bot import servers
+from mcadminbot.bot import utils
+from tests.fakercon import FakeRCONServer, run
+
+
+@pytest.fixture
+def local_config(loaded_config):
+    loaded_config.update(server_address='127.0.0.1', rcon_password='secret', rcon_timeout=1)
+    return loaded_config
+
+
+def _unused_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_rcon_broadcast_reports_each_server(local_config):
+    ctx = types.SimpleNamespace()
+
+    async def scenario():
+        server = FakeRCONServer('secret')
+        port = await server.start()
+        local_config['servers'] = {
+            'survival': {'rcon_port': port},
+            'creative': {'rcon_port': _unused_port()},
+        }
+        servers.load_servers()
+        try:
+            return await utils.rcon_command('ban Griefer', servers.ALL_SERVERS, ctx=ctx)
+        finally:
+            await servers.close_servers()
+            await server.stop()
+
+    assert run(scenario()).split('\n') == [
+        'Succeeded on 1/2 servers',
+        '[survival] OK: ran ban Griefer',
+        '[creative] FAILED: The RCON server is unreachable.',
+    ]
+    assert ctx.rcon_outcome == 'failed'
+
+
+def test_rejected_command_outcome(local_config):
+    ctx = types.SimpleNamespace()
+
+    async def scenario():
+        server = FakeRCONServer('secret')
+        server.respond = lambda command: 'That player does not exist'
+        local_config['rcon_port'] = await server.start()
+        servers.load_servers()
+        try:
+            return await utils.rcon_command('pardon Nobody', ctx=ctx)
+        finally:
+            await servers.close_servers()
+            await server.stop()
+
+    assert run(scenario()) == 'That player does not exist'
+    assert ctx.rcon_outcome == 'rejected'
+
+
+def test_split_message_prefers_separators():
+    names = ', '.join(f"player{index:04}" for index in range(500))
+    pieces = list(utils.split_message(names, limit=100))
+
+    assert ''.join(pieces) == names
+    assert all(len(piece) <= 100 for piece in pieces)
+    assert all(piece.endswith(', ') for piece in pieces[:-1])
+
+
+def test_split_message_without_separators():
+    assert list(utils.split_message('x' * 250, limit=100)) == ['x' * 100, 'x' * 100, 'x' * 50]
+    assert list(utils.split_message('')) == []